@@ -1,10 +1,24 @@
-from flask import Flask, jsonify, render_template
-import psycopg2
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
+import itertools
 import os
+import queue
+import sys
 from dotenv import load_dotenv
 import logging
 from psycopg2.extras import RealDictCursor
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "data_processing"))
+import db
+from db import execute_prepared
+from grid_cells import lookup_cell
+from grid_stats import read_coverage, read_grid_stats
+from heatmap import latest_period, read_heatmap
+from live_events import EventHub, format_event
+from log_tail import follow, parse_cursor, read_since, tail
+from response_cache import ResponseCache
+from hourly_batch import VARIABLE_COLUMNS
+from series_stream import FORMATS, encode_rows, keyset_sql, parse_time, stream_rows
+
 # 加载环境变量
 load_dotenv()
 
@@ -14,24 +28,21 @@ app.config['JSON_AS_ASCII'] = False # 禁用 ASCII 转义，支持中文显示
 # 配置日志记录
 logging.basicConfig(level=logging.INFO)
 
-# 数据库配置
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
+# 数据库连接池 (配置见 scripts/data_processing/db.py)：每个请求借用一个连接，请求结束时自动归还
+db.init_app(app, cursor_factory=RealDictCursor)
+
+FETCH_LOG = "batch_fetch.log"
+SSE_HEARTBEAT_SECONDS = 15
+
+# 只读接口的响应缓存 (ETag / 304)，以加载器维护的数据版本号失效
+response_cache = ResponseCache()
+
+# 看板推送：进程内唯一的生产者 (LISTEN grid_ingest + 跟踪爬取日志)，每个 SSE 客户端一个队列
+event_hub = EventHub(log_path=FETCH_LOG, on_ingest=response_cache.expire_version)
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            cursor_factory=RealDictCursor
-        )
-        return conn
+        return db.request_connection()
     except Exception as e:
         app.logger.error(f"Error connecting to database: {e}")
         return None
@@ -44,24 +55,66 @@ def index():
 def test_page():
     return render_template('test_db.html')
 
+def series_args():
+    """
+    时间序列接口的公共参数：after (上一页最后一行的时间)、start、end、limit、format。
+    没有 format 参数时按 Accept 头选择，缺省为 JSON 数组 (与原接口一致)，NDJSON / CSV 需显式请求。
+    """
+    limit = request.args.get('limit')
+    fmt = request.args.get('format')
+    if fmt is None:
+        mimetypes = {mimetype: name for name, mimetype in FORMATS.items()}
+        fmt = mimetypes[request.accept_mimetypes.best_match(list(mimetypes), default=FORMATS['json'])]
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return {
+        "after": parse_time(request.args.get('after'), 'after'),
+        "start": parse_time(request.args.get('start'), 'start'),
+        "end": parse_time(request.args.get('end'), 'end'),
+        "limit": int(limit) if limit else None,
+    }, fmt
+
+def stream_series(conn, sql, params, columns, fmt, headers=None, envelope=None):
+    """
+    以服务器端游标逐批读取并流式输出。第一批在返回响应前读取，查询出错时仍能返回 500；
+    stream_with_context 让请求上下文 (以及借用的连接) 保持到最后一批写完。
+    envelope 为 JSON 格式时包在行数组外的 (前缀, 后缀)。
+    """
+    batches = stream_rows(conn, sql, params)
+    first = next(batches, None)
+    if first is not None:
+        batches = itertools.chain([first], batches)
+    chunks = encode_rows(batches, columns, fmt)
+    if fmt == "json" and envelope:
+        chunks = itertools.chain([envelope[0]], chunks, [envelope[1]])
+    return Response(stream_with_context(chunks), mimetype=FORMATS[fmt], headers=headers)
+
+WEATHER_COLUMNS = ["timestamp", "temperature", "humidity", "wind_speed"]
+
 @app.route('/api/weather')
 def get_weather():
+    """
+    weather_samples 的时间序列，按时间升序流式输出 (默认 JSON 数组，format=ndjson|csv 或 Accept 头选择其他格式)。
+    分页：?limit=N 取一页，下一页传 after=<本页最后一行的 timestamp>。
+    """
+    try:
+        args, fmt = series_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Database connection failed"}), 500
     
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM weather_samples ORDER BY timestamp ASC")
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return jsonify(rows)
+        sql, params = keyset_sql("weather_samples", WEATHER_COLUMNS, **args)
+        return stream_series(conn, sql, params, WEATHER_COLUMNS, fmt)
     except Exception as e:
         app.logger.error(f"Error querying database: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/grid_recent')
+@response_cache.cached(get_db_connection)
 def get_grid_recent():
     """获取最新的网格化天气数据（最近50条）。"""
     conn = get_db_connection()
@@ -73,20 +126,20 @@ def get_grid_recent():
         # 获取最近插入的数据 (按 id 倒序)
         # 使用 id 而不是 timestamp，因为 timestamp 可能是历史时间，
         # 而 id 是自增的，更能代表"最近抓取"的数据
-        cur.execute("""
+        execute_prepared(cur, "grid_recent", """
             SELECT * FROM grid_weather_data 
             ORDER BY id DESC 
             LIMIT 50
         """)
         rows = cur.fetchall()
         cur.close()
-        conn.close()
         return jsonify(rows)
     except Exception as e:
         app.logger.error(f"Error querying recent grid data: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/grid_stats')
+@response_cache.cached(get_db_connection)
 def get_grid_stats():
     """获取网格化数据的统计信息。"""
     conn = get_db_connection()
@@ -94,33 +147,51 @@ def get_grid_stats():
         return jsonify({"error": "Database connection failed"}), 500
     
     try:
-        cur = conn.cursor()
-        # 获取记录总数
-        cur.execute("SELECT COUNT(*) as count FROM grid_weather_data")
-        total_count = cur.fetchone()['count']
-        
-        # 获取数据时间范围
-        cur.execute("SELECT MIN(timestamp) as min_date, MAX(timestamp) as max_date FROM grid_weather_data")
-        date_range = cur.fetchone()
-        
-        # 获取覆盖的网格点数量
-        cur.execute("SELECT COUNT(DISTINCT (latitude, longitude)) as grid_count FROM grid_weather_data")
-        grid_count = cur.fetchone()['grid_count']
-        
-        cur.close()
-        conn.close()
-        
-        return jsonify({
-            "total_records": total_count,
-            "min_date": date_range['min_date'],
-            "max_date": date_range['max_date'],
-            "grid_points": grid_count
-        })
+        # 读取加载器增量维护的 grid_stats (几十行)，不扫描小时表
+        return jsonify(read_grid_stats(conn))
     except Exception as e:
         app.logger.error(f"Error querying grid stats: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/grid_series')
+def get_grid_series():
+    """
+    获取单个网格点的小时序列：?lat=&lon=[&start=&end=&after=&limit=&format=json|ndjson|csv]
+    与 /api/weather 相同的键集分页和流式输出；解析到的网格单元放在 X-Cell-Id 响应头中。
+    JSON 格式保持原来的 {"cell_id", "rows"} 结构和行数上限 (默认 1000，最多 10000)。
+    """
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required numbers"}), 400
+    try:
+        args, fmt = series_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fmt == "json":
+        # 整个数组由客户端一次解析，沿用原接口的行数上限
+        args["limit"] = min(args["limit"] or 1000, 10000)
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection failed"}), 500
+
+    try:
+        # 坐标只在这里解析一次，之后是 (cell_id, timestamp) 上的等值 + 范围查找
+        cell_id = lookup_cell(conn, lat, lon)
+        if cell_id is None:
+            return jsonify({"error": f"No grid cell near ({lat}, {lon})"}), 404
+        columns = ["timestamp"] + list(VARIABLE_COLUMNS.values())
+        sql, params = keyset_sql("grid_weather_data", columns, filters=[("cell_id = %s", cell_id)], **args)
+        return stream_series(conn, sql, params, columns, fmt, headers={"X-Cell-Id": str(cell_id)},
+                             envelope=(f'{{"cell_id": {cell_id}, "rows": ', "}"))
+    except Exception as e:
+        app.logger.error(f"Error querying grid series: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/coverage_stats')
+@response_cache.cached(get_db_connection)
 def get_coverage_stats():
     """获取按年份分组的数据覆盖情况。"""
     conn = get_db_connection()
@@ -128,38 +199,95 @@ def get_coverage_stats():
         return jsonify({"error": "Database connection failed"}), 500
     
     try:
-        cur = conn.cursor()
-        # 按年份统计记录数
-        cur.execute("""
-            SELECT 
-                extract(year from timestamp)::int as year, 
-                count(*) as count 
-            FROM grid_weather_data 
-            GROUP BY year 
-            ORDER BY year ASC
-        """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return jsonify(rows)
+        # 每年的记录数来自 grid_stats，与 /api/grid_stats 同源
+        return jsonify(read_coverage(conn))
     except Exception as e:
         app.logger.error(f"Error querying coverage stats: {e}")
         return jsonify({"error": str(e)}), 500
 
-from collections import deque
+@app.route('/api/heatmap_data')
+@response_cache.cached(get_db_connection)
+def get_heatmap_data():
+    """
+    全区域热力图：?variable=temperature_mean&period=YYYY|YYYY-MM|YYYY-MM-DD
+    读取预先汇总的日/月值 (一次按期间的索引读取)，返回稠密数组和网格元数据；period 缺省为最近一个月。
+    """
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection failed"}), 500
+
+    try:
+        period = request.args.get('period') or latest_period(conn)
+        if period is None:
+            return jsonify({"error": "No rollup data yet"}), 404
+        try:
+            return jsonify(read_heatmap(conn, request.args.get('variable', 'temperature_mean'), period))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error querying heatmap data: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/events')
+def live_events():
+    """
+    看板的 Server-Sent Events 通道：ingest (新行数与按年增量)、recent (最新行)、log (日志新增行)。
+    不借用数据库连接，所有客户端共享同一个生产者；空闲时定期发送注释行保持连接。
+    """
+    q = event_hub.subscribe()
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            event_hub.unsubscribe(q)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/api/fetch_log')
 def get_fetch_log():
-    """获取数据爬取日志的最后几行。"""
-    log_file = "batch_fetch.log"
-    if not os.path.exists(log_file):
-        return jsonify({"log": "Log file not found."})
-        
+    """
+    爬取日志：无 cursor 时返回最后 lines 行 (默认 20，从文件末尾向前查找)；
+    带上次返回的 cursor 时只返回之后新增的行。follow=1 时以 Server-Sent Events 持续推送新行。
+    """
+    cursor = request.args.get('cursor') or None
+    try:
+        lines_wanted = min(int(request.args.get('lines', 20)), 1000)
+        if cursor is not None:
+            parse_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if request.args.get('follow'):
+        def stream():
+            idle = 0
+            for lines, next_cursor in follow(FETCH_LOG, cursor, n=lines_wanted):
+                if lines:
+                    idle = 0
+                    yield format_event("log", {"lines": lines, "cursor": next_cursor})
+                else:
+                    idle += 1
+                    if idle >= SSE_HEARTBEAT_SECONDS:
+                        idle = 0
+                        yield ": keepalive\n\n"
+
+        return Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
     try:
-        # 使用 deque 提高大文件读取效率
-        with open(log_file, "r", encoding="utf-8", errors='replace') as f:
-            last_lines = deque(f, 20)
-            return jsonify({"log": "".join(last_lines)})
+        if cursor is None:
+            lines, cursor = tail(FETCH_LOG, lines_wanted)
+            if cursor is None:
+                return jsonify({"log": "Log file not found."})
+        else:
+            lines, cursor = read_since(FETCH_LOG, cursor)
+        return jsonify({"log": "".join(line + "\n" for line in lines), "cursor": cursor})
     except Exception as e:
         app.logger.error(f"Error reading log file: {e}")
         return jsonify({"error": str(e)}), 500
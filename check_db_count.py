@@ -1,23 +1,14 @@
-import psycopg2
 import os
+import sys
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "data_processing"))
+from db import connect
 
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
+load_dotenv()
 
 try:
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
+    conn = connect()
     cur = conn.cursor()
     cur.execute("SELECT count(*) FROM grid_weather_data")
     count = cur.fetchone()[0]
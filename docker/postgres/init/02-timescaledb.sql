@@ -0,0 +1,8 @@
+-- Enable TimescaleDB when the image ships it (POSTGRES_IMAGE=timescale/timescaledb:*);
+-- a no-op on the plain postgres image
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb') THEN
+        CREATE EXTENSION IF NOT EXISTS timescaledb;
+    END IF;
+END $$;
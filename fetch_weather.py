@@ -1,11 +1,15 @@
 import os
+import sys
 import requests
-import psycopg2
-from psycopg2.extras import execute_values
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
 
+# 共享的数据处理模块位于 scripts/data_processing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "data_processing"))
+from db import connect
+from grid_loader import WeatherSamplesLoader
+
 # 配置日志记录
 logging.basicConfig(
     level=logging.INFO,
@@ -19,23 +23,10 @@ logging.basicConfig(
 # 加载环境变量
 load_dotenv()
 
-# 数据库配置
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-
 def get_db_connection():
     """建立与 PostgreSQL 数据库的连接。"""
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         return conn
     except Exception as e:
         logging.error(f"Error connecting to database: {e}")
@@ -110,21 +101,9 @@ def process_and_store_data(conn, data):
             wind = winds[i]
             records.append((t, temp, hum, wind))
         
-        # 使用 execute_values 进行批量插入
-        insert_query = """
-        INSERT INTO weather_samples (timestamp, temperature, humidity, wind_speed)
-        VALUES %s
-        ON CONFLICT (timestamp) DO UPDATE SET
-            temperature = EXCLUDED.temperature,
-            humidity = EXCLUDED.humidity,
-            wind_speed = EXCLUDED.wind_speed;
-        """
-        
-        cur = conn.cursor()
-        execute_values(cur, insert_query, records)
-        conn.commit()
-        logging.info(f"Successfully inserted/updated {len(records)} records.")
-        cur.close()
+        # 通过 COPY -> 暂存表 -> 合并 的方式批量写入 (按 timestamp upsert)
+        affected = WeatherSamplesLoader(conn).load(records)
+        logging.info(f"Successfully inserted/updated {affected} records.")
         
     except Exception as e:
         logging.error(f"Error processing/storing data: {e}")
@@ -1,19 +1,17 @@
-import psycopg2
 import os
+import sys
 from dotenv import load_dotenv
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_processing"))
+from db import connect
+from year_partitions import year_counts_sql
+
 load_dotenv()
 
 def check_radiation_stats():
     try:
-        conn = psycopg2.connect(
-            host=os.getenv('POSTGRES_HOST', 'localhost'),
-            port=os.getenv('POSTGRES_PORT', '5432'),
-            user=os.getenv('POSTGRES_USER', 'admin'),
-            password=os.getenv('POSTGRES_PASSWORD', 'secure_password_dev'),
-            dbname=os.getenv('POSTGRES_DB', 'gra_env_db')
-        )
+        conn = connect()
         
         # 1. 检查总行数
         cur = conn.cursor()
@@ -48,16 +46,11 @@ def check_radiation_stats():
         
         # 6. 按年份统计缺失率
         print("\n--- Missing Radiation by Year ---")
-        cur.execute("""
-            SELECT 
-                extract(year from timestamp) as year,
+        cur.execute(year_counts_sql("""
                 count(*) as total,
                 count(shortwave_radiation) as non_null_rad,
                 sum(case when shortwave_radiation is null then 1 else 0 end) as null_rad
-            FROM grid_weather_data
-            GROUP BY 1
-            ORDER BY 1;
-        """)
+        """))
         rows = cur.fetchall()
         for row in rows:
             print(f"Year {int(row[0])}: Total {row[1]}, Null Rad {row[3]}")
@@ -1,256 +1,70 @@
 import os
-import requests
-import psycopg2
-from psycopg2.extras import execute_values
+import asyncio
 from datetime import datetime
 import logging
+from logging.handlers import WatchedFileHandler
 from dotenv import load_dotenv
 import pandas as pd
 import time
-import openmeteo_requests
 import requests_cache
 from retry_requests import retry
-import json
 import sys
+import threading
 from tqdm import tqdm
+from db import connect
+from rate_limiter import RateLimiter
+from hourly_batch import HOURLY_VARIABLES, responses_to_batch
+from grid_loader import GridWeatherLoader
+from ingest_manifest import create_manifest_table, incomplete_years
+from grid_cells import check_hourly_cells, create_grid_cell_table
+from timescale_storage import ensure_storage
+from year_partitions import ensure_partitions
+from rollups import create_rollup_tables
+from grid_stats import create_stats_table
+from data_version import create_version_table
+from fetch_request import FetchRequest
+from request_packer import MAX_YEARS_PER_REQUEST, AdaptiveBudget, year_spans, years_for
+from response_archive import OPEN_METEO_ARCHIVE_URL, default_archive, parse_flatbuffers
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from clash_controller import ClashController, HTTP_PROXY_URL
+from proxy_pool import ProxyPool, ProxyWorker, quota_cooldown, switch_and_settle
+from fetch_jobs import (DEFAULT_LEASE_SECONDS, create_jobs_table, seed_jobs, claim_job, renew_lease, finish_job,
+                        reset_failed_jobs, log_job_summary, default_worker_id)
 
 # --- 强制配置日志，确保在所有操作前生效 ---
+# 多个抓取进程 (--worker-id) 以追加方式写同一个 batch_fetch.log，进程内不做轮转
+# (各进程各自轮转会丢行或写进已改名的文件)。轮转交给外部 logrotate (改名后新建，不要用 copytruncate)，
+# WatchedFileHandler 发现 inode 变化后重新打开；网页看板的尾部读取会跟随轮转 (见 log_tail)
 log_path = os.path.join(os.getcwd(), "batch_fetch.log")
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(log_path, mode='a', encoding='utf-8'),
+        WatchedFileHandler(log_path, encoding='utf-8'),
         logging.StreamHandler(sys.stdout)
     ]
 )
 logging.info(f"日志系统启动，路径: {log_path}")
 
 # --- Clash API & Proxy 配置 ---
-# 配置更新时间: 2026-02-19 (根据用户本地 config.yaml 自动校准)
-# 优先从环境变量读取（用于隔离模式），否则使用默认值
-CLASH_API_URL = os.getenv("CLASH_API_URL", "http://127.0.0.1:10380")
-CLASH_SECRET = os.getenv("CLASH_SECRET", "44976f0a-414c-48b1-bda7-5759fef634d3")
-PROXY_GROUP_NAME = "猫猫云" 
-HTTP_PROXY_URL = os.getenv("HTTP_PROXY", "http://127.0.0.1:7890") 
+# Clash 控制器在第一次需要换节点时才创建，导入本模块不会访问 Clash API
+_clash = None
 
-class ClashController:
-    def __init__(self):
-        # 自动从配置文件读取配置
-        self.api_url = CLASH_API_URL
-        self.secret = CLASH_SECRET
-        self._try_load_from_config()
-        
-        self.headers = {"Authorization": f"Bearer {self.secret}"} if self.secret else {}
-        self.available_nodes = []
-        self.current_node_idx = 0
-        
-        # 优先使用配置的端口，如果连不上再探测
-        if not self._check_current_port():
-             self._auto_detect_port()
-        self._init_nodes()
-
-    def _try_load_from_config(self):
-        """尝试从 Clash 配置文件自动读取端口和密钥"""
-        # 如果环境变量已指定，则优先使用环境变量，不再读取文件
-        if os.environ.get("CLASH_API_URL"):
-            logging.info(f"使用环境变量指定的 Clash API: {self.api_url}")
-            return
-
-        try:
-            user_home = os.path.expanduser("~")
-            config_path = os.path.join(user_home, ".config", "clash", "config.yaml")
-            
-            if os.path.exists(config_path):
-                logging.info(f"发现 Clash 配置文件: {config_path}")
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    import yaml
-                    config = yaml.safe_load(f)
-                    
-                    # 读取 external-controller
-                    if 'external-controller' in config:
-                        controller = config['external-controller']
-                        # 处理可能是 0.0.0.0 的情况，替换为 127.0.0.1
-                        if controller.startswith(':'):
-                            controller = f"127.0.0.1{controller}"
-                        elif controller.startswith('0.0.0.0:'):
-                            controller = controller.replace('0.0.0.0:', '127.0.0.1:')
-                        
-                        # 确保有 http 前缀
-                        if not controller.startswith('http'):
-                            self.api_url = f"http://{controller}"
-                        else:
-                            self.api_url = controller
-                        logging.info(f"  -> 自动读取到 API 地址: {self.api_url}")
-                        
-                    # 读取 secret
-                    if 'secret' in config:
-                        self.secret = config['secret']
-                        logging.info(f"  -> 自动读取到 API 密钥: {self.secret[:3]}***{self.secret[-3:]}")
-        except Exception as e:
-            logging.warning(f"尝试读取 Clash 配置文件失败: {e} (将使用默认配置)")
-
-    def _check_current_port(self):
-        """检查当前配置的端口是否可用"""
-        try:
-            resp = requests.get(f"{self.api_url}/version", headers=self.headers, timeout=1)
-            if resp.status_code == 200:
-                logging.info(f"Clash API 连接成功: {self.api_url}")
-                return True
-        except:
-            pass
-        return False
-
-    def _auto_detect_port(self):
-        """自动探测 Clash API 端口"""
-        common_ports = [3936, 9090, 7342, 5492, 10380, 9097, 7890, 6821, 12531, 12280] # 优先尝试已知端口
-        current_port = int(self.api_url.split(':')[-1])
-        if current_port not in common_ports:
-            common_ports.insert(0, current_port)
-            
-        for port in common_ports:
-            test_url = f"http://127.0.0.1:{port}"
-            try:
-                resp = requests.get(f"{test_url}/version", headers=self.headers, timeout=1)
-                if resp.status_code == 200:
-                    self.api_url = test_url
-                    logging.info(f"成功探测到 Clash API 运行在端口: {port}")
-                    return
-                elif resp.status_code == 401:
-                    self.api_url = test_url
-                    logging.warning(f"🎯 找到 API 端口 {port}，但提示 'Unauthorized'。请在 CLASH_SECRET 中填入密钥。")
-                    return
-            except requests.exceptions.ConnectionError:
-                continue
-            except Exception as e:
-                logging.debug(f"探测端口 {port} 时发生意外错误: {e}")
-                continue
-        
-        logging.error("❌ 无法连接到 Clash API。请确保：\n"
-                      "1. Clash for Windows 已启动\n"
-                      "2. 在 [General] -> [External Control] 查看真实的端口并更新 CLASH_API_URL\n"
-                      "3. 如果设置了 Secret，请确保 CLASH_SECRET 已正确填写")
-
-    def _init_nodes(self):
-        try:
-            resp = requests.get(f"{self.api_url}/proxies", headers=self.headers, timeout=5)
-            if resp.status_code == 200:
-                proxies = resp.json()["proxies"]
-                if PROXY_GROUP_NAME in proxies:
-                    self.available_nodes = proxies[PROXY_GROUP_NAME]["all"]
-                    # 排除特殊节点和策略组名
-                    exclude_names = ["DIRECT", "REJECT", "GLOBAL", "故障转移", "负载均衡", "自动选择", "猫猫云"]
-                    self.available_nodes = [n for n in self.available_nodes if n not in exclude_names]
-                    logging.info(f"成功加载 {len(self.available_nodes)} 个可切换节点。")
-                else:
-                    logging.error(f"未找到代理组 '{PROXY_GROUP_NAME}'，请检查 Clash 配置中的组名是否为 '{PROXY_GROUP_NAME}'。")
-            elif resp.status_code == 401:
-                logging.error("❌ Clash API 认证失败 (401)。请务必在脚本顶部的 CLASH_SECRET 中填写正确的密钥。")
-            else:
-                logging.error(f"获取 Clash 代理列表失败，状态码: {resp.status_code}, 响应: {resp.text}")
-        except Exception as e:
-            logging.error(f"初始化 Clash 节点失败: {e}")
-
-    def switch_to_next(self):
-        if not self.available_nodes:
-            return False
-        
-        # 随机选择一个节点，避免按顺序遇到连片失效的节点
-        import random
-        node_name = random.choice(self.available_nodes)
-        
-        try:
-            url = f"{self.api_url}/proxies/{PROXY_GROUP_NAME}"
-            payload = {"name": node_name}
-            resp = requests.put(url, headers=self.headers, data=json.dumps(payload), timeout=5)
-            if resp.status_code == 204:
-                logging.info(f">>> 随机切换节点成功: {node_name}")
-                return True
-        except Exception as e:
-            logging.error(f"切换节点出错: {e}")
-        return False
-
-clash = ClashController()
+def get_clash():
+    global _clash
+    if _clash is None:
+        _clash = ClashController()
+    return _clash
 
 # ----------------------------
 
-STATE_FILE = "fetch_progress.json"
-
-def load_progress():
-    """Load the last processed index from the state file."""
-    if os.path.exists(STATE_FILE):
-        try:
-            with open(STATE_FILE, 'r') as f:
-                data = json.load(f)
-                return data.get('next_start_index', 0)
-        except Exception as e:
-            logging.warning(f"Failed to load progress file: {e}")
-            return 0
-    return 0
-
-def save_progress(index):
-    """Save the current progress index to the state file."""
-    try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump({'next_start_index': index}, f)
-    except Exception as e:
-        logging.warning(f"Failed to save progress: {e}")
-
 # Load environment variables
 load_dotenv()
 
-# Database configuration
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-
-def check_if_data_exists(conn, lat, lon, year):
-    """
-    Check if data for a specific year and location already exists in the database.
-    Optimized to use index on latitude, longitude and timestamp.
-    Now checks for COMPLETENESS (>8000 records) instead of just existence to fix partial data issues.
-    """
-    try:
-        cur = conn.cursor()
-        query = """
-        SELECT count(*)
-        FROM grid_weather_data 
-        WHERE latitude BETWEEN %s - 0.1 AND %s + 0.1
-          AND longitude BETWEEN %s - 0.1 AND %s + 0.1
-          AND timestamp >= %s AND timestamp <= %s;
-        """
-        # Create datetime objects for range query to utilize index
-        start_date = datetime(year, 1, 1)
-        end_date = datetime(year, 12, 31, 23, 59, 59)
-        
-        cur.execute(query, (lat, lat, lon, lon, start_date, end_date))
-        count = cur.fetchone()[0]
-        cur.close()
-        
-        # Consider complete if we have more than 8000 records (leap year is 8784, normal 8760)
-        # This handles the case where we have partial data (e.g. only 8 records)
-        if count > 0 and count <= 8000:
-             logging.info(f"  [PARTIAL DATA DETECTED] Year {year} has only {count} records. Will re-fetch.")
-             return False
-             
-        return count > 8000
-    except Exception as e:
-        # Don't fail the whole process, just assume not exists to be safe
-        logging.warning(f"Error checking existing data: {e}")
-        return False
-
 def get_db_connection():
     """Establish a connection to the PostgreSQL database."""
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         return conn
     except Exception as e:
         logging.error(f"Error connecting to database: {e}")
@@ -261,6 +75,7 @@ def create_grid_table(conn):
     create_table_query = """
     CREATE TABLE IF NOT EXISTS grid_weather_data (
         id SERIAL PRIMARY KEY,
+        cell_id INTEGER NOT NULL,
         latitude FLOAT NOT NULL,
         longitude FLOAT NOT NULL,
         timestamp TIMESTAMP NOT NULL,
@@ -271,11 +86,13 @@ def create_grid_table(conn):
         relative_humidity_2m FLOAT,
         wind_speed_10m FLOAT,
         shortwave_radiation FLOAT,
-        UNIQUE (latitude, longitude, timestamp)
+        UNIQUE (cell_id, timestamp)
     );
     """
     try:
         cur = conn.cursor()
+        # 网格单元维表，小时表以 (cell_id, timestamp) 为唯一键
+        create_grid_cell_table(cur)
         cur.execute(create_table_query)
         # 检查是否需要添加新列（如果表已存在但缺少新变量）
         new_columns = [
@@ -293,208 +110,205 @@ def create_grid_table(conn):
                     END IF;
                 END $$;
             """)
+        # 入库完整性清单、日/月汇总、按年计数与数据版本号，由加载器在写入的同一事务中维护
+        create_manifest_table(cur)
+        create_rollup_tables(cur)
+        create_version_table(cur)
+        create_stats_table(cur)
+        # 抓取作业表 (chunk × 年份)，替代 fetch_progress.json 断点文件
+        create_jobs_table(cur)
+        # 旧表结构需要先显式迁移 (grid_cells.py migrate)，不在这里执行全表更新
+        check_hourly_cells(cur)
         conn.commit()
-        logging.info("Table 'grid_weather_data' checked/updated successfully.")
         cur.close()
+        # GRID_STORAGE=timescaledb 时转为压缩的 hypertable，=partitioned 时按年分区
+        ensure_storage(conn)
+        ensure_partitions(conn, range(START_YEAR, END_YEAR + 1))
+        logging.info("Table 'grid_weather_data' checked/updated successfully.")
     except Exception as e:
         logging.error(f"Error creating/updating table: {e}")
         conn.rollback()
         raise
 
-def fetch_grid_data(grid_points):
-    """
-    Fetch historical weather data for multiple grid points using Open-Meteo API.
-    
-    Args:
-        grid_points (pd.DataFrame): DataFrame containing 'latitude' and 'longitude'.
-    """
-    # Setup the Open-Meteo API client with cache and retry on error
+START_YEAR = 1990
+END_YEAR = 2023
+CHUNK_SIZE = 10
+
+def create_openmeteo_session(proxy_url=None):
+    """Create a cached, retrying requests session routed through a Clash proxy port."""
     cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+    proxy_url = proxy_url or HTTP_PROXY_URL
     
     # 强制让 requests 走 Clash 代理端口，不依赖系统全局代理设置
     cache_session.proxies = {
-        "http": HTTP_PROXY_URL,
-        "https": HTTP_PROXY_URL
+        "http": proxy_url,
+        "https": proxy_url
     }
     
-    retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-    openmeteo = openmeteo_requests.Client(session = retry_session)
+    return retry(cache_session, retries = 5, backoff_factor = 0.2)
+
+def fetch_responses(session, request, archive=None):
+    """
+    Request `request` from the Open-Meteo archive API and parse the FlatBuffers body.
+    The raw body is stored in `archive` (if given) before it is returned.
+    """
+    params = request.params()
+    params["format"] = "flatbuffers"
+    response = session.get(OPEN_METEO_ARCHIVE_URL, params=params)
+    if response.status_code in (400, 429):
+        raise OpenMeteoRequestsError(f"{response.status_code} {response.json()}")
+    response.raise_for_status()
+    content = response.content
+    responses = parse_flatbuffers(content)
+    if archive is not None:
+        archive.put(request, content)
+    return responses
+
+def is_quota_error(error_msg):
+    return "request limit exceeded" in error_msg or "429" in error_msg
 
-    url = "https://archive-api.open-meteo.com/v1/archive"
+def drop_proxy_connections(session):
+    """
+    Close pooled keep-alive connections so the next request opens a new tunnel
+    through the newly selected Clash node instead of reusing the old one.
+    """
+    for adapter in session.adapters.values():
+        adapter.close()
+
+def rotate_proxy_node(proxies, error_msg=""):
+    """
+    Mark the current Clash node as throttled for the exhausted quota window and
+    switch to the best-scored other node (probed before switching).
+    Returns True if the switch succeeded.
+    """
+    clash = get_clash()
+    clash.mark_throttled(quota_cooldown(error_msg))
+    return switch_and_settle(clash, proxies) is not None
+
+def default_proxy_pool():
+    """
+    The proxy pool for async fetching: PROXY_WORKERS if set, otherwise a single
+    worker on HTTP_PROXY_URL controlled by the auto-detected Clash instance.
+    """
+    pool = ProxyPool.from_env()
+    if pool is None:
+        pool = ProxyPool([ProxyWorker("default", HTTP_PROXY_URL, get_clash())])
+    pool.spread_nodes()
+    return pool
+
+def seed_grid_jobs(conn, grid_points):
+    """Register one fetch job per (chunk, year) for the grid; existing jobs keep their state."""
+    years = [y for y in range(START_YEAR, END_YEAR + 1) if y <= datetime.now().year]
+    created = seed_jobs(conn, grid_points, years, CHUNK_SIZE)
+    if created:
+        logging.info(f"Registered {created} new fetch jobs.")
+    return log_job_summary(conn)
+
+def claim_next_requests(conn, worker_id, budget=None):
+    """
+    Claim the next run of consecutive-year jobs of one chunk, as many years as the
+    weight budget allows (one year without a budget). Years already complete in the
+    manifest are marked done without a request; the rest become one FetchRequest per
+    consecutive span, tagged (chunk_index, years). Returns [] when no work is left.
+    """
+    max_years = 1
+    if budget is not None:
+        max_years = years_for(budget.weight, CHUNK_SIZE, START_YEAR, MAX_YEARS_PER_REQUEST, len(HOURLY_VARIABLES))
+    while True:
+        job = claim_job(conn, worker_id, max_years=max_years)
+        if job is None:
+            return []
+        chunk_index, years, lats, lons = job
+        todo = incomplete_years(conn, lats, lons, years)
+        done = [y for y in years if y not in todo]
+        if done:
+            logging.info(f"  [SKIP] Chunk {chunk_index} year(s) {done} already complete for all points.")
+            finish_job(conn, chunk_index, done, worker_id, True)
+        if not todo:
+            continue
+        return [FetchRequest.for_years(zip(lats, lons), start, end, tag=(chunk_index, list(range(start, end + 1))))
+                for start, end in year_spans(todo)]
+
+def fetch_grid_data(grid_points, worker_id=None):
+    """
+    Fetch historical weather data for multiple grid points using Open-Meteo API.
+
+    Work is tracked in the fetch_jobs table at (chunk, year) granularity, so a restart
+    resumes at the next unfinished request and several processes can share the grid.
+    Consecutive years of a chunk are fetched in one request when the adaptive weight
+    budget allows it.
     
+    Args:
+        grid_points (pd.DataFrame): DataFrame containing 'latitude' and 'longitude'.
+        worker_id (str): Identifier recorded on claimed jobs (default: host:pid).
+    """
+    # Setup the Open-Meteo API client with cache and retry on error
+    retry_session = create_openmeteo_session()
+    archive = default_archive()
+    limiter = RateLimiter()
+    budget = AdaptiveBudget()
+    worker_id = worker_id or default_worker_id()
+
     # Process in chunks to avoid API limits (Open-Meteo accepts multiple points but keep it reasonable)
     # Increased chunk size to 10 for better efficiency
-    chunk_size = 10
-
     total_points = len(grid_points)
-    print(f"DEBUG: Optimized Chunk size is {chunk_size}, Total points: {total_points}")
-    
-    start_index = load_progress()
-    logging.info(f"Loaded progress: resuming from index {start_index}")
+    logging.debug(f"Chunk size {CHUNK_SIZE}, total points: {total_points}")
     
     conn = get_db_connection()
     create_grid_table(conn)
+    loader = GridWeatherLoader(conn)
+    summary = seed_grid_jobs(conn, grid_points)
     
     # Use tqdm for progress tracking
-    with tqdm(total=total_points, initial=start_index, desc="Processing Grid Points", unit="point") as pbar:
-        for i in range(start_index, total_points, chunk_size):
-            chunk = grid_points.iloc[i:i+chunk_size]
-            lats = chunk['latitude'].tolist()
-            lons = chunk['longitude'].tolist()
-            
-            chunk_idx = i//chunk_size + 1
-            total_chunks = (total_points-1)//chunk_size + 1
-            logging.info(f"Processing chunk {chunk_idx}/{total_chunks} ({len(chunk)} points)...")
-            
-            # Iterate by year to keep memory usage low and provide frequent feedback
-            start_year = 1990
-            end_year = 2023
-            
-            # 为了减轻单次请求负载，严格限制每次只请求 1 年的数据
-            for year in range(start_year, end_year + 1):
-                
-                # Skip future dates if we are in the current year (adjust logic if needed)
-                if year > datetime.now().year:
-                    break
-
-                # --- INTELLIGENT SKIP CHECK ---
-                # Check if we already have data for this chunk (checking the first point is sufficient as a proxy)
-                if check_if_data_exists(conn, lats[0], lons[0], year):
-                    logging.info(f"  [SKIP] Data for year {year} already exists in DB. Skipping...")
-                    continue
-                    
-                logging.info(f"  Fetching data for year {year}...")
-
-                params = {
-                    "latitude": lats,
-                    "longitude": lons,
-                    "start_date": f"{year}-01-01",
-                    "end_date": f"{year}-12-31",
-                    "hourly": [
-                        "temperature_2m", 
-                        "precipitation", 
-                        "et0_fao_evapotranspiration", 
-                        "soil_moisture_0_to_7cm",
-                        "relative_humidity_2m",
-                        "wind_speed_10m",
-                        "shortwave_radiation"
-                    ]
-                }
+    with tqdm(total=sum(summary.values()), initial=summary.get('done', 0), desc="Processing Jobs", unit="job") as pbar:
+        while True:
+            claimed = claim_next_requests(conn, worker_id, budget)
+            if not claimed:
+                break
+            for request in claimed:
+                chunk_index, years = request.tag
+                label = f"chunk {chunk_index} {years[0]}-{years[-1]}"
+                logging.info(f"  Fetching {label} ({len(request.points)} points, weight {request.weight:.0f})...")
                 
                 # Retry loop for API rate limits
                 max_retries = 5
                 retry_count = 0
                 success = False
+                last_error = None
                 
                 while retry_count < max_retries and not success:
                     try:
-                        responses = openmeteo_requests.Client(session = retry_session).weather_api(url, params=params)
-                        success = True # Mark as success if no exception
-                        
-                        all_records = []
+                        # 已归档的请求直接从磁盘读取，不消耗配额
+                        responses = archive.load(request) if archive else None
+                        if responses is None:
+                            # 按真实配额 (分钟/小时/天) 限速，代替固定的 sleep
+                            limiter.acquire_blocking(request.weight)
+                            started = time.monotonic()
+                            responses = fetch_responses(retry_session, request, archive)
+                            budget.on_success(time.monotonic() - started)
                         
-                        for j, response in enumerate(responses):
-                            lat = response.Latitude()
-                            lon = response.Longitude()
-                            
-                            # Process hourly data
-                            hourly = response.Hourly()
-                            hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-                            hourly_precipitation = hourly.Variables(1).ValuesAsNumpy()
-                            hourly_et0 = hourly.Variables(2).ValuesAsNumpy()
-                            hourly_soil_moisture = hourly.Variables(3).ValuesAsNumpy()
-                            hourly_humidity = hourly.Variables(4).ValuesAsNumpy()
-                            hourly_wind_speed = hourly.Variables(5).ValuesAsNumpy()
-                            hourly_radiation = hourly.Variables(6).ValuesAsNumpy()
-                            
-                            hourly_data = {"date": pd.date_range(
-                                start = pd.to_datetime(hourly.Time(), unit = "s", utc = True),
-                                end = pd.to_datetime(hourly.TimeEnd(), unit = "s", utc = True),
-                                freq = pd.Timedelta(seconds = hourly.Interval()),
-                                inclusive = "left"
-                            )}
-                            
-                            # Create DataFrame for easier handling
-                            df = pd.DataFrame(data = hourly_data)
-                            df["temperature"] = hourly_temperature_2m
-                            df["precipitation"] = hourly_precipitation
-                            df["et0"] = hourly_et0
-                            df["soil_moisture"] = hourly_soil_moisture
-                            df["humidity"] = hourly_humidity
-                            df["wind_speed"] = hourly_wind_speed
-                            df["radiation"] = hourly_radiation
-                            
-                            # Convert to list of tuples for DB insertion
-                            # Direct iteration to save memory
-                            for _, row in df.iterrows():
-                                all_records.append((
-                                    lat, 
-                                    lon, 
-                                    row['date'], 
-                                    float(row['temperature']), 
-                                    float(row['precipitation']), 
-                                    float(row['et0']), 
-                                    float(row['soil_moisture']),
-                                    float(row['humidity']),
-                                    float(row['wind_speed']),
-                                    float(row['radiation'])
-                                ))
+                        batch = responses_to_batch(responses, request.variables, request.points)
                         
-                        # Batch insert for this year
-                        if all_records:
-                            insert_query = """
-                            INSERT INTO grid_weather_data (
-                                latitude, longitude, timestamp, temperature, precipitation, 
-                                et0_fao_evapotranspiration, soil_moisture_0_to_7cm,
-                                relative_humidity_2m, wind_speed_10m, shortwave_radiation
-                            )
-                            VALUES %s
-                            ON CONFLICT (latitude, longitude, timestamp) DO NOTHING;
-                            """
-                            
-                            cur = conn.cursor()
-                            execute_values(cur, insert_query, all_records)
-                            conn.commit()
-                            cur.close()
-                            logging.info(f"  Inserted {len(all_records)} records for year {year} ({len(chunk)} points).")
-                        
-                        # Pause between years to stay under minutely rate limit (600/min)
-                        # 1 request per 1.2s = 50 requests per minute
-                        time.sleep(1.2)
+                        # Batch insert for this request
+                        if len(batch):
+                            inserted = loader.load(batch)
+                            logging.info(f"  Inserted {inserted}/{len(batch)} records for {label} ({len(request.points)} points).")
+                        success = True
 
                     except Exception as e:
+                        last_error = e
                         error_msg = str(e)
-                        if "request limit exceeded" in error_msg or "429" in error_msg:
+                        if is_quota_error(error_msg):
                             logging.warning(f"Quota limit reached (API Error: {error_msg}). Automatically switching Clash node...")
-                            
-                            # 如果是 Minutely 限制，额外等待一段时间，给 API 喘息的机会
-                            if "Minutely" in error_msg:
-                                logging.info("检测到每分钟频率限制，额外冷却 15 秒...")
-                                time.sleep(15)
+                            budget.on_quota_error()
 
-                            # 自动尝试切换到下一个节点
-                            if clash.switch_to_next():
-                                # 延长等待时间，让新节点链路完全打通
-                                wait_time = 15
-                                logging.info(f"等待 {wait_time} 秒让新节点链路稳定...")
-                                time.sleep(wait_time)
-                                
-                                # 验证新 IP
-                                try:
-                                    # 增加验证时的重试
-                                    for _ in range(3):
-                                        try:
-                                            new_ip = requests.get('https://api.ipify.org', proxies=cache_session.proxies, timeout=10).text
-                                            logging.info(f"新节点 IP 验证成功: {new_ip}")
-                                            break
-                                        except:
-                                            time.sleep(2)
-                                except:
-                                    logging.warning("无法验证新 IP，但将尝试继续。")
-                                
+                            # 切换到得分最高且未被限流的节点，无需额外等待
+                            if rotate_proxy_node(retry_session.proxies, error_msg):
+                                drop_proxy_connections(retry_session)
+                                # 新出口 IP 的配额重新计算
+                                limiter.reset()
                                 # 重置重试计数并立即继续循环
                                 retry_count = 0
-                                continue
                             else:
                                 # 如果自动切换失败，改为等待较长时间重试，而不是阻塞
                                 logging.error("自动切换节点失败！可能是没有可用节点或 Clash API 异常。")
@@ -502,34 +316,307 @@ def fetch_grid_data(grid_points):
                                 time.sleep(300)
                                 
                                 # 尝试重新初始化节点列表
-                                clash._init_nodes()
+                                get_clash()._init_nodes()
                                 
                                 retry_count += 1
-                                continue
+                            # 等待配额期间续租，避免作业被其他进程接管
+                            renew_lease(conn, chunk_index, years, worker_id)
+                            continue
                         else:
-                            logging.error(f"Error processing chunk {i} for year {year}: {e}")
+                            budget.on_error()
+                            logging.error(f"Error processing {label}: {e}")
                             break
-            
+                
                 if not success:
-                     logging.error(f"Failed to fetch data for year {year} after {max_retries} retries.")
-            
-            # Update progress bar
-            pbar.update(len(chunk))
-
-            # Brief pause between chunks
-            time.sleep(1)
-            
-            # Save progress to checkpoint file
-            save_progress(i + len(chunk))
+                     logging.error(f"Failed to fetch data for {label} after {retry_count + 1} attempt(s).")
+                finish_job(conn, chunk_index, years, worker_id, success, last_error)
+                
+                # Update progress bar
+                pbar.update(len(years))
 
+    log_job_summary(conn)
     conn.close()
     logging.info("Batch processing completed.")
 
+async def run_fetch_queue(requests_list, concurrency=4, on_done=None, max_retries=5, pool=None, budget=None,
+                          renew=None, renew_every=DEFAULT_LEASE_SECONDS / 3):
+    """
+    Run FetchRequest objects with up to `concurrency` requests in flight.
+
+    Requests are spread over the proxies of a ProxyPool. Each proxy has its own
+    RateLimiter bounded by the real minutely/hourly/daily quota, so a proxy that hits
+    a 429 switches node or cools down on its own while the others keep fetching.
+    A single writer task loads finished responses into the database while other
+    requests are still waiting on the network. Raw responses are kept in the
+    response archive, so requests that were fetched before are served from disk.
+    
+    Args:
+        requests_list (iterable[FetchRequest]): Work source, processed in order. It is
+            consumed lazily (at most `concurrency` requests ahead), so it may be a
+            generator that claims jobs from the database.
+        concurrency (int): Number of requests kept in flight (at least one per proxy).
+        on_done (callable): Called as on_done(request, ok) once a request is finished
+            (loaded, or given up after errors). Runs in a worker thread, so it may block
+            on the database without stalling the event loop.
+        max_retries (int): Attempts per request on quota errors.
+        pool (ProxyPool): Proxies to fetch through (default: default_proxy_pool()).
+        budget (AdaptiveBudget): Updated from the latency and 429s of every network
+            request; a generator source can read it to size the requests it yields.
+        renew (callable): Called as renew(requests) every `renew_every` seconds, in a
+            worker thread, with the requests taken from the source but not finished yet
+            (queued, waiting for a cooling proxy or quota, in flight or being written),
+            so their job leases do not expire while they wait.
+    """
+    on_done = on_done or (lambda request, ok: None)
+    pool = pool or default_proxy_pool()
+    n_slots = max(concurrency, len(pool))
+    logging.info(f"Fetching through {len(pool)} proxy worker(s) with {n_slots} request slot(s).")
+    
+    write_conn = get_db_connection()
+    create_grid_table(write_conn)
+    loader = GridWeatherLoader(write_conn)
+    archive = default_archive()
+    
+    work_queue = asyncio.Queue()
+    write_queue = asyncio.Queue(maxsize=n_slots * 2)
+    source = iter(requests_list)
+    # 已从来源取出、尚未结束的请求；它们的租约由 lease_keeper 定期续期
+    unfinished = {}
+    
+    async def finish(request, ok):
+        unfinished.pop(id(request), None)
+        await asyncio.to_thread(on_done, request, ok)
+    
+    async def feeder():
+        # 只预取少量请求，领取的作业不会在队列中积压
+        while True:
+            if work_queue.qsize() >= n_slots:
+                await asyncio.sleep(0.2)
+                continue
+            request = await asyncio.to_thread(next, source, None)
+            if request is None:
+                return
+            unfinished[id(request)] = request
+            work_queue.put_nowait(request)
+    
+    async def lease_keeper():
+        while True:
+            await asyncio.sleep(renew_every)
+            if unfinished:
+                try:
+                    await asyncio.to_thread(renew, list(unfinished.values()))
+                except Exception as e:
+                    logging.warning(f"Could not renew leases of {len(unfinished)} queued request(s): {e}")
+    
+    async def fetch_worker(proxy):
+        retry_session = create_openmeteo_session(proxy.proxy_url)
+        session_generation = proxy.generation
+        
+        async def handle(request):
+            nonlocal session_generation
+            if proxy.cooldown_remaining() > 0:
+                work_queue.put_nowait(request)
+                return
+            if proxy.generation != session_generation:
+                # 出口已换节点，丢弃仍连着旧节点的长连接
+                drop_proxy_connections(retry_session)
+                session_generation = proxy.generation
+            # 已归档的请求直接从磁盘读取，不占用出口配额
+            responses = await asyncio.to_thread(archive.load, request) if archive else None
+            if responses is None:
+                await proxy.limiter.acquire(request.weight)
+                logging.info(f"  [{proxy.name}] Fetching {request.describe()}...")
+            generation = proxy.generation
+            try:
+                if responses is None:
+                    started = time.monotonic()
+                    responses = await asyncio.to_thread(fetch_responses, retry_session, request, archive)
+                    if budget is not None:
+                        budget.on_success(time.monotonic() - started)
+                batch = responses_to_batch(responses, request.variables, request.points)
+            except Exception as e:
+                error_msg = str(e)
+                if not is_quota_error(error_msg):
+                    if budget is not None:
+                        budget.on_error()
+                    logging.error(f"Error processing {request.describe()}: {e}")
+                    await finish(request, False)
+                    return
+                if request.attempt + 1 >= max_retries:
+                    logging.error(f"Failed to fetch {request.describe()} after {max_retries} retries.")
+                    await finish(request, False)
+                    return
+                
+                logging.warning(f"[{proxy.name}] Quota limit reached (API Error: {error_msg}).")
+                if budget is not None:
+                    budget.on_quota_error()
+                await pool.on_quota_error(proxy, error_msg, generation)
+                # 请求放回队列，由其他出口 (或换节点后的本出口) 重试
+                request.attempt += 1
+                work_queue.put_nowait(request)
+                return
+            
+            proxy.requests_done += 1
+            await write_queue.put((request, batch))
+        
+        while True:
+            # 冷却中的出口不领取请求，让健康的出口继续消化队列
+            await proxy.wait_ready()
+            request = await work_queue.get()
+            try:
+                await handle(request)
+            except Exception as e:
+                # 任何意外错误只让这一个请求失败，协程继续处理队列，work_queue.join() 不会因此卡住
+                logging.error(f"[{proxy.name}] Unexpected error on {request.describe()}: {e!r}")
+                try:
+                    await finish(request, False)
+                except Exception as finish_error:
+                    logging.error(f"Could not mark {request.describe()} as failed: {finish_error!r}")
+            finally:
+                work_queue.task_done()
+    
+    async def db_writer():
+        while True:
+            item = await write_queue.get()
+            if item is None:
+                return
+            request, batch = item
+            ok = True
+            try:
+                if len(batch):
+                    inserted = await asyncio.to_thread(loader.load, batch)
+                    logging.info(f"  Inserted {inserted}/{len(batch)} records for {request.describe()}.")
+            except Exception as e:
+                logging.error(f"Error inserting {request.describe()}: {e}")
+                write_conn.rollback()
+                ok = False
+            await finish(request, ok)
+    
+    async def drained():
+        await feeder()
+        await work_queue.join()
+    
+    writer_task = asyncio.create_task(db_writer(), name="db-writer")
+    keeper_task = asyncio.create_task(lease_keeper()) if renew is not None else None
+    workers = [asyncio.create_task(fetch_worker(pool.workers[k % len(pool)]), name=f"fetch-{k}")
+               for k in range(n_slots)]
+    drain_task = asyncio.create_task(drained())
+    
+    # 写入协程和抓取协程都不会自行结束；先于队列清空而结束的说明已崩溃，不能静默地等待下去
+    await asyncio.wait([drain_task, writer_task, *workers], return_when=asyncio.FIRST_COMPLETED)
+    crashed = [task for task in (writer_task, *workers) if task.done()]
+    # 队列已清空 (或已无法继续)；冷却中的协程可能还在等待，直接取消
+    for task in (drain_task, *workers):
+        task.cancel()
+    await asyncio.gather(drain_task, *workers, return_exceptions=True)
+    if keeper_task is not None:
+        keeper_task.cancel()
+    try:
+        if crashed:
+            task = crashed[0]
+            error = None if task.cancelled() else task.exception()
+            raise RuntimeError(f"Fetch task {task.get_name()} stopped unexpectedly: {error!r}") from error
+        # 来源 (领取作业) 抛出的错误在这里传出
+        drain_task.result()
+        await write_queue.put(None)
+        await writer_task
+    finally:
+        # 已结束时无作用；出错退出时不留下仍在等待的写入协程
+        writer_task.cancel()
+        pool.log_status()
+        write_conn.close()
+
+async def fetch_grid_data_async(grid_points, concurrency=4, worker_id=None):
+    """
+    Concurrent variant of fetch_grid_data, built on run_fetch_queue and the fetch_jobs table.
+    Claims are sized by an adaptive weight budget shared with the fetch workers.
+    
+    Args:
+        grid_points (pd.DataFrame): DataFrame containing 'latitude' and 'longitude'.
+        concurrency (int): Number of requests kept in flight.
+        worker_id (str): Identifier recorded on claimed jobs (default: host:pid).
+    """
+    worker_id = worker_id or default_worker_id()
+    logging.info(f"Worker {worker_id} starting (async, concurrency={concurrency})")
+    
+    # 领取作业用一个连接；标记完成与续租用另一个连接，二者都在工作线程中运行，用锁串行
+    claim_conn = get_db_connection()
+    create_grid_table(claim_conn)
+    summary = seed_grid_jobs(claim_conn, grid_points)
+    done_conn = get_db_connection()
+    done_lock = threading.Lock()
+    pbar = tqdm(total=sum(summary.values()), initial=summary.get('done', 0), desc="Processing Jobs", unit="job")
+    
+    budget = AdaptiveBudget()
+    
+    def claimed_requests():
+        while True:
+            claimed = claim_next_requests(claim_conn, worker_id, budget)
+            if not claimed:
+                return
+            yield from claimed
+    
+    def on_done(request, ok):
+        chunk_index, years = request.tag
+        with done_lock:
+            finish_job(done_conn, chunk_index, years, worker_id, ok)
+        pbar.update(len(years))
+    
+    def renew(requests):
+        # 排队或等待冷却/配额的请求也要续租，否则会被其他进程当作失联而重复领取
+        with done_lock:
+            for request in requests:
+                chunk_index, years = request.tag
+                if not renew_lease(done_conn, chunk_index, years, worker_id):
+                    logging.warning(f"Lease of chunk {chunk_index} {years} was taken over by another worker.")
+    
+    try:
+        await run_fetch_queue(claimed_requests(), concurrency=concurrency, on_done=on_done, budget=budget,
+                              renew=renew)
+        log_job_summary(done_conn)
+        logging.info("Batch processing completed.")
+    finally:
+        # 崩溃退出时领取的作业随租约过期由其他进程接管
+        pbar.close()
+        claim_conn.close()
+        done_conn.close()
+
 if __name__ == "__main__":
+    import argparse
     from generate_grid import generate_ncp_grid
     
+    parser = argparse.ArgumentParser(description="Batch fetch Open-Meteo hourly data for the NCP grid.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="keep several requests in flight, throttled per proxy by its own rate limiter")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="number of in-flight requests in --async mode (default: 4)")
+    parser.add_argument("--proxy-workers", default=None,
+                        help="comma-separated proxy_url[@clash_api_url] list, one fetch worker per proxy "
+                             "(overrides PROXY_WORKERS; implies --async)")
+    parser.add_argument("--worker-id", default=None,
+                        help="name recorded on claimed jobs (default: host:pid)")
+    parser.add_argument("--status", action="store_true", help="print fetch job counts and exit")
+    parser.add_argument("--reset-failed", action="store_true", help="move failed jobs back to pending")
+    args = parser.parse_args()
+    
+    if args.status or args.reset_failed:
+        conn = get_db_connection()
+        create_grid_table(conn)
+        if args.reset_failed:
+            logging.info(f"Reset {reset_failed_jobs(conn)} failed jobs to pending.")
+        log_job_summary(conn)
+        conn.close()
+        sys.exit(0)
+    
     # Generate grid points
     grid = generate_ncp_grid()
     
+    if args.proxy_workers:
+        os.environ["PROXY_WORKERS"] = args.proxy_workers
+        args.use_async = True
+    
     # Start fetching
-    fetch_grid_data(grid)
+    if args.use_async:
+        asyncio.run(fetch_grid_data_async(grid, concurrency=args.concurrency, worker_id=args.worker_id))
+    else:
+        fetch_grid_data(grid, worker_id=args.worker_id)
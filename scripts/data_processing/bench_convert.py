@@ -0,0 +1,132 @@
+"""
+微基准：对比 Open-Meteo 响应 -> 入库行 的两种转换方式的吞吐量 (rows/s)。
+
+  legacy:   pandas DataFrame + df.iterrows() + 逐字段 float() (原 batch_fetch_weather 实现)
+  columnar: hourly_batch.responses_to_batch() 直接拼接 ValuesAsNumpy() 数组
+
+用法: python scripts/data_processing/bench_convert.py [--points 10] [--years 1] [--repeat 3]
+不访问网络和数据库，使用与 openmeteo_sdk 接口一致的伪造响应对象。
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from hourly_batch import HOURLY_VARIABLES, responses_to_batch
+
+
+class _FakeVariable:
+    def __init__(self, values):
+        self._values = values
+
+    def ValuesAsNumpy(self):
+        return self._values
+
+
+class _FakeHourly:
+    def __init__(self, start, hours, rng):
+        self._start = start
+        self._hours = hours
+        self._vars = [_FakeVariable(rng.random(hours, dtype=np.float32) * 30) for _ in HOURLY_VARIABLES]
+
+    def Time(self):
+        return self._start
+
+    def TimeEnd(self):
+        return self._start + self._hours * 3600
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, i):
+        return self._vars[i]
+
+
+class FakeResponse:
+    def __init__(self, lat, lon, start, hours, rng):
+        self._lat = lat
+        self._lon = lon
+        self._hourly = _FakeHourly(start, hours, rng)
+
+    def Latitude(self):
+        return self._lat
+
+    def Longitude(self):
+        return self._lon
+
+    def Elevation(self):
+        return 50.0
+
+    def Hourly(self):
+        return self._hourly
+
+
+def make_responses(n_points, n_years, seed=0):
+    rng = np.random.default_rng(seed)
+    start = int(pd.Timestamp("1990-01-01", tz="UTC").timestamp())
+    hours = int(365.25 * 24 * n_years)
+    return [FakeResponse(36.0 + 0.25 * k, 115.0 + 0.25 * k, start, hours, rng) for k in range(n_points)]
+
+
+def legacy_responses_to_records(responses):
+    """原 batch_fetch_weather.py 中基于 iterrows 的实现，仅用于对比。"""
+    all_records = []
+    for response in responses:
+        lat = response.Latitude()
+        lon = response.Longitude()
+        hourly = response.Hourly()
+        df = pd.DataFrame(data={"date": pd.date_range(
+            start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
+            end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
+            freq=pd.Timedelta(seconds=hourly.Interval()),
+            inclusive="left"
+        )})
+        for k, name in enumerate(HOURLY_VARIABLES):
+            df[name] = hourly.Variables(k).ValuesAsNumpy()
+        for _, row in df.iterrows():
+            all_records.append((lat, lon, row["date"]) + tuple(float(row[name]) for name in HOURLY_VARIABLES))
+    return all_records
+
+
+def columnar_rows(responses):
+    return responses_to_batch(responses).rows()
+
+
+def bench(fn, responses, repeat):
+    best = float("inf")
+    n_rows = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n_rows = len(fn(responses))
+        best = min(best, time.perf_counter() - t0)
+    return n_rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    responses = make_responses(args.points, args.years)
+
+    # 先确认两种实现产出的数值一致
+    legacy = legacy_responses_to_records(responses)
+    columnar = columnar_rows(responses)
+    assert len(legacy) == len(columnar)
+    assert all(int(a[2].timestamp()) == b[2] and a[3:] == b[3:] for a, b in zip(legacy, columnar))
+
+    print(f"{args.points} points x {args.years} year(s), best of {args.repeat}:")
+    results = {}
+    for name, fn in [("legacy (iterrows)", legacy_responses_to_records), ("columnar", columnar_rows),
+                     ("columnar (no rows)", responses_to_batch)]:
+        n_rows, seconds = bench(fn, responses, args.repeat)
+        results[name] = n_rows / seconds
+        print(f"  {name:<20} {n_rows:>9,} rows  {seconds * 1000:>9.1f} ms  {n_rows / seconds:>14,.0f} rows/s")
+    print(f"  speedup (columnar rows vs legacy): {results['columnar'] / results['legacy (iterrows)']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,34 @@
 
-import psycopg2
-import os
 from dotenv import load_dotenv
+from db import connect
+from year_partitions import year_bounds, year_range_sql
 
 load_dotenv()
 
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-
 def check_distribution():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         cur = conn.cursor()
 
         print("--- Checking Year 1990 (Even Year - High Data) ---")
-        cur.execute("""
-            SELECT count(DISTINCT (latitude, longitude)) as locations, count(*) as total_rows
+        # 范围条件可以裁剪到单个年份分区；extract(year ...) = 1990 需要扫描整表
+        cur.execute(f"""
+            SELECT count(DISTINCT cell_id) as locations, count(*) as total_rows
             FROM grid_weather_data
-            WHERE extract(year from timestamp) = 1990;
-        """)
+            WHERE {year_range_sql()};
+        """, year_bounds(1990))
         locs_1990, rows_1990 = cur.fetchone()
         print(f"1990: {locs_1990} locations, {rows_1990} rows")
         if locs_1990 > 0:
             print(f"Avg rows per location: {rows_1990 / locs_1990:.1f} (Expected ~8760)")
 
         print("\n--- Checking Year 1991 (Odd Year - Low Data) ---")
-        cur.execute("""
-            SELECT count(DISTINCT (latitude, longitude)) as locations, count(*) as total_rows
+        # 范围条件可以裁剪到单个年份分区；extract(year ...) = 1991 需要扫描整表
+        cur.execute(f"""
+            SELECT count(DISTINCT cell_id) as locations, count(*) as total_rows
             FROM grid_weather_data
-            WHERE extract(year from timestamp) = 1991;
-        """)
+            WHERE {year_range_sql()};
+        """, year_bounds(1991))
         locs_1991, rows_1991 = cur.fetchone()
         print(f"1991: {locs_1991} locations, {rows_1991} rows")
         if locs_1991 > 0:
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+# --- Clash API & Proxy 配置 ---
+# 配置更新时间: 2026-02-19 (根据用户本地 config.yaml 自动校准)
+# 优先从环境变量读取（用于隔离模式），否则使用默认值
+CLASH_API_URL = os.getenv("CLASH_API_URL", "http://127.0.0.1:10380")
+CLASH_SECRET = os.getenv("CLASH_SECRET", "44976f0a-414c-48b1-bda7-5759fef634d3")
+PROXY_GROUP_NAME = "猫猫云"
+HTTP_PROXY_URL = os.getenv("HTTP_PROXY", "http://127.0.0.1:7890")
+
+# 排除特殊节点和策略组名
+EXCLUDED_NODE_NAMES = ["DIRECT", "REJECT", "GLOBAL", "故障转移", "负载均衡", "自动选择", "猫猫云"]
+
+# 节点测速：通过 Clash 的 /proxies/{name}/delay 接口，由 Clash 自己经该节点访问测试地址
+CLASH_DELAY_TEST_URL = os.getenv("CLASH_DELAY_TEST_URL", "http://www.gstatic.com/generate_204")
+PROBE_TIMEOUT_MS = 3000
+# 测速结果的有效期，过期后在下次换节点前重新测速
+PROBE_TTL_SECONDS = 600
+PROBE_CONCURRENCY = 16
+# 每次 429 记录在节点上的额外分数 (毫秒)，让经常被限流的节点排在后面
+QUOTA_HIT_PENALTY_MS = 200
+
+
+class NodeScores:
+    """
+    按节点名记录测速延迟、测速失败与 429 限流时间，为换节点打分。线程安全。
+
+    出口 IP 由节点决定，多个 Clash 实例使用同一订阅时应共用一个实例，
+    这样一个实例上被限流的节点在其他实例上同样会被跳过。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = {}
+
+    def _entry(self, name):
+        return self._nodes.setdefault(name, {"delay": None, "probed_at": None,
+                                             "throttled_until": 0.0, "quota_hits": 0})
+
+    def record_probe(self, name, delay_ms):
+        """记录一次测速结果，delay_ms 为 None 表示节点不可用。"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["delay"] = delay_ms
+            entry["probed_at"] = time.monotonic()
+
+    def mark_throttled(self, name, seconds):
+        """节点的出口 IP 收到 429，在配额窗口重置之前不再选用。"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["throttled_until"] = max(entry["throttled_until"], time.monotonic() + seconds)
+            entry["quota_hits"] += 1
+
+    def throttled_for(self, name):
+        with self._lock:
+            entry = self._nodes.get(name)
+            return max(0.0, entry["throttled_until"] - time.monotonic()) if entry else 0.0
+
+    def stale(self, names, ttl=PROBE_TTL_SECONDS):
+        """返回从未测速或测速结果已过期的节点。"""
+        now = time.monotonic()
+        with self._lock:
+            return [n for n in names
+                    if n not in self._nodes or self._nodes[n]["probed_at"] is None
+                    or now - self._nodes[n]["probed_at"] > ttl]
+
+    def is_usable(self, name):
+        """测速通过且未被限流。"""
+        with self._lock:
+            entry = self._nodes.get(name)
+            return (entry is not None and entry["delay"] is not None
+                    and entry["throttled_until"] <= time.monotonic())
+
+    def rank(self, names):
+        """按分数从好到差返回可用节点 (排除测速失败和限流中的节点)。"""
+        now = time.monotonic()
+        with self._lock:
+            scored = []
+            for name in names:
+                entry = self._nodes.get(name)
+                if entry is None or entry["delay"] is None or entry["throttled_until"] > now:
+                    continue
+                scored.append((entry["delay"] + QUOTA_HIT_PENALTY_MS * entry["quota_hits"], name))
+        return [name for _, name in sorted(scored)]
+
+    def delay(self, name):
+        with self._lock:
+            entry = self._nodes.get(name)
+            return entry["delay"] if entry else None
+
+
+class ClashController:
+    """
+    Clash REST API 的轻量封装：加载代理组节点、切换节点。
+
+    api_url 为 None 时沿用原有行为 (环境变量 -> 本地 config.yaml -> 常见端口探测)；
+    显式传入 api_url 时只连接该地址，用于多实例代理池。
+    http 可替换为任何提供 requests 风格 get/put 的对象 (例如测试中的本地桩)。
+    scores 为节点打分表，多个控制器可共用。
+    """
+
+    def __init__(self, api_url=None, secret=None, group=PROXY_GROUP_NAME, http=None, scores=None):
+        self.http = http or requests
+        self.scores = scores if scores is not None else NodeScores()
+        self.group = group
+        self.api_url = api_url or CLASH_API_URL
+        self.secret = CLASH_SECRET if secret is None else secret
+        if api_url is None:
+            # 自动从配置文件读取配置
+            self._try_load_from_config()
+
+        self.headers = {"Authorization": f"Bearer {self.secret}"} if self.secret else {}
+        self.available_nodes = []
+        self.current_node = None
+
+        # 优先使用配置的端口，如果连不上再探测
+        if not self._check_current_port() and api_url is None:
+            self._auto_detect_port()
+        self._init_nodes()
+
+    def _try_load_from_config(self):
+        """尝试从 Clash 配置文件自动读取端口和密钥"""
+        # 如果环境变量已指定，则优先使用环境变量，不再读取文件
+        if os.environ.get("CLASH_API_URL"):
+            logging.info(f"使用环境变量指定的 Clash API: {self.api_url}")
+            return
+
+        try:
+            user_home = os.path.expanduser("~")
+            config_path = os.path.join(user_home, ".config", "clash", "config.yaml")
+
+            if os.path.exists(config_path):
+                logging.info(f"发现 Clash 配置文件: {config_path}")
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    import yaml
+                    config = yaml.safe_load(f)
+
+                    # 读取 external-controller
+                    if 'external-controller' in config:
+                        controller = config['external-controller']
+                        # 处理可能是 0.0.0.0 的情况，替换为 127.0.0.1
+                        if controller.startswith(':'):
+                            controller = f"127.0.0.1{controller}"
+                        elif controller.startswith('0.0.0.0:'):
+                            controller = controller.replace('0.0.0.0:', '127.0.0.1:')
+
+                        # 确保有 http 前缀
+                        if not controller.startswith('http'):
+                            self.api_url = f"http://{controller}"
+                        else:
+                            self.api_url = controller
+                        logging.info(f"  -> 自动读取到 API 地址: {self.api_url}")
+
+                    # 读取 secret
+                    if 'secret' in config:
+                        self.secret = config['secret']
+                        logging.info(f"  -> 自动读取到 API 密钥: {self.secret[:3]}***{self.secret[-3:]}")
+        except Exception as e:
+            logging.warning(f"尝试读取 Clash 配置文件失败: {e} (将使用默认配置)")
+
+    def _check_current_port(self):
+        """检查当前配置的端口是否可用"""
+        try:
+            resp = self.http.get(f"{self.api_url}/version", headers=self.headers, timeout=1)
+            if resp.status_code == 200:
+                logging.info(f"Clash API 连接成功: {self.api_url}")
+                return True
+        except:
+            pass
+        return False
+
+    def _auto_detect_port(self):
+        """自动探测 Clash API 端口"""
+        common_ports = [3936, 9090, 7342, 5492, 10380, 9097, 7890, 6821, 12531, 12280] # 优先尝试已知端口
+        current_port = int(self.api_url.split(':')[-1])
+        if current_port not in common_ports:
+            common_ports.insert(0, current_port)
+
+        for port in common_ports:
+            test_url = f"http://127.0.0.1:{port}"
+            try:
+                resp = self.http.get(f"{test_url}/version", headers=self.headers, timeout=1)
+                if resp.status_code == 200:
+                    self.api_url = test_url
+                    logging.info(f"成功探测到 Clash API 运行在端口: {port}")
+                    return
+                elif resp.status_code == 401:
+                    self.api_url = test_url
+                    logging.warning(f"🎯 找到 API 端口 {port}，但提示 'Unauthorized'。请在 CLASH_SECRET 中填入密钥。")
+                    return
+            except requests.exceptions.ConnectionError:
+                continue
+            except Exception as e:
+                logging.debug(f"探测端口 {port} 时发生意外错误: {e}")
+                continue
+
+        logging.error("❌ 无法连接到 Clash API。请确保：\n"
+                      "1. Clash for Windows 已启动\n"
+                      "2. 在 [General] -> [External Control] 查看真实的端口并更新 CLASH_API_URL\n"
+                      "3. 如果设置了 Secret，请确保 CLASH_SECRET 已正确填写")
+
+    def _init_nodes(self):
+        try:
+            resp = self.http.get(f"{self.api_url}/proxies", headers=self.headers, timeout=5)
+            if resp.status_code == 200:
+                proxies = resp.json()["proxies"]
+                if self.group in proxies:
+                    self.available_nodes = [n for n in proxies[self.group]["all"] if n not in EXCLUDED_NODE_NAMES]
+                    self.current_node = proxies[self.group].get("now")
+                    logging.info(f"成功加载 {len(self.available_nodes)} 个可切换节点 ({self.api_url})。")
+                else:
+                    logging.error(f"未找到代理组 '{self.group}'，请检查 Clash 配置中的组名是否为 '{self.group}'。")
+            elif resp.status_code == 401:
+                logging.error("❌ Clash API 认证失败 (401)。请务必在脚本顶部的 CLASH_SECRET 中填写正确的密钥。")
+            else:
+                logging.error(f"获取 Clash 代理列表失败，状态码: {resp.status_code}, 响应: {resp.text}")
+        except Exception as e:
+            logging.error(f"初始化 Clash 节点失败: {e}")
+
+    def select(self, node_name):
+        """把代理组切换到指定节点，成功返回 True。"""
+        try:
+            url = f"{self.api_url}/proxies/{self.group}"
+            payload = {"name": node_name}
+            resp = self.http.put(url, headers=self.headers, data=json.dumps(payload), timeout=5)
+            if resp.status_code == 204:
+                self.current_node = node_name
+                return True
+        except Exception as e:
+            logging.error(f"切换节点出错: {e}")
+        return False
+
+    def probe_delay(self, node_name, url=CLASH_DELAY_TEST_URL, timeout_ms=PROBE_TIMEOUT_MS):
+        """让 Clash 经指定节点访问测试地址，返回延迟毫秒数 (失败返回 None) 并记入打分表。"""
+        delay = None
+        try:
+            resp = self.http.get(f"{self.api_url}/proxies/{quote(node_name, safe='')}/delay",
+                                 headers=self.headers, params={"url": url, "timeout": timeout_ms},
+                                 timeout=timeout_ms / 1000 + 2)
+            if resp.status_code == 200:
+                delay = resp.json().get("delay")
+        except Exception as e:
+            logging.debug(f"节点 {node_name} 测速出错: {e}")
+        self.scores.record_probe(node_name, delay)
+        return delay
+
+    def probe_nodes(self, nodes=None, max_workers=PROBE_CONCURRENCY):
+        """并发测速，返回 {节点: 延迟或 None}。"""
+        nodes = list(self.available_nodes if nodes is None else nodes)
+        if not nodes:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as pool:
+            delays = dict(zip(nodes, pool.map(self.probe_delay, nodes)))
+        alive = sum(1 for d in delays.values() if d is not None)
+        logging.info(f"节点测速完成: {alive}/{len(nodes)} 可用 ({self.api_url})。")
+        return delays
+
+    def ensure_probed(self, nodes=None):
+        """只对从未测速或结果过期的节点测速。"""
+        stale = self.scores.stale(self.available_nodes if nodes is None else nodes)
+        if stale:
+            self.probe_nodes(stale)
+
+    def mark_throttled(self, seconds, node_name=None):
+        """当前 (或指定) 节点收到 429，seconds 秒内不再选用。"""
+        node_name = node_name or self.current_node
+        if node_name:
+            self.scores.mark_throttled(node_name, seconds)
+
+    def switch_to_next(self, exclude=()):
+        """
+        切换到得分最好的另一个节点，返回新节点名 (失败返回 None)。
+
+        测速失败或仍在限流窗口内的节点不会被选中；exclude 中的节点 (例如代理池中
+        其他 worker 正在使用的节点) 只在没有其他可用节点时才会被选中。
+        切换前对选中的节点再测一次速，代替切换后的固定等待与出口 IP 验证。
+        """
+        if not self.available_nodes:
+            return None
+
+        others = [n for n in self.available_nodes if n != self.current_node]
+        preferred = [n for n in others if n not in exclude]
+        self.ensure_probed(others)
+        for node_name in self.scores.rank(preferred) + self.scores.rank([n for n in others if n in exclude]):
+            if self.probe_delay(node_name) is None:
+                continue
+            if self.select(node_name):
+                logging.info(f">>> 切换节点成功: {node_name} "
+                             f"({self.scores.delay(node_name)} ms, {self.api_url})")
+                return node_name
+        logging.warning(f"没有未被限流的可用节点 ({self.api_url})。")
+        return None
@@ -0,0 +1,295 @@
+"""
+稠密的本地气候立方体：每年一个 float32 memmap 文件，形状为 (小时, 网格单元, 变量)。
+
+ET0 / SPEI / QM 以及后续的模型训练都需要整个区域的数组，逐点 pd.read_sql 查询
+受限于数据库往返；立方体在本地磁盘上按内存带宽读取，并返回零拷贝视图。
+
+    <root>/cube.json      坐标索引：网格单元 (cell_id, 纬度, 经度)、变量、年份与同步水位
+    <root>/<year>.f32     float32 (hours_in_year, n_cells, n_variables)，缺测为 NaN
+
+年份按 UTC 划分 (与请求和入库清单一致)，第 k 个小时对应 UTC 年初 + k 小时。
+网格单元按 (纬度, 经度) 排序，因此同一纬度带内的单元在单元轴上连续。
+
+增量同步依据 grid_ingest_manifest.updated_at：只重读上次同步之后有写入的 (单元, 年份)。
+
+用法:
+    python scripts/data_processing/climate_cube.py sync
+    python scripts/data_processing/climate_cube.py info
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from hourly_batch import VARIABLE_COLUMNS
+from ingest_manifest import MANIFEST_TABLE, hours_in_year
+
+CUBE_DIR = os.getenv("CLIMATE_CUBE_DIR", os.path.join(os.getcwd(), "climate_cube"))
+META_FILE = "cube.json"
+
+
+def year_start_epoch(year):
+    return int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+class ClimateCube:
+    """
+    立方体的读写入口。读取接口返回 np.memmap 的视图，不复制数据：
+    单个单元、连续的单元区间、时间切片都是零拷贝；不连续的单元集合 (例如经度方向的 bbox)
+    只能通过花式索引取出，会产生拷贝。
+    """
+
+    def __init__(self, root=CUBE_DIR):
+        self.root = root
+        self.variables = list(VARIABLE_COLUMNS.values())
+        self.cells = np.empty((0, 3))  # (cell_id, lat, lon)，按 (lat, lon) 排序
+        self.years = {}  # year -> {"synced_at": iso}
+        self.synced_at = None
+        self._maps = {}
+        self._index = {}
+        if os.path.exists(self._meta_path):
+            self._load_meta()
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.root, META_FILE)
+
+    def _year_path(self, year):
+        return os.path.join(self.root, f"{year}.f32")
+
+    def _load_meta(self):
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.variables = meta["variables"]
+        self.cells = np.array(meta["cells"], dtype=np.float64).reshape(-1, 3)
+        self.years = {int(y): v for y, v in meta["years"].items()}
+        self.synced_at = meta.get("synced_at")
+        self._reindex()
+
+    def _save_meta(self):
+        os.makedirs(self.root, exist_ok=True)
+        meta = {
+            "variables": self.variables,
+            "cells": self.cells.tolist(),
+            "years": {str(y): v for y, v in sorted(self.years.items())},
+            "synced_at": self.synced_at,
+        }
+        tmp = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+    def _reindex(self):
+        self._index = {int(cid): k for k, cid in enumerate(self.cells[:, 0])}
+
+    # ---- 坐标索引 ----
+
+    def cell_index(self, cell_id):
+        return self._index[int(cell_id)]
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """bbox 内网格单元在单元轴上的下标 (升序)。"""
+        lat, lon = self.cells[:, 1], self.cells[:, 2]
+        return np.flatnonzero((lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max))
+
+    def times(self, year):
+        start = np.datetime64(f"{year}-01-01T00:00")
+        return start + np.arange(hours_in_year(year)).astype("timedelta64[h]")
+
+    def variable_index(self, variable):
+        return self.variables.index(VARIABLE_COLUMNS.get(variable, variable))
+
+    # ---- 读取 ----
+
+    def year(self, year, mode="r"):
+        """整年的 (小时, 单元, 变量) memmap。"""
+        key = (year, mode)
+        if key not in self._maps:
+            self._maps[key] = np.memmap(self._year_path(year), dtype=np.float32, mode=mode,
+                                        shape=(hours_in_year(year), len(self.cells), len(self.variables)))
+        return self._maps[key]
+
+    def select(self, year, cells=None, variable=None, hours=slice(None)):
+        """
+        取一年内的切片。cells: cell_id、单元下标的 slice 或下标数组；variable: 变量名或列名。
+        cells 为单个单元或 slice 时返回视图，为不连续的下标数组时返回拷贝。
+        """
+        data = self.year(year)[hours]
+        if cells is not None:
+            if isinstance(cells, (int, np.integer)):
+                cells = self.cell_index(cells)
+            elif not isinstance(cells, slice):
+                cells = np.asarray(cells)
+                if len(cells) and np.array_equal(cells, np.arange(cells[0], cells[0] + len(cells))):
+                    cells = slice(int(cells[0]), int(cells[0]) + len(cells))
+            data = data[:, cells]
+        if variable is not None:
+            data = data[..., self.variable_index(variable)]
+        return data
+
+    def series(self, cell_id, variable, start_year, end_year):
+        """一个单元跨年的小时序列 (跨年时拼接，会产生拷贝)。"""
+        k = self.cell_index(cell_id)
+        v = self.variable_index(variable)
+        parts = [self.year(y)[:, k, v] for y in range(start_year, end_year + 1) if y in self.years]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    # ---- 写入 ----
+
+    def set_layout(self, cells, variables=None):
+        """
+        设置单元轴 [(cell_id, lat, lon)] 与变量轴；与已有布局不同时把已有年份重排到新布局。
+        """
+        cells = np.array(sorted(cells, key=lambda c: (c[1], c[2], c[0])), dtype=np.float64).reshape(-1, 3)
+        variables = list(variables or self.variables)
+        if np.array_equal(cells, self.cells) and variables == self.variables:
+            return False
+        old_cells, old_vars = self.cells, self.variables
+        os.makedirs(self.root, exist_ok=True)
+        for year in sorted(self.years):
+            old = self.year(year)
+            new = np.memmap(f"{self._year_path(year)}.tmp", dtype=np.float32, mode="w+",
+                            shape=(hours_in_year(year), len(cells), len(variables)))
+            new[:] = np.nan
+            new_index = {int(cid): k for k, cid in enumerate(cells[:, 0])}
+            for k_old, cid in enumerate(old_cells[:, 0]):
+                k_new = new_index.get(int(cid))
+                if k_new is None:
+                    continue
+                for v_new, name in enumerate(variables):
+                    if name in old_vars:
+                        new[:, k_new, v_new] = old[:, k_old, old_vars.index(name)]
+            new.flush()
+            del new
+            self._close()
+            os.replace(f"{self._year_path(year)}.tmp", self._year_path(year))
+        self.cells, self.variables = cells, variables
+        self._reindex()
+        self._save_meta()
+        return True
+
+    def _close(self):
+        for data in self._maps.values():
+            if data.mode != "r":
+                data.flush()
+        self._maps.clear()
+
+    def write(self, year, cell_ids, epoch, values, columns=None):
+        """
+        把小时记录写入立方体：cell_ids / epoch (UTC 秒) 为 (n,)，values 为 (n, k)，
+        columns 为 values 的列名 (默认与立方体变量轴一致)。不在该年的记录会被忽略。
+        """
+        if year not in self.years:
+            data = np.memmap(self._year_path(year), dtype=np.float32, mode="w+",
+                             shape=(hours_in_year(year), len(self.cells), len(self.variables)))
+            data[:] = np.nan
+            data.flush()
+            del data
+            self.years[year] = {}
+        data = self.year(year, mode="r+")
+        hour = (np.asarray(epoch, dtype=np.int64) - year_start_epoch(year)) // 3600
+        ids = self.cells[:, 0].astype(np.int64)
+        order = np.argsort(ids)
+        cell = order[np.searchsorted(ids, np.asarray(cell_ids, dtype=np.int64), sorter=order)]
+        ok = (hour >= 0) & (hour < data.shape[0])
+        columns = list(columns or self.variables)
+        for j, name in enumerate(columns):
+            data[hour[ok], cell[ok], self.variables.index(name)] = np.asarray(values)[ok, j]
+
+    def commit(self, synced_at, years=(), complete=False):
+        """刷新所有写入并记录各年份的同步时间；complete 时推进全局同步水位。"""
+        self._close()
+        for year in years:
+            self.years.setdefault(year, {})["synced_at"] = synced_at
+        if complete:
+            self.synced_at = synced_at
+        self._save_meta()
+
+
+def touched_cell_years(conn, since=None):
+    """自 since (ISO 时间) 以来清单中有写入的 {year: [cell_id, ...]}。"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT DISTINCT m.year, c.id
+        FROM {MANIFEST_TABLE} m
+        JOIN grid_cell c ON c.request_latitude = m.latitude AND c.request_longitude = m.longitude
+        WHERE m.updated_at > %s;
+    """, (since or "-infinity",))
+    touched = {}
+    for year, cell_id in cur.fetchall():
+        touched.setdefault(int(year), []).append(cell_id)
+    cur.close()
+    return touched
+
+
+def sync_cube(conn, cube=None, full=False, cells_per_query=50):
+    """
+    把数据库同步到立方体，返回写入的 (单元, 年份) 数。
+    水位取同步开始时的数据库时间，同步期间的新写入会在下次同步时补上。
+    """
+    cube = cube or ClimateCube()
+    cur = conn.cursor()
+    cur.execute("SELECT now();")
+    started = cur.fetchone()[0].isoformat()
+    cur.execute("SELECT id, COALESCE(latitude, request_latitude), COALESCE(longitude, request_longitude) "
+                "FROM grid_cell;")
+    cube.set_layout(cur.fetchall())
+    cur.close()
+
+    touched = touched_cell_years(conn, None if full else cube.synced_at)
+    columns = ", ".join(cube.variables)
+    n = 0
+    for year in sorted(touched):
+        cell_ids = sorted(touched[year])
+        for k in range(0, len(cell_ids), cells_per_query):
+            batch = cell_ids[k:k + cells_per_query]
+            # 参数先转为会话时区下的 TIMESTAMP，保持 timestamp 列上的范围条件可走索引
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT cell_id, extract(epoch FROM timestamp::timestamptz)::bigint, {columns}
+                FROM grid_weather_data
+                WHERE cell_id = ANY(%s)
+                  AND timestamp >= to_timestamp(%s)::timestamp AND timestamp < to_timestamp(%s)::timestamp;
+            """, (batch, year_start_epoch(year), year_start_epoch(year + 1)))
+            rows = cur.fetchall()
+            cur.close()
+            if not rows:
+                continue
+            arr = np.array(rows, dtype=np.float64)
+            cube.write(year, arr[:, 0].astype(np.int64), arr[:, 1].astype(np.int64), arr[:, 2:])
+            n += len(batch)
+        cube.commit(started, years=[year])
+        logging.info(f"  Cube {year}: synced {len(cell_ids)} cells.")
+    cube.commit(started, complete=True)
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialise grid_weather_data as a local memory-mapped cube.")
+    parser.add_argument("command", choices=["sync", "info"])
+    parser.add_argument("--root", default=CUBE_DIR)
+    parser.add_argument("--full", action="store_true", help="re-read every cell-year instead of only new writes")
+    args = parser.parse_args()
+    cube = ClimateCube(args.root)
+
+    if args.command == "info":
+        size = sum(os.path.getsize(cube._year_path(y)) for y in cube.years if os.path.exists(cube._year_path(y)))
+        years = f"{min(cube.years)}-{max(cube.years)}" if cube.years else "none"
+        print(f"{len(cube.cells)} cells x {len(cube.variables)} variables, years {years}, "
+              f"{size / 1e9:.2f} GB in {args.root}; last sync {cube.synced_at}")
+        return
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    n = sync_cube(conn, cube, full=args.full)
+    conn.close()
+    logging.info(f"Cube sync completed: {n} cell-years written to {args.root}.")
+
+
+if __name__ == "__main__":
+    main()
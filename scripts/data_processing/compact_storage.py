@@ -0,0 +1,164 @@
+"""
+紧凑存储编码：小时变量按固定比例存为 SMALLINT，行以 cell_id 为键，不再存双精度经纬度。
+
+Open-Meteo 的源数据远没有双精度 (温度 0.1 °C、湿度 1 %、辐射 1 W/m²)，
+每个变量 2 字节即可无损保存到比源数据更细的一级；一行从约 112 字节降到约 56 字节，
+索引只剩 (cell_id, timestamp) 主键和 id，表和索引都约减半，所有扫描的 I/O 随之减半。
+
+迁移后:
+    grid_weather_compact   物理表 (id, cell_id, timestamp, 各变量 SMALLINT)
+    grid_weather_data      同名解码视图，列与旧表一致 (经纬度来自 grid_cell)，读取方无需改动
+    grid_weather_legacy    旧表，确认无误后可用 --drop-legacy 删除
+加载器检测到紧凑表后直接写入编码值 (NaN 与超出范围的值存为 NULL)。
+
+迁移期间请停止抓取进程:
+    python scripts/data_processing/compact_storage.py migrate
+"""
+import argparse
+import logging
+
+import numpy as np
+
+HOURLY_VIEW = "grid_weather_data"
+COMPACT_TABLE = "grid_weather_compact"
+LEGACY_TABLE = "grid_weather_legacy"
+ENCODE_FUNCTION = "grid_encode"
+
+# 列名 -> 存储比例 (存储值 = round(原值 / 比例))，SMALLINT 可表示 ±32767 × 比例
+COLUMN_SCALES = {
+    "temperature": 0.01,                  # ±327 °C
+    "precipitation": 0.01,                # 0..327 mm/h
+    "et0_fao_evapotranspiration": 0.001,  # 0..32 mm/h
+    "soil_moisture_0_to_7cm": 0.0001,     # 0..3.2 m³/m³
+    "relative_humidity_2m": 0.1,          # 0..100 %
+    "wind_speed_10m": 0.1,                # 0..3276 km/h
+    "shortwave_radiation": 0.1,           # 0..3276 W/m²
+}
+
+SMALLINT_MAX = 32767
+
+CREATE_COMPACT_SQL = f"""
+CREATE OR REPLACE FUNCTION {ENCODE_FUNCTION}(value FLOAT, scale FLOAT) RETURNS SMALLINT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE WHEN value IS NULL OR value = 'NaN' OR abs(round(value / scale)) > {SMALLINT_MAX}
+                THEN NULL ELSE round(value / scale)::smallint END
+$$;
+CREATE TABLE IF NOT EXISTS {COMPACT_TABLE} (
+    id INTEGER NOT NULL,
+    cell_id INTEGER NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    {", ".join(f"{col} SMALLINT" for col in COLUMN_SCALES)},
+    PRIMARY KEY (cell_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS {COMPACT_TABLE}_id_idx ON {COMPACT_TABLE} (id);
+"""
+
+
+def encode_sql(expr, column):
+    return f"{ENCODE_FUNCTION}({expr}, {COLUMN_SCALES[column]})"
+
+
+def decode_sql(expr, column):
+    return f"({expr} * {COLUMN_SCALES[column]}::float8)"
+
+
+def encode(values, column):
+    """numpy 版本的编码 (与 SQL 函数一致)，返回 (int16 数组, 是否有效的掩码)。"""
+    scaled = np.round(np.asarray(values, dtype=np.float64) / COLUMN_SCALES[column])
+    valid = np.isfinite(scaled) & (np.abs(scaled) <= SMALLINT_MAX)
+    return np.where(valid, scaled, 0).astype(np.int16), valid
+
+
+def decode(stored, column, valid=None):
+    values = np.asarray(stored, dtype=np.float64) * COLUMN_SCALES[column]
+    return values if valid is None else np.where(valid, values, np.nan)
+
+
+def compact_enabled(cur):
+    """迁移完成 (grid_weather_data 已替换为解码视图) 后为 True。"""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (HOURLY_VIEW,))
+    row = cur.fetchone()
+    return row is not None and row[0] == "v"
+
+
+def hourly_storage_table(cur):
+    """小时数据的物理表名 (紧凑模式下 grid_weather_data 只是视图)。"""
+    return COMPACT_TABLE if compact_enabled(cur) else HOURLY_VIEW
+
+
+def create_decode_view_sql():
+    decoded = ",\n            ".join(f"{decode_sql('g.' + col, col)} AS {col}" for col in COLUMN_SCALES)
+    # LEFT JOIN 唯一键：不读取经纬度的查询 (汇总、按 cell_id 的点查询) 中规划器会消去该连接
+    return f"""
+        CREATE OR REPLACE VIEW {HOURLY_VIEW} AS
+        SELECT g.id, g.cell_id,
+               COALESCE(c.latitude, c.request_latitude) AS latitude,
+               COALESCE(c.longitude, c.request_longitude) AS longitude,
+               g.timestamp,
+            {decoded}
+        FROM {COMPACT_TABLE} g
+        LEFT JOIN grid_cell c ON c.id = g.cell_id;
+    """
+
+
+def migrate_to_compact(conn, cells_per_batch=20, drop_legacy=False):
+    """
+    把 grid_weather_data 迁移到紧凑表，并以同名解码视图替换旧表，可重复执行 (中断后继续)。
+    数据按网格单元分批复制并逐批提交，单个事务的大小与总数据量无关。返回复制的行数。
+    """
+    cur = conn.cursor()
+    cur.execute(CREATE_COMPACT_SQL)
+    conn.commit()
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (HOURLY_VIEW,))
+    row = cur.fetchone()
+    copied = 0
+
+    if row is not None and row[0] in ("r", "p"):
+        # grid_weather_data 仍是普通表：逐批编码复制，中断后重新运行会跳过已复制的行
+        cur.execute("SELECT id FROM grid_cell ORDER BY id;")
+        cell_ids = [r[0] for r in cur.fetchall()]
+        columns = ", ".join(COLUMN_SCALES)
+        encoded = ", ".join(encode_sql(col, col) for col in COLUMN_SCALES)
+        for k in range(0, len(cell_ids), cells_per_batch):
+            cur.execute(f"""
+                INSERT INTO {COMPACT_TABLE} (id, cell_id, timestamp, {columns})
+                SELECT id, cell_id, timestamp, {encoded}
+                FROM {HOURLY_VIEW}
+                WHERE cell_id = ANY(%s)
+                ON CONFLICT (cell_id, timestamp) DO NOTHING;
+            """, (cell_ids[k:k + cells_per_batch],))
+            copied += cur.rowcount
+            conn.commit()
+            logging.info(f"  Encoded {min(k + cells_per_batch, len(cell_ids))}/{len(cell_ids)} cells "
+                         f"({copied} rows so far)...")
+
+        # 旧表的序列继续为新行分配 id；改为归属紧凑表，删除旧表时不会被连带删除
+        cur.execute(f"ALTER SEQUENCE IF EXISTS {HOURLY_VIEW}_id_seq OWNED BY {COMPACT_TABLE}.id;")
+        cur.execute(f"ALTER TABLE {COMPACT_TABLE} ALTER COLUMN id SET DEFAULT nextval('{HOURLY_VIEW}_id_seq');")
+        cur.execute(f"ALTER TABLE {HOURLY_VIEW} RENAME TO {LEGACY_TABLE};")
+    cur.execute(create_decode_view_sql())
+    if drop_legacy:
+        cur.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE};")
+    conn.commit()
+    cur.close()
+    logging.info(f"{HOURLY_VIEW} now decodes {COMPACT_TABLE}; copied {copied} rows.")
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate grid_weather_data to the compact SMALLINT encoding.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--drop-legacy", action="store_true", help="drop the old table after migrating")
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    migrate_to_compact(conn, drop_legacy=args.drop_legacy)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
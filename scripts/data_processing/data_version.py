@@ -0,0 +1,51 @@
+"""
+网格数据的版本号：一行一列的计数器，任何改变网格数据的事务在提交前加一。
+
+版本号与数据在同一事务中提交，读取方看到新版本时一定也能看到新数据，
+因此可以作为响应缓存的失效依据和 ETag (见 response_cache.py)。
+
+改变数据的路径:
+    GridWeatherLoader        每批合并之后 (无新行或填补时不加)
+    reset_stats              清空小时表 / 重建统计
+    truncate_year            清空一年
+    rebuild_rollups          重建日/月汇总
+加锁的时间只从加一到提交为止，因此加一放在各事务的最后一步。
+"""
+import psycopg2
+from psycopg2.extensions import cursor as tuple_cursor
+
+VERSION_TABLE = "grid_data_version"
+
+CREATE_VERSION_SQL = f"""
+CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO {VERSION_TABLE} (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+"""
+
+BUMP_VERSION_SQL = f"UPDATE {VERSION_TABLE} SET version = version + 1, updated_at = now();"
+
+
+def create_version_table(cur):
+    cur.execute(CREATE_VERSION_SQL)
+
+
+def bump_version(cur):
+    """在调用方的事务中把版本号加一 (提交时生效)。"""
+    cur.execute(BUMP_VERSION_SQL)
+
+
+def read_version(conn):
+    """当前已提交的版本号；表尚未建立时返回 None (调用方不做缓存)。"""
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    try:
+        cur.execute(f"SELECT version FROM {VERSION_TABLE};")
+        row = cur.fetchone()
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+    return row[0] if row is not None else None
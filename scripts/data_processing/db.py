@@ -0,0 +1,156 @@
+"""
+数据库连接的统一入口：连接参数、线程安全的连接池、服务端预备语句和 Flask 的按请求借还。
+
+连接参数只在这里从环境变量读取一次 (默认端口 5432，与 docker-compose.yml 一致)：
+    connect()            独立连接，供脚本和抓取进程中长期持有的连接使用
+    pool()               进程内共享的连接池，最多 DB_POOL_MAX 个后端连接；
+                         池满时借用方等待 (最多 DB_POOL_TIMEOUT 秒)，而不是再开新连接
+    execute_prepared()   热点查询在每个连接上 PREPARE 一次，之后只发送 EXECUTE
+    init_app(app)        Flask 每个请求从池中借一个连接，请求结束时归还 (request_connection)
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("POSTGRES_HOST", "localhost"),
+    "port": os.getenv("POSTGRES_PORT", "5432"),
+    "dbname": os.getenv("POSTGRES_DB", "gra_env_db"),
+    "user": os.getenv("POSTGRES_USER", "admin"),
+    "password": os.getenv("POSTGRES_PASSWORD", "secure_password_dev"),
+}
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """记录本连接上已经 PREPARE 过的语句名 (预备语句属于会话，随连接一起保留)。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect(**overrides):
+    """按统一配置建立一个独立连接；overrides 可覆盖任意参数 (例如 cursor_factory)。"""
+    return psycopg2.connect(**{**DB_CONFIG, "connection_factory": PreparingConnection, **overrides})
+
+
+def execute_prepared(cur, name, sql, params=()):
+    """
+    以预备语句执行 sql (参数写作 $1, $2 ...)。每个连接第一次遇到 name 时 PREPARE，
+    之后的调用省去解析和规划。返回 cur，便于链式 fetch。
+    """
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None or name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        if prepared is not None:
+            prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", tuple(params))
+    else:
+        cur.execute(f"EXECUTE {name}")
+    return cur
+
+
+class ConnectionPool:
+    """
+    ThreadedConnectionPool 加一个计数信号量：psycopg2 的池在耗尽时直接抛出 PoolError，
+    这里改为等待其他线程归还，后端连接数因此始终不超过 maxconn。
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._pool = pg_pool.ThreadedConnectionPool(
+            minconn, maxconn, **{**DB_CONFIG, "connection_factory": PreparingConnection, **kwargs})
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pg_pool.PoolError(f"no database connection available within {self.timeout}s")
+        try:
+            conn = self._pool.getconn()
+            if conn.closed:
+                # 服务器重启等原因断开的连接：丢弃并换一个新的
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            broken = bool(conn.closed)
+            if not broken and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                # 借用方没有提交的事务不能带给下一个使用者
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_kwargs = {}
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """进程内共享的连接池，第一次借用时才建立连接 (数据库未启动时导入模块不会失败)。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(**_pool_kwargs)
+            logging.info(f"Database pool ready (max {POOL_MAX} connections to "
+                         f"{DB_CONFIG['host']}:{DB_CONFIG['port']}).")
+        return _pool
+
+
+def request_connection():
+    """当前 Flask 请求的连接，同一请求内多次调用返回同一个连接，请求结束时由 init_app 的钩子归还。"""
+    from flask import g
+
+    if "db_conn" not in g:
+        g.db_conn = pool().getconn()
+    return g.db_conn
+
+
+def init_app(app, **pool_kwargs):
+    """
+    让 Flask 应用使用共享连接池，pool_kwargs (例如 cursor_factory) 传给池中的每个连接；
+    每个请求 (包括出错的请求) 结束时归还连接。
+    """
+    from flask import g
+
+    _pool_kwargs.update(pool_kwargs)
+
+    @app.teardown_appcontext
+    def _return_connection(exc):
+        conn = g.pop("db_conn", None)
+        if conn is not None:
+            pool().putconn(conn)
@@ -0,0 +1,168 @@
+"""
+抓取作业表 fetch_jobs：以 (chunk, 年份) 为粒度记录抓取进度，替代 fetch_progress.json 断点文件。
+
+多个抓取进程 (可以在不同主机上) 共用一张作业表：
+    seed_jobs    为网格登记全部作业，可重复执行，已有作业保持原状态
+    claim_job    领取下一个待处理作业及同一 chunk 紧随其后的连续年份 (FOR UPDATE SKIP LOCKED)
+    renew_lease  等待配额或排队期间续租
+    finish_job   标记完成或失败
+领取的作业带有租约 (lease_expires_at)；进程崩溃后租约过期，作业会被其他进程重新领取。
+续租和结束都只作用于 claimed_by 仍为本进程的作业，被接管的作业不会被旧进程改写。
+"""
+import logging
+import os
+import socket
+
+from psycopg2.extras import execute_values
+
+JOBS_TABLE = "fetch_jobs"
+
+# 作业以 (chunk, 年份) 为粒度，即一次 API 请求；经纬度随作业保存，
+# 这样不同进程即使网格生成顺序有变化，也能拿到同一批点。
+CREATE_JOBS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+    chunk_index INTEGER NOT NULL,
+    year SMALLINT NOT NULL,
+    latitudes FLOAT[] NOT NULL,
+    longitudes FLOAT[] NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    claimed_by VARCHAR(128),
+    lease_expires_at TIMESTAMPTZ,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (chunk_index, year)
+);
+CREATE INDEX IF NOT EXISTS {JOBS_TABLE}_status_idx ON {JOBS_TABLE} (status, chunk_index, year);
+"""
+
+DEFAULT_LEASE_SECONDS = int(os.getenv("FETCH_JOB_LEASE_SECONDS", "1800"))
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def create_jobs_table(cur):
+    cur.execute(CREATE_JOBS_SQL)
+
+
+def seed_jobs(conn, grid_points, years, chunk_size):
+    """为每个 (chunk, 年份) 登记作业；已存在的作业保持原状态。返回新增作业数。"""
+    lats = grid_points['latitude'].tolist()
+    lons = grid_points['longitude'].tolist()
+    rows = []
+    for i in range(0, len(lats), chunk_size):
+        for year in years:
+            rows.append((i // chunk_size, year, lats[i:i + chunk_size], lons[i:i + chunk_size]))
+    cur = conn.cursor()
+    execute_values(cur, f"""
+        INSERT INTO {JOBS_TABLE} (chunk_index, year, latitudes, longitudes)
+        VALUES %s
+        ON CONFLICT (chunk_index, year) DO NOTHING;
+    """, rows, page_size=1000)
+    created = cur.rowcount
+    conn.commit()
+    cur.close()
+    return created
+
+
+def _as_years(years):
+    return [years] if isinstance(years, int) else list(years)
+
+
+def claim_job(conn, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, max_years=1):
+    """
+    领取下一个待处理作业 (或租约已过期的作业)，并顺带领取同一 chunk 紧随其后的
+    连续年份作业，最多 max_years 个，以便合并成一个多年请求。
+    返回 (chunk_index, [years], lats, lons) 或 None。
+
+    FOR UPDATE SKIP LOCKED 保证多个抓取进程并发领取时互不阻塞、不会重复领取。
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH first_job AS (
+            SELECT chunk_index, year FROM {JOBS_TABLE}
+            WHERE status = 'pending' OR (status = 'claimed' AND lease_expires_at < now())
+            ORDER BY chunk_index, year
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        ), candidates AS (
+            SELECT j.chunk_index, j.year FROM {JOBS_TABLE} j, first_job f
+            WHERE j.chunk_index = f.chunk_index AND j.year >= f.year AND j.year < f.year + %s
+              AND (j.status = 'pending' OR (j.status = 'claimed' AND j.lease_expires_at < now()))
+            FOR UPDATE OF j SKIP LOCKED
+        ), run AS (
+            -- 只保留从第一个作业开始不间断的年份
+            SELECT c.chunk_index, c.year FROM (
+                SELECT chunk_index, year, year - row_number() OVER (ORDER BY year) AS grp FROM candidates
+            ) c, first_job f
+            WHERE c.grp = f.year - 1
+        )
+        UPDATE {JOBS_TABLE} j SET
+            status = 'claimed',
+            claimed_by = %s,
+            lease_expires_at = now() + make_interval(secs => %s),
+            attempts = j.attempts + 1,
+            updated_at = now()
+        FROM run
+        WHERE j.chunk_index = run.chunk_index AND j.year = run.year
+        RETURNING j.chunk_index, j.year, j.latitudes, j.longitudes;
+    """, (max_years, worker_id, lease_seconds))
+    rows = sorted(cur.fetchall(), key=lambda row: row[1])
+    conn.commit()
+    cur.close()
+    if not rows:
+        return None
+    chunk_index, _, lats, lons = rows[0]
+    return chunk_index, [row[1] for row in rows], lats, lons
+
+
+def renew_lease(conn, chunk_index, years, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """长时间等待配额时续租，防止作业被其他进程当作失联而重新领取。years 可为单个年份或列表。"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {JOBS_TABLE} SET lease_expires_at = now() + make_interval(secs => %s), updated_at = now()
+        WHERE chunk_index = %s AND year = ANY(%s) AND claimed_by = %s AND status = 'claimed';
+    """, (lease_seconds, chunk_index, _as_years(years), worker_id))
+    renewed = cur.rowcount > 0
+    conn.commit()
+    cur.close()
+    return renewed
+
+
+def finish_job(conn, chunk_index, years, worker_id, ok, error=None):
+    """标记作业完成或失败；作业已被其他进程接管时不做修改 (数据写入本身是幂等的)。"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {JOBS_TABLE} SET status = %s, last_error = %s, lease_expires_at = NULL, updated_at = now()
+        WHERE chunk_index = %s AND year = ANY(%s) AND claimed_by = %s;
+    """, ('done' if ok else 'failed', None if ok else (str(error)[:1000] if error else None),
+          chunk_index, _as_years(years), worker_id))
+    conn.commit()
+    cur.close()
+
+
+def reset_failed_jobs(conn):
+    cur = conn.cursor()
+    cur.execute(f"UPDATE {JOBS_TABLE} SET status = 'pending', updated_at = now() WHERE status = 'failed';")
+    n = cur.rowcount
+    conn.commit()
+    cur.close()
+    return n
+
+
+def job_summary(conn):
+    """返回 {status: 作业数}。"""
+    cur = conn.cursor()
+    cur.execute(f"SELECT status, count(*) FROM {JOBS_TABLE} GROUP BY status;")
+    summary = dict(cur.fetchall())
+    conn.commit()
+    cur.close()
+    return summary
+
+
+def log_job_summary(conn):
+    summary = job_summary(conn)
+    logging.info("Fetch jobs: " + ", ".join(f"{k}={v}" for k, v in sorted(summary.items())))
+    return summary
@@ -0,0 +1,56 @@
+from dataclasses import dataclass, field
+from datetime import date
+
+from hourly_batch import HOURLY_VARIABLES
+from rate_limiter import request_weight
+
+
+@dataclass
+class FetchRequest:
+    """
+    一次 Open-Meteo archive 请求：若干网格点 × 一段连续日期 × 一组小时变量。
+
+    points 为请求坐标 [(lat, lon), ...]，入库时作为清单的键。
+    tag 由调用方自定义 (例如 chunk 起始下标)，用于完成回调。
+    """
+
+    points: list
+    start_date: date
+    end_date: date
+    variables: tuple = tuple(HOURLY_VARIABLES)
+    tag: object = None
+    attempt: int = field(default=0, compare=False)
+
+    @classmethod
+    def for_years(cls, points, start_year, end_year=None, variables=None, tag=None):
+        return cls(list(points), date(start_year, 1, 1), date(end_year or start_year, 12, 31),
+                   tuple(variables or HOURLY_VARIABLES), tag)
+
+    @property
+    def lats(self):
+        return [p[0] for p in self.points]
+
+    @property
+    def lons(self):
+        return [p[1] for p in self.points]
+
+    @property
+    def n_days(self):
+        return (self.end_date - self.start_date).days + 1
+
+    @property
+    def weight(self):
+        """按 Open-Meteo 分数调用规则估算的 API 调用数。"""
+        return request_weight(len(self.points), self.n_days, len(self.variables))
+
+    def params(self):
+        return {
+            "latitude": self.lats,
+            "longitude": self.lons,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "hourly": list(self.variables)
+        }
+
+    def describe(self):
+        return f"{len(self.points)} point(s) {self.start_date}..{self.end_date} [{len(self.variables)} vars]"
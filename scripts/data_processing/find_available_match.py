@@ -1,29 +1,21 @@
 
-import os
 import pandas as pd
-import psycopg2
 from dotenv import load_dotenv
+from db import connect
 
 load_dotenv()
 
-DB_CONFIG = {
-    "host": os.getenv("POSTGRES_HOST", "localhost"),
-    "port": os.getenv("POSTGRES_PORT", "5432"),
-    "dbname": os.getenv("POSTGRES_DB", "gra_env_db"),
-    "user": os.getenv("POSTGRES_USER", "admin"),
-    "password": os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-}
-
 def find_available_matches():
     print("--- 扫描数据库中的 Open-Meteo 数据范围 ---")
-    conn = psycopg2.connect(**DB_CONFIG)
+    conn = connect()
     
     # 1. 获取数据库中已有的所有不重复网格点 (Lat, Lon)
     # 只需要查询最近几年的数据即可判断覆盖范围
     query = """
-    SELECT DISTINCT latitude, longitude 
-    FROM grid_weather_data 
-    WHERE timestamp >= '2020-01-01'
+    SELECT c.latitude, c.longitude
+    FROM grid_cell c
+    WHERE EXISTS (SELECT 1 FROM grid_weather_data g
+                  WHERE g.cell_id = c.id AND g.timestamp >= '2020-01-01')
     """
     df_om = pd.read_sql_query(query, conn)
     conn.close()
@@ -0,0 +1,407 @@
+"""
+网格单元维表 grid_cell 与坐标 -> cell_id 的缓存查找。
+
+每个请求网格点 (generate_ncp_grid 给出的坐标) 对应一个整数 id，同时记录
+Open-Meteo 吸附后的规范坐标和海拔。小时表以 (cell_id, timestamp) 为唯一键，
+点查询是整数等值查找，不再需要 latitude BETWEEN x - 0.1 AND x + 0.1 这样的范围扫描
+(范围框还可能把相邻网格一起匹配进来)。
+
+旧表结构的数据需要显式迁移 (为旧行补 cell_id、合并坐标归并后重复的行、替换唯一约束)。
+迁移分批提交，中断后重新运行会从未完成的部分继续；迁移期间请停止抓取进程:
+    python scripts/data_processing/grid_cells.py migrate [--batch-rows 200000]
+    python scripts/data_processing/grid_cells.py status
+迁移完成前 create_grid_table 会报错并提示运行上面的命令。
+"""
+import argparse
+import logging
+import threading
+
+import numpy as np
+from psycopg2.extensions import cursor as tuple_cursor
+from psycopg2.extras import execute_values
+
+GRID_CELL_TABLE = "grid_cell"
+HOURLY_TABLE = "grid_weather_data"
+
+CREATE_GRID_CELL_SQL = f"""
+CREATE TABLE IF NOT EXISTS {GRID_CELL_TABLE} (
+    id SERIAL PRIMARY KEY,
+    request_latitude FLOAT NOT NULL,
+    request_longitude FLOAT NOT NULL,
+    latitude FLOAT,
+    longitude FLOAT,
+    elevation FLOAT,
+    UNIQUE (request_latitude, request_longitude)
+);
+CREATE INDEX IF NOT EXISTS {GRID_CELL_TABLE}_latlon_idx ON {GRID_CELL_TABLE} (latitude, longitude);
+"""
+
+# 旧表结构以浮点坐标为唯一键，迁移完成后由 (cell_id, timestamp) 取代
+LEGACY_UNIQUE_CONSTRAINT = "grid_weather_data_latitude_longitude_timestamp_key"
+CELL_UNIQUE_INDEX = "grid_weather_data_cell_id_timestamp_key"
+# 迁移期间的 (存储坐标 -> cell_id) 映射，跨批次、跨中断保留，迁移完成后删除
+MIGRATION_TABLE = "grid_cell_migration"
+MIGRATION_BATCH_ROWS = 200_000
+
+
+def create_grid_cell_table(cur):
+    cur.execute(CREATE_GRID_CELL_SQL)
+
+
+def _key(lat, lon):
+    # 坐标来自不同的浮点来源 (CSV、numpy、float4 响应)，按 4 位小数归一
+    return round(float(lat), 4), round(float(lon), 4)
+
+
+class CellIndex:
+    """
+    grid_cell 的进程内缓存。表很小 (几百行)，首次使用时整表读入；
+    未命中时重新读取一次，以发现其他进程新登记的单元。
+    """
+
+    def __init__(self):
+        self._by_request = {}
+        self._by_canonical = {}
+        self._cells = {}  # id -> (request_lat, request_lon, lat, lon, elevation)
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cells)
+
+    def _remember(self, cell_id, req_lat, req_lon, lat=None, lon=None, elevation=None):
+        self._cells[cell_id] = (req_lat, req_lon, lat, lon, elevation)
+        self._by_request[_key(req_lat, req_lon)] = cell_id
+        if lat is not None and lon is not None:
+            self._by_canonical.setdefault(_key(lat, lon), cell_id)
+
+    def refresh(self, conn):
+        cur = conn.cursor(cursor_factory=tuple_cursor)
+        cur.execute(f"""
+            SELECT id, request_latitude, request_longitude, latitude, longitude, elevation
+            FROM {GRID_CELL_TABLE};
+        """)
+        rows = cur.fetchall()
+        cur.close()
+        with self._lock:
+            self._by_request.clear()
+            self._by_canonical.clear()
+            self._cells.clear()
+            for row in rows:
+                self._remember(*row)
+            self._loaded = True
+        return len(rows)
+
+    def cell(self, cell_id):
+        """返回 (request_lat, request_lon, lat, lon, elevation)，未知 id 返回 None。"""
+        return self._cells.get(cell_id)
+
+    def _match(self, lat, lon, tolerance):
+        key = _key(lat, lon)
+        cell_id = self._by_request.get(key, self._by_canonical.get(key))
+        if cell_id is not None or not tolerance:
+            return cell_id
+        # 站点等任意坐标：取规范坐标最近的单元，两个方向都不超过 tolerance
+        best, best_d = None, None
+        for cid, (req_lat, req_lon, c_lat, c_lon, _) in self._cells.items():
+            c_lat = req_lat if c_lat is None else c_lat
+            c_lon = req_lon if c_lon is None else c_lon
+            if abs(c_lat - lat) > tolerance or abs(c_lon - lon) > tolerance:
+                continue
+            d = (c_lat - lat) ** 2 + (c_lon - lon) ** 2
+            if best_d is None or d < best_d:
+                best, best_d = cid, d
+        return best
+
+    def lookup(self, conn, lat, lon, tolerance=0.1):
+        """
+        坐标 -> cell_id。先按请求坐标或规范坐标精确匹配，再在 ±tolerance 内取最近的单元；
+        找不到时返回 None。
+        """
+        if not self._loaded:
+            self.refresh(conn)
+        cell_id = self._match(lat, lon, 0)
+        if cell_id is None:
+            self.refresh(conn)
+            cell_id = self._match(lat, lon, tolerance)
+        return cell_id
+
+    def register(self, conn, batch):
+        """
+        在当前事务中登记 batch 里尚未缓存的请求点，返回新登记的 [(id, 请求坐标, 规范坐标, 海拔)]。
+
+        调用方在事务提交后用 remember() 写入缓存；回滚时这些单元不会进入缓存，
+        下次加载会再次登记 (ON CONFLICT 使其幂等)。
+        """
+        if not len(batch):
+            return []
+        if not self._loaded:
+            self.refresh(conn)
+        points = np.stack([batch.request_latitude, batch.request_longitude,
+                           batch.latitude, batch.longitude, batch.elevation], axis=1)
+        # 按 _key 去重：只差浮点误差的请求坐标登记为同一个单元
+        _, first = np.unique(np.round(points[:, :2], 4), axis=0, return_index=True)
+        rows = [tuple(None if np.isnan(v) else float(v) for v in points[k]) for k in sorted(first)]
+        rows = [r for r in rows if _key(r[0], r[1]) not in self._by_request]
+        if not rows:
+            return []
+        cur = conn.cursor(cursor_factory=tuple_cursor)
+        registered = execute_values(cur, f"""
+            INSERT INTO {GRID_CELL_TABLE} (request_latitude, request_longitude, latitude, longitude, elevation)
+            VALUES %s
+            ON CONFLICT (request_latitude, request_longitude) DO UPDATE SET
+                latitude = COALESCE({GRID_CELL_TABLE}.latitude, EXCLUDED.latitude),
+                longitude = COALESCE({GRID_CELL_TABLE}.longitude, EXCLUDED.longitude),
+                elevation = COALESCE({GRID_CELL_TABLE}.elevation, EXCLUDED.elevation)
+            RETURNING id, request_latitude, request_longitude, latitude, longitude, elevation;
+        """, rows, fetch=True)
+        cur.close()
+        return registered
+
+    def resolve(self, batch, registered=()):
+        """
+        batch 每一行的 cell_id (int32 数组)，由缓存和本事务刚登记的单元 (register 的返回值) 查得。
+
+        加载器把结果随数据 COPY 进暂存表，合并时按整数 cell_id 写入，不再在 SQL 中按浮点坐标关联；
+        有请求点找不到单元时抛出 ValueError，而不是让这些行在合并中消失。
+        """
+        if not len(batch):
+            return np.empty(0, dtype=np.int32)
+        known = {_key(row[1], row[2]): row[0] for row in registered}
+        keys, inverse = np.unique(np.round(np.stack([batch.request_latitude, batch.request_longitude], axis=1), 4),
+                                  axis=0, return_inverse=True)
+        ids = np.empty(len(keys), dtype=np.int32)
+        with self._lock:
+            for k, (lat, lon) in enumerate(keys):
+                key = _key(lat, lon)
+                cell_id = known.get(key, self._by_request.get(key))
+                if cell_id is None:
+                    raise ValueError(f"No grid cell registered for request point ({lat}, {lon}).")
+                ids[k] = cell_id
+        return ids[inverse.reshape(-1)]
+
+    def remember(self, registered):
+        with self._lock:
+            for row in registered:
+                self._remember(*row)
+
+
+# 进程内共享的缓存 (加载器、Flask 接口和脚本共用)
+cell_index = CellIndex()
+
+
+def lookup_cell(conn, lat, lon, tolerance=0.1):
+    return cell_index.lookup(conn, lat, lon, tolerance)
+
+
+def hourly_cells_pending(cur):
+    """小时表是否还有待迁移的行 (cell_id 列缺失或尚未 NOT NULL)；紧凑存储的物理表从建立起就以 cell_id 为键。"""
+    from compact_storage import compact_enabled
+
+    if compact_enabled(cur):
+        return False
+    cur.execute("""
+        SELECT is_nullable FROM information_schema.columns
+        WHERE table_name = %s AND column_name = 'cell_id';
+    """, (HOURLY_TABLE,))
+    row = cur.fetchone()
+    return row is None or row[0] == "YES"
+
+
+def check_hourly_cells(cur):
+    """create_grid_table 的检查：旧表结构未迁移时加载器无法按 (cell_id, timestamp) 合并，直接报错。"""
+    if hourly_cells_pending(cur):
+        raise RuntimeError(f"{HOURLY_TABLE} has rows without cell_id; stop the fetchers and run "
+                           f"`python scripts/data_processing/grid_cells.py migrate` first.")
+
+
+def _map_stored_coordinates(conn, cur, grid_points, tolerance):
+    """
+    把尚未映射的存储坐标匹配到单元并写入 MIGRATION_TABLE，返回新映射的坐标数。
+
+    旧行只有吸附后的坐标：按 ±tolerance 匹配回最近的请求网格点 (与 rebuild_manifest 相同)，
+    匹配不到的坐标自身登记为一个单元。多个存储坐标可能归并到同一个请求点 (即同一个单元)。
+    """
+    cur.execute(f"""
+        SELECT DISTINCT g.latitude, g.longitude FROM {HOURLY_TABLE} g
+        WHERE g.cell_id IS NULL AND NOT EXISTS (
+            SELECT 1 FROM {MIGRATION_TABLE} m WHERE m.latitude = g.latitude AND m.longitude = g.longitude
+        );
+    """)
+    stored = cur.fetchall()
+    if not stored:
+        return 0
+    if grid_points is None:
+        from generate_grid import generate_ncp_grid
+        grid_points = generate_ncp_grid()
+    points = list(zip(grid_points['latitude'].tolist(), grid_points['longitude'].tolist()))
+    cells = CellIndex()
+    cells.refresh(conn)
+    requests = {}  # 请求点 -> 第一个归并到它的存储坐标 (作为规范坐标)
+    mapping = []
+    for lat, lon in stored:
+        nearest = min(points, key=lambda p: (p[0] - lat) ** 2 + (p[1] - lon) ** 2)
+        if abs(nearest[0] - lat) > tolerance or abs(nearest[1] - lon) > tolerance:
+            nearest = (lat, lon)
+        requests.setdefault(_key(*nearest), (nearest[0], nearest[1], lat, lon))
+        mapping.append((lat, lon, _key(*nearest)))
+    # 已登记的单元 (按 _key 比较) 直接沿用；同一请求点在一条 INSERT 中只出现一次
+    new_cells = [row for key, row in requests.items() if key not in cells._by_request]
+    if new_cells:
+        cells.remember(execute_values(cur, f"""
+            INSERT INTO {GRID_CELL_TABLE} (request_latitude, request_longitude, latitude, longitude)
+            VALUES %s
+            ON CONFLICT (request_latitude, request_longitude) DO UPDATE SET
+                latitude = COALESCE({GRID_CELL_TABLE}.latitude, EXCLUDED.latitude),
+                longitude = COALESCE({GRID_CELL_TABLE}.longitude, EXCLUDED.longitude)
+            RETURNING id, request_latitude, request_longitude, latitude, longitude, elevation;
+        """, new_cells, fetch=True))
+    execute_values(cur, f"""
+        INSERT INTO {MIGRATION_TABLE} (latitude, longitude, cell_id) VALUES %s
+        ON CONFLICT (latitude, longitude) DO NOTHING;
+    """, [(lat, lon, cells._by_request[key]) for lat, lon, key in mapping])
+    conn.commit()
+    return len(mapping)
+
+
+def _assign_cell_ids(conn, cur, batch_rows):
+    """按 id 区间分批为旧行写入 cell_id，每批一个事务；返回更新的行数。"""
+    cur.execute(f"SELECT min(id), max(id) FROM {HOURLY_TABLE} WHERE cell_id IS NULL;")
+    lo, hi = cur.fetchone()
+    if lo is None:
+        return 0
+    migrated = 0
+    for start in range(lo, hi + 1, batch_rows):
+        cur.execute(f"""
+            UPDATE {HOURLY_TABLE} g SET cell_id = m.cell_id
+            FROM {MIGRATION_TABLE} m
+            WHERE g.id >= %s AND g.id < %s AND g.cell_id IS NULL
+              AND g.latitude = m.latitude AND g.longitude = m.longitude;
+        """, (start, start + batch_rows))
+        migrated += cur.rowcount
+        conn.commit()
+        logging.info(f"  Assigned cell_id up to id {min(start + batch_rows, hi + 1) - 1}/{hi} ({migrated} rows).")
+    return migrated
+
+
+def _merge_collapsed_rows(conn, cur):
+    """
+    多个存储坐标归并到同一单元时，(cell_id, timestamp) 可能重复，唯一索引会建立失败。
+    每组保留 id 最小的行，用其余行按 id 顺序填补其 NULL 值后删除其余行；每个单元一个事务。
+    返回删除的行数。
+    """
+    from hourly_batch import VARIABLE_COLUMNS
+
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND column_name = ANY(%s);
+    """, (HOURLY_TABLE, list(VARIABLE_COLUMNS.values())))
+    columns = [row[0] for row in cur.fetchall()]
+    firsts = ", ".join(f"(array_agg({c} ORDER BY id) FILTER (WHERE {c} IS NOT NULL))[1] AS {c}" for c in columns)
+    fill = ", ".join(f"{c} = COALESCE(g.{c}, d.{c})" for c in columns)
+    cur.execute(f"SELECT cell_id FROM {MIGRATION_TABLE} GROUP BY cell_id HAVING count(*) > 1 ORDER BY cell_id;")
+    removed = 0
+    for (cell_id,) in cur.fetchall():
+        # 存储坐标条件让查找走旧的 (latitude, longitude, timestamp) 唯一索引
+        cur.execute(f"""
+            WITH d AS (
+                SELECT timestamp, min(id) AS keep_id, {firsts}
+                FROM {HOURLY_TABLE}
+                WHERE cell_id = %(cell)s AND (latitude, longitude) IN (
+                    SELECT latitude, longitude FROM {MIGRATION_TABLE} WHERE cell_id = %(cell)s
+                )
+                GROUP BY timestamp
+                HAVING count(*) > 1
+            ), kept AS (
+                UPDATE {HOURLY_TABLE} g SET {fill} FROM d WHERE g.id = d.keep_id
+            )
+            DELETE FROM {HOURLY_TABLE} g USING d
+            WHERE g.cell_id = %(cell)s AND g.timestamp = d.timestamp AND g.id <> d.keep_id;
+        """, {"cell": cell_id})
+        removed += cur.rowcount
+        conn.commit()
+    return removed
+
+
+def migrate_hourly_cells(conn, grid_points=None, tolerance=0.1, batch_rows=MIGRATION_BATCH_ROWS):
+    """
+    为小时表补 cell_id 列并迁移旧数据。每一步都单独提交，中断后重新运行从未完成的部分继续。
+
+    1. 加 cell_id 列，把存储坐标映射到单元 (MIGRATION_TABLE)
+    2. 按 id 区间分批写入 cell_id
+    3. 合并归并到同一单元后重复的 (cell_id, timestamp) 行
+    4. 建立 (cell_id, timestamp) 唯一索引、cell_id 设为 NOT NULL，删除旧的浮点坐标唯一约束
+    返回 (写入 cell_id 的行数, 合并删除的行数)。
+    """
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    create_grid_cell_table(cur)
+    if not hourly_cells_pending(cur):
+        conn.commit()
+        cur.close()
+        return 0, 0
+    # 不加外键：每行一次外键检查会拖慢批量合并，单元只由加载器登记
+    cur.execute(f"ALTER TABLE {HOURLY_TABLE} ADD COLUMN IF NOT EXISTS cell_id INTEGER;")
+    # 待迁移行的部分索引，迁移完成后删除
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {HOURLY_TABLE}_cell_pending_idx
+        ON {HOURLY_TABLE} (latitude, longitude) WHERE cell_id IS NULL;
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATION_TABLE} (
+            latitude FLOAT NOT NULL,
+            longitude FLOAT NOT NULL,
+            cell_id INTEGER NOT NULL,
+            PRIMARY KEY (latitude, longitude)
+        );
+    """)
+    conn.commit()
+
+    mapped = _map_stored_coordinates(conn, cur, grid_points, tolerance)
+    logging.info(f"Mapped {mapped} stored coordinates to grid cells.")
+    migrated = _assign_cell_ids(conn, cur, batch_rows)
+    cur.execute(f"SELECT count(*) FROM {HOURLY_TABLE} WHERE cell_id IS NULL;")
+    left = cur.fetchone()[0]
+    if left:
+        raise RuntimeError(f"{left} {HOURLY_TABLE} rows still have no cell_id; re-run the migration.")
+    removed = _merge_collapsed_rows(conn, cur)
+    if removed:
+        logging.warning(f"Merged {removed} rows whose coordinates collapsed onto the same cell; "
+                        f"run grid_stats.py rebuild and rollups.py to refresh derived tables.")
+
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {CELL_UNIQUE_INDEX} ON {HOURLY_TABLE} (cell_id, timestamp);")
+    # SET NOT NULL 需要全表校验，只在迁移最后执行一次
+    cur.execute(f"ALTER TABLE {HOURLY_TABLE} ALTER COLUMN cell_id SET NOT NULL;")
+    cur.execute(f"ALTER TABLE {HOURLY_TABLE} DROP CONSTRAINT IF EXISTS {LEGACY_UNIQUE_CONSTRAINT};")
+    cur.execute(f"DROP INDEX IF EXISTS {HOURLY_TABLE}_cell_pending_idx;")
+    cur.execute(f"DROP TABLE IF EXISTS {MIGRATION_TABLE};")
+    conn.commit()
+    cur.close()
+    return migrated, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate grid_weather_data to cell_id keys.")
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--batch-rows", type=int, default=MIGRATION_BATCH_ROWS,
+                        help="rows per committed UPDATE batch")
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    if args.command == "migrate":
+        migrated, removed = migrate_hourly_cells(conn, batch_rows=args.batch_rows)
+        logging.info(f"Assigned cell_id to {migrated} rows; merged {removed} duplicate rows.")
+        fetcher.create_grid_table(conn)
+    cur = conn.cursor()
+    pending = hourly_cells_pending(cur)
+    cur.close()
+    conn.commit()
+    cell_index.refresh(conn)
+    logging.info(f"{len(cell_index)} grid cells registered; migration {'pending' if pending else 'complete'}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
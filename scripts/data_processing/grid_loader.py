@@ -0,0 +1,283 @@
+import io
+import logging
+import struct
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from compact_storage import COMPACT_TABLE, compact_enabled, encode_sql
+from data_version import bump_version
+from grid_cells import cell_index
+from grid_stats import stats_upsert_sql
+from hourly_batch import VARIABLE_COLUMNS
+from ingest_manifest import manifest_refresh_sql
+from live_events import ingest_notify_sql
+from rollups import refresh_rollups, staged_ranges_sql
+
+# PostgreSQL 二进制 COPY 文件头 / 结束标记
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+
+# HourlyBatch 在暂存表中的固定前导列 (之后是 batch.columns)；cell_id 由 CellIndex.resolve 给出
+BATCH_KEY_COLUMNS = ["latitude", "longitude", "epoch", "request_latitude", "request_longitude", "cell_id"]
+_KEY_TYPES = {"epoch": (">i8", "BIGINT"), "cell_id": (">i4", "INTEGER")}
+
+
+def batch_to_binary_copy(batch, cell_ids):
+    """
+    把 HourlyBatch 和每行的 cell_id 编码为 COPY ... (FORMAT binary) 的字节流。
+
+    每一行都是定长记录 (字段数 + 各字段的 长度/值)，因此可以用一个大端结构化
+    numpy 数组一次性填充，全程不产生逐行的 Python 对象。
+    字段顺序: BATCH_KEY_COLUMNS, batch.columns...
+    """
+    fields = [("nfields", ">i2")]
+    for name in BATCH_KEY_COLUMNS:
+        fields += [(f"len_{name}", ">i4"), (name, _KEY_TYPES.get(name, (">f8",))[0])]
+    for k in range(len(batch.columns)):
+        fields += [(f"len_v{k}", ">i4"), (f"v{k}", ">f8")]
+    dtype = np.dtype(fields)
+    records = np.empty(len(batch), dtype=dtype)
+
+    records["nfields"] = len(BATCH_KEY_COLUMNS) + len(batch.columns)
+    for name, _ in fields:
+        if name.startswith("len_"):
+            records[name] = dtype[name[4:]].itemsize
+    for name in BATCH_KEY_COLUMNS:
+        records[name] = cell_ids if name == "cell_id" else getattr(batch, name)
+    for k in range(len(batch.columns)):
+        # float32 -> float64 与原先 float(row[...]) 得到的值完全一致 (NaN 仍写为 NaN)
+        records[f"v{k}"] = batch.values[:, k]
+
+    return _PGCOPY_HEADER + records.tobytes() + _PGCOPY_TRAILER
+
+
+def rows_to_text_copy(rows):
+    """把少量行元组编码为 COPY 文本格式 (None -> \\N)。"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+
+class StagedCopyLoader(ABC):
+    """
+    COPY -> UNLOGGED 暂存表 -> 一条集合语句合并到目标表。
+    子类给出 target_table / staging_table / staging_columns 并实现 merge_sql。
+
+    暂存表由所有写入进程共享，每行带 load_id (默认 pg_backend_pid())；
+    合并和清理都只作用于本连接写入的行，并与 COPY 处在同一个事务中，
+    因此多个抓取进程可以同时写入，崩溃时暂存数据也会随事务一起回滚。
+    """
+
+    target_table = None
+    staging_table = None
+    staging_columns = ()  # [(列名, 类型), ...]
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._staging_ready = False
+
+    def ensure_staging(self):
+        if self._staging_ready:
+            return
+        column_defs = ",\n".join(f"{name} {col_type}" for name, col_type in self.staging_columns)
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            CREATE UNLOGGED TABLE IF NOT EXISTS {self.staging_table} (
+                load_id INTEGER NOT NULL DEFAULT pg_backend_pid(),
+                {column_defs}
+            );
+        """)
+        # 暂存表结构随版本演进时补齐新列
+        for name, col_type in self.staging_columns:
+            cur.execute(f"ALTER TABLE {self.staging_table} ADD COLUMN IF NOT EXISTS {name} {col_type};")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {self.staging_table}_load_id_idx ON {self.staging_table} (load_id);")
+        self.conn.commit()
+        cur.close()
+        self._staging_ready = True
+
+    @abstractmethod
+    def merge_sql(self, columns):
+        """把本连接暂存的行 (load_id = pg_backend_pid()) 合并到目标表的语句。"""
+
+    def merged_rows(self, cur):
+        """合并语句执行后的实际插入/更新行数。"""
+        return cur.rowcount
+
+    def after_merge(self, cur, columns):
+        """子类钩子：在同一事务内、清理暂存行之前执行。"""
+
+    def load_buffer(self, columns, buffer, binary=False, commit=True):
+        """COPY 一批数据并合并，返回目标表实际插入/更新的行数。"""
+        self.ensure_staging()
+        fmt = "binary" if binary else "text"
+        cur = self.conn.cursor()
+        try:
+            cur.copy_expert(
+                f"COPY {self.staging_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT {fmt})",
+                io.BytesIO(buffer) if binary else buffer,
+            )
+            cur.execute(self.merge_sql(columns))
+            affected = self.merged_rows(cur)
+            self.after_merge(cur, columns)
+            cur.execute(f"DELETE FROM {self.staging_table} WHERE load_id = pg_backend_pid();")
+            if commit:
+                self.conn.commit()
+            return affected
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+class GridWeatherLoader(StagedCopyLoader):
+    """
+    grid_weather_data 的批量加载器。
+
+    新行直接插入；已存在的行保留原值，只填补本批数据所含列中仍为 NULL 的值
+    (例如表结构新增列之后的补抓)，没有可填补的列时不改写该行。
+    新的网格点在同一事务中登记，每行的 cell_id 在 Python 中由 CellIndex 查得并随数据 COPY，
+    以 (cell_id, timestamp) 去重。grid_stats 的按年计数由合并语句 RETURNING 的新行在同一条语句中累加；
+    合并之后在同一事务内按目标表重算本批涉及的 (单元, 年份) 的 grid_ingest_manifest 计数，
+    并重算本批涉及日期的 grid_daily / grid_monthly (rollups=False 时跳过，例如大批量回放后再统一 rebuild_rollups)。
+    有新行时发出 NOTIFY grid_ingest，提交后推送给看板 (见 live_events)；数据有变化时版本号加一 (见 data_version)。
+    迁移到紧凑存储后 (见 compact_storage) 直接向 grid_weather_compact 写入编码值。
+    """
+
+    target_table = "grid_weather_data"
+    staging_table = "grid_weather_staging"
+    staging_columns = [(name, _KEY_TYPES.get(name, (None, "FLOAT"))[1]) for name in BATCH_KEY_COLUMNS] + \
+        [(col, "FLOAT") for col in VARIABLE_COLUMNS.values()]
+
+    compact = False
+    _merged = 0
+
+    def __init__(self, conn, cells=cell_index, rollups=True):
+        super().__init__(conn)
+        self.cells = cells
+        self.rollups = rollups
+
+    def ensure_staging(self):
+        if self._staging_ready:
+            return
+        cur = self.conn.cursor()
+        self.compact = compact_enabled(cur)
+        cur.close()
+        super().ensure_staging()
+
+    def merge_sql(self, columns):
+        value_columns = columns[len(BATCH_KEY_COLUMNS):]
+        upsert = self._compact_merge_sql(value_columns) if self.compact else self._merge_sql(value_columns)
+        # xmax = 0 表示本语句新插入的行 (被更新的行 xmax 为本事务 id)，新行数累加到 grid_stats，
+        # 并通知看板 (NOTIFY 在提交时才送达)
+        return f"""
+            WITH merged AS (
+                {upsert.rstrip().rstrip(";")}
+                RETURNING timestamp, (xmax = 0) AS inserted
+            ), stats AS (
+                {stats_upsert_sql("merged")}
+            )
+            SELECT count(*), {ingest_notify_sql("merged").strip()} FROM merged;
+        """
+
+    def merged_rows(self, cur):
+        self._merged = cur.fetchone()[0]
+        return self._merged
+
+    @staticmethod
+    def _distinct_order(value_columns):
+        # 同一批中 (cell_id, epoch) 重复 (两个请求点落入同一单元、请求年份重叠) 时 DISTINCT ON 只保留
+        # 非空值最多的一行，否则 ON CONFLICT DO UPDATE 会因同一行被更新两次而使整批回滚
+        return f"ORDER BY s.cell_id, s.epoch, num_nonnulls({', '.join('s.' + c for c in value_columns)}) DESC"
+
+    def _merge_sql(self, value_columns):
+        target = self.target_table
+        fill = ",\n                ".join(f"{c} = COALESCE({target}.{c}, EXCLUDED.{c})" for c in value_columns)
+        fillable = " OR ".join(f"({target}.{c} IS NULL AND EXCLUDED.{c} IS NOT NULL)" for c in value_columns)
+        # to_timestamp() 得到 timestamptz，按会话时区落入 TIMESTAMP 列
+        return f"""
+            INSERT INTO {target} (cell_id, latitude, longitude, timestamp, {", ".join(value_columns)})
+            SELECT DISTINCT ON (s.cell_id, s.epoch)
+                   s.cell_id, s.latitude, s.longitude, to_timestamp(s.epoch), {", ".join("s." + c for c in value_columns)}
+            FROM {self.staging_table} s
+            WHERE s.load_id = pg_backend_pid()
+            {self._distinct_order(value_columns)}
+            ON CONFLICT (cell_id, timestamp) DO UPDATE SET
+                {fill}
+            WHERE {fillable};
+        """
+
+    def _compact_merge_sql(self, value_columns):
+        # 与上面的语义相同，只是写入编码后的值，不再存经纬度
+        target = COMPACT_TABLE
+        fill = ",\n                ".join(f"{c} = COALESCE({target}.{c}, EXCLUDED.{c})" for c in value_columns)
+        fillable = " OR ".join(f"({target}.{c} IS NULL AND EXCLUDED.{c} IS NOT NULL)" for c in value_columns)
+        return f"""
+            INSERT INTO {target} (cell_id, timestamp, {", ".join(value_columns)})
+            SELECT DISTINCT ON (s.cell_id, s.epoch)
+                   s.cell_id, to_timestamp(s.epoch), {", ".join(encode_sql("s." + c, c) for c in value_columns)}
+            FROM {self.staging_table} s
+            WHERE s.load_id = pg_backend_pid()
+            {self._distinct_order(value_columns)}
+            ON CONFLICT (cell_id, timestamp) DO UPDATE SET
+                {fill}
+            WHERE {fillable};
+        """
+
+    def after_merge(self, cur, columns):
+        target = COMPACT_TABLE if self.compact else self.target_table
+        cur.execute(manifest_refresh_sql(self.staging_table, target, columns[len(BATCH_KEY_COLUMNS):]))
+        if self.rollups:
+            refresh_rollups(cur, staged_ranges_sql(self.staging_table))
+        if self._merged:
+            # 最后一步加版本号：版本行的锁只持有到提交为止
+            bump_version(cur)
+
+    def load(self, batch, commit=True):
+        if not len(batch):
+            return 0
+        columns = BATCH_KEY_COLUMNS + list(batch.columns)
+        try:
+            registered = self.cells.register(self.conn, batch)
+            cell_ids = self.cells.resolve(batch, registered)
+        except Exception:
+            self.conn.rollback()
+            raise
+        inserted = self.load_buffer(columns, batch_to_binary_copy(batch, cell_ids), binary=True, commit=commit)
+        if commit:
+            # 回滚的登记不能进入缓存，否则之后的合并会因找不到单元而丢行
+            self.cells.remember(registered)
+        logging.debug(f"COPY merged {inserted}/{len(batch)} rows into {self.target_table}.")
+        return inserted
+
+
+class WeatherSamplesLoader(StagedCopyLoader):
+    """weather_samples 的批量加载器，保持原先按 timestamp upsert 的语义。"""
+
+    target_table = "weather_samples"
+    staging_table = "weather_samples_staging"
+    staging_columns = [("timestamp", "TIMESTAMP"), ("temperature", "FLOAT"),
+                       ("humidity", "FLOAT"), ("wind_speed", "FLOAT")]
+
+    def merge_sql(self, columns):
+        return f"""
+            INSERT INTO {self.target_table} (timestamp, temperature, humidity, wind_speed)
+            SELECT timestamp, temperature, humidity, wind_speed
+            FROM {self.staging_table}
+            WHERE load_id = pg_backend_pid()
+            ON CONFLICT (timestamp) DO UPDATE SET
+                temperature = EXCLUDED.temperature,
+                humidity = EXCLUDED.humidity,
+                wind_speed = EXCLUDED.wind_speed;
+        """
+
+    def load(self, records, commit=True):
+        """records: [(timestamp, temperature, humidity, wind_speed), ...]"""
+        if not records:
+            return 0
+        columns = [name for name, _ in self.staging_columns]
+        return self.load_buffer(columns, rows_to_text_copy(records), commit=commit)
@@ -0,0 +1,175 @@
+"""
+小时表的增量统计 grid_stats：每个 UTC 年一行 (行数、最早/最晚时间)，由加载器在合并的同一事务中累加。
+
+/api/grid_stats 和 /api/coverage_stats 只读这张几十行的表，不再对整张小时表做
+COUNT(*) / MIN / MAX / 按年分组，响应时间与数据量无关。
+
+year = 0 的一行是基线标记：统计从空表开始累加或 rebuild 之后才写入该行。没有基线时
+(例如在已有数据的库上刚升级) 读取方退回到 pg_class 的行数估计和入库清单，
+并在结果中以 "source": "estimate" 标明；运行一次 rebuild 即可切换到精确值:
+    python scripts/data_processing/grid_stats.py rebuild
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from psycopg2.extensions import cursor as tuple_cursor
+
+from compact_storage import hourly_storage_table
+from data_version import bump_version
+from grid_cells import GRID_CELL_TABLE
+from ingest_manifest import MANIFEST_TABLE
+from year_partitions import utc_year_sql, year_counts_sql
+
+STATS_TABLE = "grid_stats"
+BASELINE_YEAR = 0
+
+CREATE_STATS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+    year SMALLINT PRIMARY KEY,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    min_timestamp TIMESTAMP,
+    max_timestamp TIMESTAMP,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def create_stats_table(cur):
+    """建表；小时表为空时直接建立基线 (之后的加载都会被累加)。"""
+    cur.execute(CREATE_STATS_SQL)
+    cur.execute(f"SELECT 1 FROM {STATS_TABLE} WHERE year = %s;", (BASELINE_YEAR,))
+    if cur.fetchone() is None:
+        cur.execute("SELECT 1 FROM grid_weather_data LIMIT 1;")
+        if cur.fetchone() is None:
+            reset_stats(cur)
+
+
+def reset_stats(cur):
+    """小时表被清空后调用：统计归零并建立基线，数据版本加一。"""
+    cur.execute(f"DELETE FROM {STATS_TABLE};")
+    cur.execute(f"INSERT INTO {STATS_TABLE} (year) VALUES (%s);", (BASELINE_YEAR,))
+    bump_version(cur)
+
+
+def stats_upsert_sql(merged):
+    """
+    由合并语句 RETURNING 的 CTE (列: timestamp, inserted) 累加每个 UTC 年的统计 (与入库清单一致)。
+    只有新插入的行计数，填补 NULL 的更新不改变行数。
+    """
+    return f"""
+        INSERT INTO {STATS_TABLE} (year, row_count, min_timestamp, max_timestamp, updated_at)
+        SELECT {utc_year_sql()}, count(*) FILTER (WHERE inserted),
+               min(timestamp), max(timestamp), now()
+        FROM {merged}
+        GROUP BY 1
+        ON CONFLICT (year) DO UPDATE SET
+            row_count = {STATS_TABLE}.row_count + EXCLUDED.row_count,
+            min_timestamp = LEAST({STATS_TABLE}.min_timestamp, EXCLUDED.min_timestamp),
+            max_timestamp = GREATEST({STATS_TABLE}.max_timestamp, EXCLUDED.max_timestamp),
+            updated_at = now()
+    """
+
+
+def rebuild_stats(conn):
+    """
+    按年重新统计小时表 (每年一次范围扫描)，返回统计的年数。
+    统计期间锁住 grid_stats：并发加载在锁释放后才累加，因此既不会重复也不会遗漏。
+    """
+    cur = conn.cursor()
+    cur.execute(f"LOCK TABLE {STATS_TABLE} IN SHARE ROW EXCLUSIVE MODE;")
+    reset_stats(cur)
+    cur.execute(f"""
+        INSERT INTO {STATS_TABLE} (year, row_count, min_timestamp, max_timestamp)
+        SELECT * FROM ({year_counts_sql("count(*), min(timestamp), max(timestamp)").rstrip().rstrip(";")}) y
+        WHERE y.count > 0;
+    """)
+    n = cur.rowcount
+    conn.commit()
+    cur.close()
+    return n
+
+
+def _estimated_rows(cur):
+    # 分区表和 hypertable 的行数记在各个子表上
+    cur.execute("""
+        SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint
+        FROM pg_class c
+        WHERE c.oid = to_regclass(%s)
+           OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s));
+    """, (hourly_storage_table(cur),) * 2)
+    return cur.fetchone()[0]
+
+
+def read_grid_stats(conn):
+    """/api/grid_stats 的数据：总行数、时间范围、网格点数以及数据来源 (stats / estimate)。"""
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    cur.execute(f"SELECT count(*) FROM {GRID_CELL_TABLE};")
+    grid_points = cur.fetchone()[0]
+    cur.execute(f"""
+        SELECT bool_or(year = %s), sum(row_count) FILTER (WHERE year <> %s),
+               min(min_timestamp), max(max_timestamp)
+        FROM {STATS_TABLE};
+    """, (BASELINE_YEAR, BASELINE_YEAR))
+    has_baseline, total, min_ts, max_ts = cur.fetchone()
+    source = "stats"
+    if not has_baseline:
+        source = "estimate"
+        total = _estimated_rows(cur)
+        cur.execute(f"SELECT min(year), max(year) FROM {MANIFEST_TABLE};")
+        first, last = cur.fetchone()
+        min_ts = datetime(first, 1, 1) if first is not None else None
+        max_ts = datetime(last, 12, 31, 23) if last is not None else None
+    cur.close()
+    return {
+        "total_records": int(total or 0),
+        "min_date": min_ts,
+        "max_date": max_ts,
+        "grid_points": grid_points,
+        "source": source,
+    }
+
+
+def read_coverage(conn):
+    """/api/coverage_stats 的数据：[{year, count}]。没有基线时按入库清单估计每年的行数。"""
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    cur.execute(f"SELECT 1 FROM {STATS_TABLE} WHERE year = %s;", (BASELINE_YEAR,))
+    if cur.fetchone() is not None:
+        cur.execute(f"""
+            SELECT year, row_count FROM {STATS_TABLE}
+            WHERE year <> %s AND row_count > 0 ORDER BY year;
+        """, (BASELINE_YEAR,))
+    else:
+        # 每个点每年取各变量中最大的行数，即该点该年的小时行数
+        cur.execute(f"""
+            SELECT year, sum(row_count)::bigint FROM (
+                SELECT latitude, longitude, year, max(row_count) AS row_count
+                FROM {MANIFEST_TABLE} GROUP BY latitude, longitude, year
+            ) m
+            GROUP BY year ORDER BY year;
+        """)
+    rows = [{"year": int(year), "count": int(count)} for year, count in cur.fetchall()]
+    cur.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the incremental grid_weather_data statistics.")
+    parser.add_argument("command", choices=["rebuild", "show"])
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    if args.command == "rebuild":
+        logging.info(f"Rebuilt statistics for {rebuild_stats(conn)} years.")
+    stats = read_grid_stats(conn)
+    logging.info(f"{stats['total_records']} rows ({stats['source']}), {stats['min_date']} - {stats['max_date']}, "
+                 f"{stats['grid_points']} grid points.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+全区域热力图：某个变量在某一天 / 某个月 / 某一年的网格场，输出为稠密数组 + 网格元数据。
+
+数据来自加载器增量维护的汇总表 (见 rollups.py)：
+    period=YYYY-MM-DD  -> grid_daily   (day 上的索引，一次读取 = 每个单元一行)
+    period=YYYY-MM     -> grid_monthly (month 上的索引)
+    period=YYYY        -> grid_monthly 的 12 个月再按变量的聚合方式合并
+
+网格布局 (纬度/经度 -> 数组下标) 由 grid_cell 的请求坐标推出，在进程内缓存；
+响应中的 values 是按行 (纬度从南到北，每行经度从西到东) 展开的一维数组，缺测为 null:
+    {"variable", "period", "level", "lat0", "lon0", "dlat", "dlon", "nlat", "nlon", "values", "cells"}
+"""
+import math
+import os
+import re
+import threading
+from datetime import date
+
+from psycopg2.extensions import cursor as tuple_cursor
+
+from grid_cells import GRID_CELL_TABLE
+from rollups import DAILY_AGGREGATES, DAILY_TABLE, MONTHLY_TABLE
+
+HEATMAP_RESOLUTION = float(os.getenv("HEATMAP_RESOLUTION", "0.5"))
+
+# 变量 -> 按年合并月值时的聚合函数；water_balance (P - ET0) 是 SPEI 的输入
+HEATMAP_VARIABLES = {name: fn for name, _, fn in DAILY_AGGREGATES}
+HEATMAP_VARIABLES["water_balance"] = "sum"
+
+_PERIOD = re.compile(r"^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?$")
+
+
+def parse_period(value):
+    """'YYYY' / 'YYYY-MM' / 'YYYY-MM-DD' -> (level, start, end)，[start, end) 为日期区间。"""
+    match = _PERIOD.match(value or "")
+    if not match:
+        raise ValueError(f"period must be YYYY, YYYY-MM or YYYY-MM-DD, got {value!r}")
+    year, month, day = (int(g) if g else None for g in match.groups())
+    if day is not None:
+        start = date(year, month, day)
+        return "day", start, date.fromordinal(start.toordinal() + 1)
+    if month is not None:
+        start = date(year, month, 1)
+        return "month", start, date(year + month // 12, month % 12 + 1, 1)
+    return "year", date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def heatmap_sql(variable, level):
+    """返回 (cell_id, value) 的查询，参数为 (start, end)。"""
+    if variable not in HEATMAP_VARIABLES:
+        raise ValueError(f"variable must be one of {', '.join(HEATMAP_VARIABLES)}, got {variable!r}")
+    if level == "day":
+        if variable == "water_balance":
+            raise ValueError("water_balance is only available for monthly and yearly periods")
+        return f"SELECT cell_id, {variable} FROM {DAILY_TABLE} WHERE day >= %s AND day < %s;"
+    if level == "month":
+        return f"SELECT cell_id, {variable} FROM {MONTHLY_TABLE} WHERE month >= %s AND month < %s;"
+    return f"""
+        SELECT cell_id, {HEATMAP_VARIABLES[variable]}({variable})
+        FROM {MONTHLY_TABLE} WHERE month >= %s AND month < %s
+        GROUP BY cell_id;
+    """
+
+
+class GridLayout:
+    """
+    网格单元在规则经纬网上的位置。请求坐标按 resolution 对齐到最近的格点；
+    不在格点上的单元 (例如站点校准点) 落到最近的格点，与规则网格点重合时规则网格点优先。
+    """
+
+    def __init__(self, cells, resolution=HEATMAP_RESOLUTION):
+        self.resolution = resolution
+        self.index = {}
+        self.known = set()
+        if not cells:
+            self.lat0 = self.lon0 = None
+            self.nlat = self.nlon = 0
+            return
+        lats = [lat for _, lat, _ in cells]
+        lons = [lon for _, _, lon in cells]
+        self.lat0, self.lon0 = min(lats), min(lons)
+        self.nlat = int(round((max(lats) - self.lat0) / resolution)) + 1
+        self.nlon = int(round((max(lons) - self.lon0) / resolution)) + 1
+        best = {}  # 格点下标 -> (到格点的距离, cell_id)
+        for cell_id, lat, lon in cells:
+            i = int(round((lat - self.lat0) / resolution))
+            j = int(round((lon - self.lon0) / resolution))
+            off = abs(lat - (self.lat0 + i * resolution)) + abs(lon - (self.lon0 + j * resolution))
+            k = i * self.nlon + j
+            if k not in best or off < best[k][0]:
+                best[k] = (off, cell_id)
+        self.index = {cell_id: k for k, (_, cell_id) in best.items()}
+        # 被更近的单元占用格点的单元也算已知，不会触发布局重读
+        self.known = {cell_id for cell_id, _, _ in cells}
+
+    def __contains__(self, cell_id):
+        return cell_id in self.known
+
+    def dense(self, rows):
+        """[(cell_id, value)] -> 长度 nlat * nlon 的列表，缺测和 NaN 为 None。"""
+        values = [None] * (self.nlat * self.nlon)
+        for cell_id, value in rows:
+            k = self.index.get(cell_id)
+            if k is not None and value is not None and not math.isnan(value):
+                values[k] = value
+        return values
+
+    def metadata(self):
+        return {"lat0": self.lat0, "lon0": self.lon0, "dlat": self.resolution, "dlon": self.resolution,
+                "nlat": self.nlat, "nlon": self.nlon}
+
+
+_layout = None
+_layout_lock = threading.Lock()
+
+
+def grid_layout(conn, refresh=False):
+    """进程内缓存的 GridLayout；refresh=True 时重新读取 grid_cell (发现新登记的单元)。"""
+    global _layout
+    with _layout_lock:
+        if _layout is None or refresh:
+            cur = conn.cursor(cursor_factory=tuple_cursor)
+            cur.execute(f"SELECT id, request_latitude, request_longitude FROM {GRID_CELL_TABLE} ORDER BY id;")
+            _layout = GridLayout(cur.fetchall())
+            cur.close()
+        return _layout
+
+
+def latest_period(conn):
+    """最近一个有月值的月份 ('YYYY-MM')，作为默认期间；没有数据时返回 None。"""
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    cur.execute(f"SELECT max(month) FROM {MONTHLY_TABLE};")
+    month = cur.fetchone()[0]
+    cur.close()
+    return month.strftime("%Y-%m") if month is not None else None
+
+
+def read_heatmap(conn, variable, period):
+    """/api/heatmap_data 的数据：一次按期间索引读取全部单元，再按缓存的布局填入稠密数组。"""
+    level, start, end = parse_period(period)
+    sql = heatmap_sql(variable, level)
+    cur = conn.cursor(cursor_factory=tuple_cursor)
+    cur.execute(sql, (start, end))
+    rows = cur.fetchall()
+    cur.close()
+    layout = grid_layout(conn)
+    if any(cell_id not in layout for cell_id, _ in rows):
+        layout = grid_layout(conn, refresh=True)
+    return {
+        "variable": variable,
+        "period": period,
+        "level": level,
+        **layout.metadata(),
+        "values": layout.dense(rows),
+        "cells": len(rows),
+    }
@@ -0,0 +1,110 @@
+import numpy as np
+
+# 请求的 Open-Meteo 小时变量及其在 grid_weather_data 中对应的列名 (顺序即请求顺序)
+VARIABLE_COLUMNS = {
+    "temperature_2m": "temperature",
+    "precipitation": "precipitation",
+    "et0_fao_evapotranspiration": "et0_fao_evapotranspiration",
+    "soil_moisture_0_to_7cm": "soil_moisture_0_to_7cm",
+    "relative_humidity_2m": "relative_humidity_2m",
+    "wind_speed_10m": "wind_speed_10m",
+    "shortwave_radiation": "shortwave_radiation",
+}
+
+HOURLY_VARIABLES = list(VARIABLE_COLUMNS)
+
+
+class HourlyBatch:
+    """
+    列式存放的一批小时数据，直接由 ValuesAsNumpy() 数组拼接而成。
+
+    latitude / longitude: float64 (n,)，Open-Meteo 返回的 (吸附后的) 坐标
+    request_latitude / request_longitude: float64 (n,)，发起请求时使用的网格点坐标
+    elevation: float64 (n,)，Open-Meteo 返回的网格海拔，未知时为 NaN
+    epoch: int64 (n,)，UTC 秒级时间戳
+    values: float32 (n, k)，列顺序与 columns 一致
+    """
+
+    def __init__(self, latitude, longitude, epoch, values, columns,
+                 request_latitude=None, request_longitude=None, elevation=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.request_latitude = latitude if request_latitude is None else request_latitude
+        self.request_longitude = longitude if request_longitude is None else request_longitude
+        self.elevation = np.full(len(latitude), np.nan) if elevation is None else elevation
+        self.epoch = epoch
+        self.values = values
+        self.columns = tuple(columns)
+
+    def __len__(self):
+        return len(self.epoch)
+
+    @classmethod
+    def empty(cls, columns):
+        return cls(
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64),
+            np.empty((0, len(columns)), dtype=np.float32),
+            columns,
+        )
+
+    @classmethod
+    def concat(cls, batches, columns=None):
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty(columns or ())
+        return cls(
+            np.concatenate([b.latitude for b in batches]),
+            np.concatenate([b.longitude for b in batches]),
+            np.concatenate([b.epoch for b in batches]),
+            np.concatenate([b.values for b in batches]),
+            batches[0].columns,
+            np.concatenate([b.request_latitude for b in batches]),
+            np.concatenate([b.request_longitude for b in batches]),
+            np.concatenate([b.elevation for b in batches]),
+        )
+
+    def rows(self):
+        """
+        转成 execute_values 可用的行元组 (lat, lon, epoch, v1, ..., vk)。
+
+        tolist() 一次性在 C 层完成装箱，比逐行 float() 快一个数量级。
+        """
+        return list(zip(self.latitude.tolist(), self.longitude.tolist(), self.epoch.tolist(),
+                        *self.values.T.tolist()))
+
+
+def response_to_batch(response, variables=HOURLY_VARIABLES, request_point=None):
+    """把单个 WeatherApiResponse 的 hourly 块转换为 HourlyBatch，不创建逐行对象。"""
+    hourly = response.Hourly()
+    epoch = np.arange(hourly.Time(), hourly.TimeEnd(), hourly.Interval(), dtype=np.int64)
+    n = len(epoch)
+    values = np.empty((n, len(variables)), dtype=np.float32)
+    for k in range(len(variables)):
+        values[:, k] = hourly.Variables(k).ValuesAsNumpy()[:n]
+    lat, lon = response.Latitude(), response.Longitude()
+    req_lat, req_lon = request_point if request_point is not None else (lat, lon)
+    return HourlyBatch(
+        np.full(n, lat, dtype=np.float64),
+        np.full(n, lon, dtype=np.float64),
+        epoch,
+        values,
+        [VARIABLE_COLUMNS[v] for v in variables],
+        np.full(n, req_lat, dtype=np.float64),
+        np.full(n, req_lon, dtype=np.float64),
+        np.full(n, response.Elevation(), dtype=np.float64),
+    )
+
+
+def responses_to_batch(responses, variables=HOURLY_VARIABLES, request_points=None):
+    """
+    把一次多点请求返回的所有 response 拼接为一个 HourlyBatch。
+
+    request_points: 与请求参数顺序一致的 [(lat, lon), ...]；Open-Meteo 按请求顺序返回。
+    """
+    columns = [VARIABLE_COLUMNS[v] for v in variables]
+    request_points = list(request_points) if request_points is not None else [None] * len(responses)
+    return HourlyBatch.concat(
+        [response_to_batch(r, variables, p) for r, p in zip(responses, request_points)], columns
+    )
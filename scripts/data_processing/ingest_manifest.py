@@ -0,0 +1,159 @@
+import logging
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+from hourly_batch import VARIABLE_COLUMNS
+
+MANIFEST_TABLE = "grid_ingest_manifest"
+
+# 清单以 "请求坐标" 为键 (即 generate_ncp_grid 给出的网格点)，
+# 而不是 Open-Meteo 返回的吸附坐标，这样跳过判断无需再做 ±0.1° 的范围匹配。
+CREATE_MANIFEST_SQL = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    latitude FLOAT NOT NULL,
+    longitude FLOAT NOT NULL,
+    year SMALLINT NOT NULL,
+    variable VARCHAR(64) NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(16) NOT NULL DEFAULT 'partial',
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (latitude, longitude, year, variable)
+);
+"""
+
+# 年份按 UTC 计算，与按自然年发起的 API 请求一一对应
+_HOURS_IN_YEAR_SQL = "((make_date({y} + 1, 1, 1) - make_date({y}, 1, 1)) * 24)"
+
+
+def create_manifest_table(cur):
+    cur.execute(CREATE_MANIFEST_SQL)
+
+
+def hours_in_year(year):
+    return (datetime(year + 1, 1, 1) - datetime(year, 1, 1)).days * 24
+
+
+def manifest_refresh_sql(staging_table, target_table, columns, cell_table="grid_cell"):
+    """
+    合并之后重算本连接暂存行涉及的 (网格单元, UTC 年) 在目标表中的非空行数，覆盖清单中的计数。
+
+    计数取自目标表而不是本批写入的行：已存在且无需填补的行不会被合并语句改写，
+    只统计写入的行会让先前已有部分数据的年份永远达不到整年小时数。
+    必须作为合并之后的单独语句执行 (同一条语句中的 CTE 看不到合并写入的行)。
+    """
+    counts = ",\n                   ".join(f"count(g.{col}) AS {col}" for col in columns)
+    values = ", ".join(f"('{col}', n.{col})" for col in columns)
+    hours = _HOURS_IN_YEAR_SQL.format(y="n.year")
+    return f"""
+        WITH touched AS (
+            SELECT DISTINCT s.cell_id, extract(year FROM to_timestamp(s.epoch) AT TIME ZONE 'UTC')::int AS year
+            FROM {staging_table} s
+            WHERE s.load_id = pg_backend_pid()
+        ), counts AS (
+            SELECT t.cell_id, t.year,
+                   {counts}
+            FROM touched t
+            JOIN {target_table} g
+              ON g.cell_id = t.cell_id
+             AND g.timestamp >= make_timestamptz(t.year, 1, 1, 0, 0, 0, 'UTC')::timestamp
+             AND g.timestamp < make_timestamptz(t.year + 1, 1, 1, 0, 0, 0, 'UTC')::timestamp
+            GROUP BY t.cell_id, t.year
+        )
+        INSERT INTO {MANIFEST_TABLE} (latitude, longitude, year, variable, row_count, status, updated_at)
+        SELECT c.request_latitude, c.request_longitude, n.year, v.variable, v.row_count,
+               CASE WHEN v.row_count >= {hours} THEN 'complete' ELSE 'partial' END,
+               now()
+        FROM counts n
+        JOIN {cell_table} c ON c.id = n.cell_id
+        CROSS JOIN LATERAL (VALUES {values}) AS v(variable, row_count)
+        ON CONFLICT (latitude, longitude, year, variable) DO UPDATE SET
+            row_count = EXCLUDED.row_count,
+            status = EXCLUDED.status,
+            updated_at = now();
+    """
+
+
+def incomplete_years(conn, lats, lons, years, variables=None):
+    """
+    返回 years 中至少有一个点、一个变量尚未完整入库的年份 (升序)。
+
+    整个 chunk 的所有点和所有年份只需一次主键查找，不再扫描小时表。
+    """
+    variables = list(variables or VARIABLE_COLUMNS.values())
+    years = list(years)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT m.year, count(*)
+        FROM {MANIFEST_TABLE} m
+        JOIN unnest(%s::float8[], %s::float8[]) AS p(lat, lon)
+          ON m.latitude = p.lat AND m.longitude = p.lon
+        WHERE m.year = ANY(%s) AND m.variable = ANY(%s) AND m.status = 'complete'
+        GROUP BY m.year;
+    """, (list(lats), list(lons), years, variables))
+    complete_counts = dict(cur.fetchall())
+    cur.close()
+    expected = len(set(zip(lats, lons))) * len(variables)
+    return [y for y in years if complete_counts.get(y, 0) < expected]
+
+
+def rebuild_manifest(conn, grid_points, tolerance=0.1, columns=None):
+    """
+    一次性全表扫描，从已有小时数据重建清单 (用于清单上线前已入库的数据)。
+
+    已存储的是 Open-Meteo 吸附后的坐标，这里按 ±tolerance 匹配回最近的请求网格点。
+    columns 不为 None 时只重算这些变量的条目 (例如表结构新增列之后)，其余条目保持不变。
+    """
+    only_columns = columns is not None
+    columns = list(columns or VARIABLE_COLUMNS.values())
+    counts = ", ".join(f"count({col})" for col in columns)
+    cur = conn.cursor()
+    logging.info("Scanning grid_weather_data to rebuild the ingest manifest...")
+    cur.execute(f"""
+        SELECT latitude, longitude,
+               extract(year FROM timestamp::timestamptz AT TIME ZONE 'UTC')::int AS year,
+               {counts}
+        FROM grid_weather_data
+        GROUP BY 1, 2, 3;
+    """)
+    stored = cur.fetchall()
+
+    points = list(zip(grid_points['latitude'].tolist(), grid_points['longitude'].tolist()))
+    nearest_cache = {}
+    rows = []
+    for lat, lon, year, *col_counts in stored:
+        if (lat, lon) not in nearest_cache:
+            nearest_cache[(lat, lon)] = min(points, key=lambda p: (p[0] - lat) ** 2 + (p[1] - lon) ** 2)
+        nearest = nearest_cache[(lat, lon)]
+        if abs(nearest[0] - lat) > tolerance or abs(nearest[1] - lon) > tolerance:
+            continue
+        for col, n in zip(columns, col_counts):
+            status = 'complete' if n >= hours_in_year(year) else 'partial'
+            rows.append((nearest[0], nearest[1], year, col, n, status))
+
+    create_manifest_table(cur)
+    if only_columns:
+        cur.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE variable = ANY(%s);", (columns,))
+    else:
+        cur.execute(f"TRUNCATE {MANIFEST_TABLE};")
+    execute_values(cur, f"""
+        INSERT INTO {MANIFEST_TABLE} (latitude, longitude, year, variable, row_count, status)
+        VALUES %s
+        ON CONFLICT (latitude, longitude, year, variable) DO UPDATE SET
+            row_count = GREATEST({MANIFEST_TABLE}.row_count, EXCLUDED.row_count),
+            status = CASE WHEN {MANIFEST_TABLE}.status = 'complete' THEN 'complete' ELSE EXCLUDED.status END;
+    """, rows)
+    conn.commit()
+    cur.close()
+    logging.info(f"Manifest rebuilt: {len(rows)} (point, year, variable) entries.")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from batch_fetch_weather import get_db_connection, create_grid_table
+    from generate_grid import generate_ncp_grid
+
+    conn = get_db_connection()
+    create_grid_table(conn)
+    rebuild_manifest(conn, generate_ncp_grid())
+    conn.close()
@@ -0,0 +1,209 @@
+"""
+看板的推送通道：一个服务端生产者 + 任意多个 Server-Sent Events 订阅者。
+
+加载器在合并语句中调用 pg_notify (见 ingest_notify_sql)，通知随事务提交才送达、回滚则丢弃。
+网页服务进程里只有一个生产者线程：它用一个独立连接 LISTEN，把一段时间内的通知合并成一个事件
+广播给所有订阅者，并跟踪爬取日志的新增行。每个浏览器标签页只占一个队列，不再各自定时查询数据库，
+数据库负载与打开看板的人数无关。
+
+事件 (event: 名称, data: JSON):
+    ingest   {"inserted", "years": {年份: 新行数}, "min_timestamp", "max_timestamp"}
+    recent   最新 RECENT_LIMIT 行 (与 /api/grid_recent 相同)，有入库时最多每 RECENT_INTERVAL 秒一次
+    log      {"lines": [...]} 爬取日志的新增行
+
+没有订阅者时生产者线程退出并释放连接，下一个订阅者到来时重新启动。
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from datetime import date, datetime
+
+from log_tail import read_since, tail
+from year_partitions import utc_year_sql
+
+INGEST_CHANNEL = "grid_ingest"
+
+POLL_SECONDS = 1.0
+RECENT_INTERVAL = 10.0
+RECENT_LIMIT = 50
+QUEUE_SIZE = 100
+RECONNECT_SECONDS = 5.0
+
+
+def ingest_notify_sql(merged):
+    """
+    由合并语句 RETURNING 的 CTE (列: timestamp, inserted) 发出入库通知的 SELECT 表达式；
+    没有新行时不发送。放在合并语句的最终 SELECT 中，与合并处于同一事务。
+    """
+    return f"""
+        CASE WHEN count(*) FILTER (WHERE inserted) > 0 THEN pg_notify('{INGEST_CHANNEL}', json_build_object(
+            'inserted', count(*) FILTER (WHERE inserted),
+            'min_timestamp', min(timestamp) FILTER (WHERE inserted),
+            'max_timestamp', max(timestamp) FILTER (WHERE inserted),
+            'years', (SELECT json_object_agg(y, n) FROM (
+                SELECT {utc_year_sql()} AS y, count(*) AS n
+                FROM {merged} WHERE inserted GROUP BY 1
+            ) per_year)
+        )::text) END
+    """
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def format_event(event, data):
+    """SSE 文本帧；每个事件只编码一次，所有订阅者共用。"""
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default, ensure_ascii=False)}\n\n"
+
+
+def merge_ingest(payloads):
+    """把一个周期内的多条入库通知合并为一个 ingest 事件。"""
+    event = {"inserted": 0, "years": {}, "min_timestamp": None, "max_timestamp": None}
+    for payload in payloads:
+        event["inserted"] += payload["inserted"]
+        for year, n in (payload.get("years") or {}).items():
+            event["years"][year] = event["years"].get(year, 0) + n
+        lo, hi = payload.get("min_timestamp"), payload.get("max_timestamp")
+        if lo and (event["min_timestamp"] is None or lo < event["min_timestamp"]):
+            event["min_timestamp"] = lo
+        if hi and (event["max_timestamp"] is None or hi > event["max_timestamp"]):
+            event["max_timestamp"] = hi
+    return event
+
+
+class LogFollower:
+    """从创建时的文件末尾开始，只读新增的完整行 (轮转和截断的处理见 log_tail)。"""
+
+    def __init__(self, path):
+        self.path = path
+        _, self.cursor = tail(path, 0)
+
+    def read_new_lines(self):
+        lines, self.cursor = read_since(self.path, self.cursor)
+        return lines
+
+
+class EventHub:
+    """
+    订阅者队列的集合和唯一的生产者线程。connect 为建立 LISTEN 连接的函数 (默认 db.connect)，
+    log_path 为要跟踪的日志文件 (None 时不推送日志)，on_ingest 在收到入库通知时以合并后的事件调用
+    (例如让响应缓存立即重新读取版本号)。
+    """
+
+    def __init__(self, connect=None, log_path=None, on_ingest=None):
+        self._connect = connect
+        self.log_path = log_path
+        self.on_ingest = on_ingest
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-events", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        frame = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(frame)
+            except queue.Full:
+                # 读得慢的客户端丢掉最旧的一帧，不阻塞生产者
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(frame)
+
+    def _should_stop(self):
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                return True
+        return False
+
+    def _listen(self):
+        if self._connect is None:
+            from db import connect
+            self._connect = connect
+        conn = self._connect()
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {INGEST_CHANNEL};")
+        cur.close()
+        return conn
+
+    def _recent_rows(self, conn):
+        from psycopg2.extras import RealDictCursor
+
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM grid_weather_data ORDER BY id DESC LIMIT %s;", (RECENT_LIMIT,))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    def poll(self, conn, timeout=POLL_SECONDS):
+        """等待通知最多 timeout 秒，返回本周期收到的入库通知 (已解析的 JSON)。"""
+        if select.select([conn], [], [], timeout)[0]:
+            conn.poll()
+        payloads = []
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            try:
+                payloads.append(json.loads(note.payload))
+            except ValueError:
+                logging.warning(f"Ignoring malformed {INGEST_CHANNEL} payload: {note.payload!r}")
+        return payloads
+
+    def _run(self):
+        conn = None
+        follower = LogFollower(self.log_path) if self.log_path else None
+        recent_due = 0.0
+        pending_recent = False
+        while not self._should_stop():
+            try:
+                if follower is not None:
+                    lines = follower.read_new_lines()
+                    if lines:
+                        self.publish("log", {"lines": lines})
+                if conn is None:
+                    conn = self._listen()
+                payloads = self.poll(conn)
+                if payloads:
+                    event = merge_ingest(payloads)
+                    if self.on_ingest is not None:
+                        self.on_ingest(event)
+                    self.publish("ingest", event)
+                    pending_recent = True
+                if pending_recent and time.monotonic() >= recent_due:
+                    self.publish("recent", self._recent_rows(conn))
+                    pending_recent = False
+                    recent_due = time.monotonic() + RECENT_INTERVAL
+            except Exception as e:
+                logging.warning(f"Live event producer error: {e}; reconnecting in {RECONNECT_SECONDS:.0f}s.")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                time.sleep(RECONNECT_SECONDS)
+        if conn is not None:
+            conn.close()
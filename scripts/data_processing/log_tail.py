@@ -0,0 +1,112 @@
+"""
+爬取日志的尾部读取：从文件末尾向前按块查找最后 N 行，之后凭游标只读新增的字节。
+
+游标是 "<inode>:<字节偏移>" 形式的字符串，由客户端保存并在下一次请求时带回；
+每次调用的开销只与新增字节数有关，与日志文件的总大小无关。只消费完整的行，
+写到一半的行留到下一次。
+
+轮转 (logrotate 把 batch_fetch.log 改名为 batch_fetch.log.1 并新建文件) 时
+inode 变化：先读完 .1 中游标之后的部分，再从新文件开头继续；文件被截断 (大小小于偏移) 时从头读。
+"""
+import os
+import time
+
+TAIL_BLOCK = 8192
+MAX_READ_BYTES = 1 << 20
+
+
+def make_cursor(inode, offset):
+    return f"{inode}:{offset}"
+
+
+def parse_cursor(cursor):
+    """游标 -> (inode, offset)；格式错误抛出 ValueError。"""
+    try:
+        inode, offset = (int(part) for part in cursor.split(":"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"invalid log cursor {cursor!r}") from None
+    if offset < 0:
+        raise ValueError(f"invalid log cursor {cursor!r}")
+    return inode, offset
+
+
+def _decode(data):
+    return data.decode("utf-8", errors="replace").splitlines()
+
+
+def tail(path, n=20):
+    """最后 n 个完整的行和指向其后的游标；文件不存在时返回 ([], None)。"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], None
+    with f:
+        st = os.fstat(f.fileno())
+        pos, data = st.st_size, b""
+        # 多读一个换行，保证第一行是完整的
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    complete = data.rfind(b"\n") + 1
+    lines = _decode(data[:complete])[-n:] if n else []
+    return lines, make_cursor(st.st_ino, st.st_size - (len(data) - complete))
+
+
+def _read_from(path, offset, max_bytes):
+    """从 offset 读取至多 max_bytes 字节中的完整行，返回 (行, 新偏移, 文件大小)。"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        data = f.read(min(max_bytes, max(size - offset, 0)))
+    complete = data.rfind(b"\n") + 1
+    if complete == 0 and len(data) == max_bytes:
+        # 超长的一行不能一直卡住游标
+        complete = len(data)
+    return _decode(data[:complete]), offset + complete, size
+
+
+def read_since(path, cursor, max_bytes=MAX_READ_BYTES):
+    """
+    游标之后新增的完整行和新的游标。cursor 为 None 时从当前文件开头读；
+    文件不存在时返回 ([], cursor)。
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [], cursor
+    inode, offset = parse_cursor(cursor) if cursor is not None else (st.st_ino, 0)
+    lines = []
+    if inode != st.st_ino:
+        rotated = f"{path}.1"
+        try:
+            rotated_inode = os.stat(rotated).st_ino
+        except FileNotFoundError:
+            rotated_inode = None
+        if rotated_inode == inode:
+            start = offset
+            lines, offset, size = _read_from(rotated, offset, max_bytes)
+            max_bytes -= offset - start
+            if offset < size:
+                return lines, make_cursor(inode, offset)
+        inode, offset = st.st_ino, 0
+    elif st.st_size < offset:
+        offset = 0
+    new_lines, offset, _ = _read_from(path, offset, max(max_bytes, 0))
+    return lines + new_lines, make_cursor(inode, offset)
+
+
+def follow(path, cursor=None, n=20, poll_seconds=1.0):
+    """
+    持续跟踪日志：先产出最后 n 行 (cursor 为 None 时)，之后每 poll_seconds 秒产出新增的行。
+    产出 (行列表, 游标)；没有新行时在等待之后产出空列表，调用方可借此发送心跳或停止迭代。
+    """
+    if cursor is None:
+        lines, cursor = tail(path, n)
+        yield lines, cursor
+    while True:
+        lines, cursor = read_since(path, cursor)
+        if not lines:
+            time.sleep(poll_seconds)
+        yield lines, cursor
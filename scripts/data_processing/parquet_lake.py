@@ -0,0 +1,255 @@
+"""
+按年份和网格单元块分区的 Parquet 数据湖导出与读取。
+
+scripts/export_db.py 的 pg_dump 备份只适合整库迁移；离线分析和模型训练需要的是
+可以按区域、时间直接读取的列式文件：
+
+    <root>/grid_cell.parquet                                    网格单元坐标
+    <root>/<table>/year=<YYYY>/cell_block=<NNN>/part-0.parquet  按 (cell_id, 时间) 排序
+
+导出通过服务器端游标分批读取，内存占用与表大小无关；同一年内的行按 cell_id 排序，
+因此同一时刻只打开一个写入器。读取时经纬度/时间条件先换算为 year / cell_block
+做分区裁剪，再由行组统计信息 (cell_id, 时间的 min/max) 跳过无关的行组。
+
+小时表的 year 是 UTC 年 (与入库清单、抓取作业和年份分区一致)，timestamp 列仍是会话本地时间；
+汇总表的 year 是 day / month 所在的日历年。
+
+依赖 pyarrow (可选依赖，仅导出和读取时需要)。
+
+用法:
+    python scripts/data_processing/parquet_lake.py export --start-year 1990 --end-year 2023
+    python scripts/data_processing/parquet_lake.py export --tables grid_daily grid_monthly
+"""
+import argparse
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from hourly_batch import VARIABLE_COLUMNS
+from rollups import DAILY_AGGREGATES, DAILY_TABLE, MONTHLY_TABLE
+from year_partitions import year_bounds, year_range_sql
+
+LAKE_DIR = os.getenv("PARQUET_LAKE_DIR", os.path.join(os.getcwd(), "parquet_lake"))
+# 每个分区目录包含的网格单元数；网格约 450 个单元，按 64 个一块约 8 个分区/年
+CELL_BLOCK_SIZE = 64
+ROW_GROUP_SIZE = 128 * 1024
+FETCH_SIZE = 50000
+
+# 表名 -> (时间列, 数值列, 数值类型)。小时数据来自 float32 响应，存为 float32 不损失精度
+LAKE_TABLES = {
+    "grid_weather_data": ("timestamp", list(VARIABLE_COLUMNS.values()), "float32"),
+    DAILY_TABLE: ("day", ["hours"] + [name for name, _, _ in DAILY_AGGREGATES], "float64"),
+    MONTHLY_TABLE: ("month", ["days", "hours"] + [name for name, _, _ in DAILY_AGGREGATES] + ["water_balance"],
+                    "float64"),
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The Parquet lake needs pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def cell_block(cell_id):
+    return int(cell_id) // CELL_BLOCK_SIZE
+
+
+def _schema(pa, table):
+    time_col, value_cols, value_type = LAKE_TABLES[table]
+    time_type = pa.timestamp("s") if time_col == "timestamp" else pa.date32()
+    return pa.schema([("cell_id", pa.int32()), (time_col, time_type)] +
+                     [(c, getattr(pa, value_type)()) for c in value_cols])
+
+
+def _partition_dir(root, table, year, block):
+    return os.path.join(root, table, f"year={year}", f"cell_block={block:03d}")
+
+
+def export_cells(conn, root=LAKE_DIR):
+    pa = _pyarrow()
+    cur = conn.cursor()
+    cur.execute("SELECT id, request_latitude, request_longitude, latitude, longitude, elevation "
+                "FROM grid_cell ORDER BY id;")
+    rows = cur.fetchall()
+    cur.close()
+    names = ["cell_id", "request_latitude", "request_longitude", "latitude", "longitude", "elevation"]
+    table = pa.table({name: [row[k] for row in rows] for k, name in enumerate(names)})
+    os.makedirs(root, exist_ok=True)
+    pa.parquet.write_table(table, os.path.join(root, "grid_cell.parquet"))
+    return len(rows)
+
+
+def export_year(conn, table, year, root=LAKE_DIR):
+    """
+    导出一张表一年的数据，覆盖该年已有的分区，返回行数。
+    先写到临时目录，完成后整体替换，读取方不会看到写了一半的年份。
+    """
+    pa = _pyarrow()
+    time_col, value_cols, _ = LAKE_TABLES[table]
+    schema = _schema(pa, table)
+    final_dir = os.path.join(root, table, f"year={year}")
+    tmp_root = os.path.join(root, f".tmp-{table}-{year}-{os.getpid()}")
+    shutil.rmtree(tmp_root, ignore_errors=True)
+
+    # 服务器端 (命名) 游标：每次只取 FETCH_SIZE 行
+    cur = conn.cursor(name=f"lake_{table}_{year}")
+    cur.itersize = FETCH_SIZE
+    if time_col == "timestamp":
+        where, params = year_range_sql(time_col), year_bounds(year)
+    else:
+        where, params = f"{time_col} >= %s AND {time_col} < %s", (datetime(year, 1, 1), datetime(year + 1, 1, 1))
+    cur.execute(f"""
+        SELECT cell_id, {time_col}, {", ".join(value_cols)}
+        FROM {table}
+        WHERE {where}
+        ORDER BY cell_id, {time_col};
+    """, params)
+
+    writer, block, n = None, None, 0
+    try:
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            blocks = [cell_block(c) for c in columns[0]]
+            start = 0
+            # 一批行可能跨越单元块边界，按块切开分别写入
+            for end in range(1, len(rows) + 1):
+                if end < len(rows) and blocks[end] == blocks[start]:
+                    continue
+                if blocks[start] != block:
+                    if writer is not None:
+                        writer.close()
+                    block = blocks[start]
+                    path = _partition_dir(tmp_root, table, year, block)
+                    os.makedirs(path, exist_ok=True)
+                    writer = pa.parquet.ParquetWriter(os.path.join(path, "part-0.parquet"), schema,
+                                                      compression="zstd")
+                batch = pa.record_batch([pa.array(col[start:end], type=field.type)
+                                         for col, field in zip(columns, schema)], schema=schema)
+                writer.write_batch(batch, row_group_size=ROW_GROUP_SIZE)
+                n += end - start
+                start = end
+    finally:
+        if writer is not None:
+            writer.close()
+        cur.close()
+        conn.rollback()
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    tmp_year = os.path.join(tmp_root, table, f"year={year}")
+    if os.path.isdir(tmp_year):
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        os.replace(tmp_year, final_dir)
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    return n
+
+
+class ParquetLake:
+    """数据湖读取器：经纬度范围与时间范围下推到分区裁剪和行组统计。"""
+
+    def __init__(self, root=LAKE_DIR):
+        self.root = root
+        self._cells = None
+
+    def cells(self):
+        """网格单元坐标表 (pandas DataFrame)。"""
+        if self._cells is None:
+            pa = _pyarrow()
+            self._cells = pa.parquet.read_table(os.path.join(self.root, "grid_cell.parquet")).to_pandas()
+        return self._cells
+
+    def cells_in_bbox(self, lat_min, lat_max, lon_min, lon_max):
+        cells = self.cells()
+        lat = cells["latitude"].fillna(cells["request_latitude"])
+        lon = cells["longitude"].fillna(cells["request_longitude"])
+        mask = lat.between(lat_min, lat_max) & lon.between(lon_min, lon_max)
+        return sorted(int(c) for c in cells.loc[mask, "cell_id"])
+
+    def build_filter(self, table, cell_ids=None, start=None, end=None):
+        """cell_ids / [start, end) 换算为分区键与列上的过滤表达式。"""
+        pa = _pyarrow()
+        ds = pa.dataset
+        time_col = LAKE_TABLES[table][0]
+        # 小时表按 UTC 年分区而时间列是本地时间 (相差不到一天)：年份条件放宽一天，精确范围由时间列过滤
+        slack = timedelta(days=1) if time_col == "timestamp" else None
+        conditions = []
+        if cell_ids is not None:
+            conditions.append(ds.field("cell_block").isin(sorted({cell_block(c) for c in cell_ids})))
+            conditions.append(ds.field("cell_id").isin(list(cell_ids)))
+        if start is not None:
+            start = datetime.fromisoformat(str(start))
+            conditions.append(ds.field("year") >= (start - slack if slack else start).year)
+            conditions.append(ds.field(time_col) >= self._scalar(pa, table, start))
+        if end is not None:
+            end = datetime.fromisoformat(str(end))
+            # end 为开区间；恰好是年初时不需要读取那一年
+            if slack:
+                last_year = (end + slack).year
+            elif (end.month, end.day, end.hour, end.minute, end.second) == (1, 1, 0, 0, 0):
+                last_year = end.year - 1
+            else:
+                last_year = end.year
+            conditions.append(ds.field("year") <= last_year)
+            conditions.append(ds.field(time_col) < self._scalar(pa, table, end))
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    @staticmethod
+    def _scalar(pa, table, value):
+        field = _schema(pa, table).field(LAKE_TABLES[table][0])
+        return pa.scalar(value if pa.types.is_timestamp(field.type) else value.date(), type=field.type)
+
+    def dataset(self, table):
+        pa = _pyarrow()
+        return pa.dataset.dataset(os.path.join(self.root, table), format="parquet", partitioning="hive")
+
+    def read(self, table="grid_weather_data", bbox=None, cell_ids=None, start=None, end=None, columns=None):
+        """
+        读取为 pandas DataFrame。bbox=(lat_min, lat_max, lon_min, lon_max)；
+        start / end 为 ISO 日期或时间 (end 为开区间)；columns 为 None 时读取全部列。
+        """
+        if bbox is not None:
+            bbox_cells = self.cells_in_bbox(*bbox)
+            cell_ids = bbox_cells if cell_ids is None else sorted(set(cell_ids) & set(bbox_cells))
+        time_col = LAKE_TABLES[table][0]
+        if columns is not None:
+            columns = ["cell_id", time_col] + [c for c in columns if c not in ("cell_id", time_col)]
+        result = self.dataset(table).to_table(columns=columns, filter=self.build_filter(table, cell_ids, start, end))
+        return result.to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export grid tables to a partitioned Parquet lake.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--root", default=LAKE_DIR)
+    parser.add_argument("--tables", nargs="+", default=list(LAKE_TABLES), choices=list(LAKE_TABLES))
+    parser.add_argument("--start-year", type=int, default=None)
+    parser.add_argument("--end-year", type=int, default=None)
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    start_year = args.start_year or fetcher.START_YEAR
+    end_year = args.end_year or fetcher.END_YEAR
+    conn = fetcher.get_db_connection()
+    logging.info(f"Exported {export_cells(conn, args.root)} grid cells.")
+    for table in args.tables:
+        for year in range(start_year, end_year + 1):
+            n = export_year(conn, table, year, args.root)
+            logging.info(f"  {table} {year}: {n} rows.")
+    conn.close()
+    logging.info(f"Parquet export completed in {args.root}.")
+
+
+if __name__ == "__main__":
+    main()
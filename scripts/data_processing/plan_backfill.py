@@ -0,0 +1,191 @@
+"""
+缺口检测与补抓规划。
+
+一次读取 grid_ingest_manifest，找出所有 (网格点, 年份, 变量) 缺口，
+再合并为 "多点 × 多年" 的缺口矩形，按自适应权重预算切成尽量少的 Open-Meteo 请求，
+交给抓取器作为工作队列执行。
+替代 check_year_distribution.py / check_1991_detail.py 那样逐年手工排查的方式。
+
+请求只包含该 点×年 实际缺失的变量；加载器合并时只填补已有行中为 NULL 的列，
+因此表结构新增变量后只需补抓这些列，而不必重新抓取整个档案：
+
+    python scripts/data_processing/plan_backfill.py --columns wind_speed_10m,shortwave_radiation --rescan
+
+--rescan 先从小时表重新统计这些列的非空行数 (一次全表扫描)，
+用于修正新列上线前、或清单记录与实际存储不一致的情况。
+
+用法:
+    python scripts/data_processing/plan_backfill.py --dry-run
+    python scripts/data_processing/plan_backfill.py --concurrency 4
+"""
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+
+from fetch_request import FetchRequest
+from hourly_batch import VARIABLE_COLUMNS
+from ingest_manifest import MANIFEST_TABLE, rebuild_manifest
+from rate_limiter import request_weight
+from request_packer import MAX_YEARS_PER_REQUEST, AdaptiveBudget, pack_runs, span_days
+
+# 列名 -> API 变量名
+COLUMN_VARIABLES = {col: var for var, col in VARIABLE_COLUMNS.items()}
+
+
+def parse_columns(spec):
+    """把逗号分隔的列名或 API 变量名解析为列名列表。"""
+    columns = []
+    for name in (s.strip() for s in spec.split(",")):
+        if not name:
+            continue
+        column = VARIABLE_COLUMNS.get(name, name)
+        if column not in COLUMN_VARIABLES:
+            raise ValueError(f"Unknown hourly column or variable: {name}")
+        columns.append(column)
+    return columns
+
+
+def find_gaps(conn, points, years, columns=None):
+    """
+    返回 {(lat, lon): {year: frozenset(缺失的列名)}}，只包含存在缺口的点和年份。
+
+    只扫描一次清单 (每个 点×年×变量 一行)，不触碰小时表。
+    """
+    columns = list(columns or VARIABLE_COLUMNS.values())
+    years = list(years)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT latitude, longitude, year, variable
+        FROM {MANIFEST_TABLE}
+        WHERE status = 'complete' AND year BETWEEN %s AND %s AND variable = ANY(%s);
+    """, (min(years), max(years), columns))
+    complete = set(cur.fetchall())
+    cur.close()
+
+    gaps = {}
+    for lat, lon in points:
+        point_gaps = {}
+        for year in years:
+            missing = frozenset(c for c in columns if (lat, lon, year, c) not in complete)
+            if missing:
+                point_gaps[year] = missing
+        if point_gaps:
+            gaps[(lat, lon)] = point_gaps
+    return gaps
+
+
+def gap_runs(gaps, max_years=None):
+    """
+    把缺口整理为矩形：[(variables, start_year, end_year, points)]。
+
+    对每一组相同的缺失变量：按年份求出缺该组变量的点集合，相邻年份点集合相同则合并为
+    一个多年区间 (max_years 不为 None 时不超过 max_years 年)。点按 gaps 中的顺序排列。
+    """
+    point_order = {p: k for k, p in enumerate(gaps)}
+    # 缺失变量集合 -> 年份 -> 点集合
+    by_columns = defaultdict(lambda: defaultdict(set))
+    for point, point_gaps in gaps.items():
+        for year, missing in point_gaps.items():
+            by_columns[missing][year].add(point)
+
+    result = []
+    for missing, year_points in by_columns.items():
+        variables = tuple(v for v, c in VARIABLE_COLUMNS.items() if c in missing)
+        runs = []  # [(start_year, end_year, frozenset(points))]
+        for year in sorted(year_points):
+            pts = frozenset(year_points[year])
+            if (runs and runs[-1][1] == year - 1 and runs[-1][2] == pts
+                    and (max_years is None or year - runs[-1][0] < max_years)):
+                runs[-1] = (runs[-1][0], year, pts)
+            else:
+                runs.append((year, year, pts))
+        for start_year, end_year, pts in runs:
+            result.append((variables, start_year, end_year, sorted(pts, key=point_order.get)))
+
+    result.sort(key=lambda run: (run[1], point_order[run[3][0]]))
+    return result
+
+
+def coalesce_gaps(gaps, max_points=10, max_years=5):
+    """
+    把缺口合并为固定形状上限的请求：每个请求不超过 max_points 个点、max_years 年。
+    """
+    return [FetchRequest.for_years(points[k:k + max_points], start_year, end_year, variables)
+            for variables, start_year, end_year, points in gap_runs(gaps, max_years)
+            for k in range(0, len(points), max_points)]
+
+
+def pack_gaps(gaps, budget, max_years=MAX_YEARS_PER_REQUEST):
+    """按自适应权重预算把缺口切成请求 (生成器，见 request_packer.pack_runs)。"""
+    return pack_runs(gap_runs(gaps), budget, max_years)
+
+
+def plan_backfill(conn, grid_points, start_year, end_year, max_points=10, max_years=5, budget=None, columns=None):
+    """
+    找出网格在 [start_year, end_year] 内的缺口并规划请求。
+
+    budget 为 None 时返回固定形状 (max_points × max_years) 的请求列表；
+    传入 AdaptiveBudget 时返回按预算动态切分的请求生成器。
+    columns 不为 None 时只考虑这些列的缺口，请求也只包含对应的变量。
+    """
+    points = list(zip(grid_points['latitude'].tolist(), grid_points['longitude'].tolist()))
+    gaps = find_gaps(conn, points, range(start_year, end_year + 1), columns)
+    n_missing = sum(len(cols) for point_gaps in gaps.values() for cols in point_gaps.values())
+    total_weight = sum(request_weight(len(run[3]), span_days(run[1], run[2] - run[1] + 1), len(run[0]))
+                       for run in gap_runs(gaps))
+    logging.info(f"Found {n_missing} missing (point, year, variable) cells across {len(gaps)} points; "
+                 f"total weight {total_weight:.0f} API calls.")
+    if budget is not None:
+        return pack_gaps(gaps, budget, max_years)
+    plan = coalesce_gaps(gaps, max_points=max_points, max_years=max_years)
+    logging.info(f"Planned {len(plan)} fixed-shape requests.")
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan and run the minimal set of backfill requests.")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--fixed-shape", action="store_true",
+                        help="use --max-points x --max-years requests instead of the adaptive weight budget")
+    parser.add_argument("--max-points", type=int, default=10, help="points per request with --fixed-shape (default: 10)")
+    parser.add_argument("--max-years", type=int, default=None,
+                        help=f"years per request (default: 5 with --fixed-shape, else up to {MAX_YEARS_PER_REQUEST})")
+    parser.add_argument("--columns", type=parse_columns, default=None,
+                        help="comma-separated columns or API variables to backfill (default: all)")
+    parser.add_argument("--rescan", action="store_true",
+                        help="recount the selected columns from grid_weather_data before planning (full table scan)")
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+    from generate_grid import generate_ncp_grid
+
+    budget = None if args.fixed_shape else AdaptiveBudget()
+    max_years = args.max_years or (5 if args.fixed_shape else MAX_YEARS_PER_REQUEST)
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    grid = generate_ncp_grid()
+    if args.rescan:
+        rebuild_manifest(conn, grid, columns=args.columns)
+    plan = plan_backfill(conn, grid, fetcher.START_YEAR, fetcher.END_YEAR,
+                         max_points=args.max_points, max_years=max_years, budget=budget, columns=args.columns)
+    conn.close()
+
+    if args.dry_run:
+        # 预演时预算不会变化，按初始预算展开
+        plan = list(plan)
+        logging.info(f"Planned {len(plan)} requests.")
+        for request in plan[:50]:
+            print(f"  {request.describe():<60} weight={request.weight:.0f}")
+        if len(plan) > 50:
+            print(f"  ... {len(plan) - 50} more")
+        return
+
+    asyncio.run(fetcher.run_fetch_queue(plan, concurrency=args.concurrency, budget=budget))
+    logging.info("Backfill completed.")
+
+
+if __name__ == "__main__":
+    main()
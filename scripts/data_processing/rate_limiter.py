@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+import time
+
+# Open-Meteo 免费接口的配额 (https://open-meteo.com/en/terms)
+# 每个窗口: (允许的 API 调用数, 窗口长度秒)
+OPEN_METEO_LIMITS = {
+    "minutely": (int(os.getenv("OPEN_METEO_MINUTELY_LIMIT", "600")), 60),
+    "hourly": (int(os.getenv("OPEN_METEO_HOURLY_LIMIT", "5000")), 3600),
+    "daily": (int(os.getenv("OPEN_METEO_DAILY_LIMIT", "10000")), 86400),
+}
+
+
+def request_weight(n_points, n_days, n_variables):
+    """
+    估算一次 Open-Meteo 请求消耗的 API 调用数。
+
+    Open-Meteo 按 "分数调用" 计费：每个坐标点单独计数，
+    超过 10 个变量或超过 2 周的时间跨度会按比例折算成多次调用。
+    例如 10 个点 × 1 年 × 7 个变量 ≈ 10 × 26 = 260 次调用。
+    """
+    return n_points * max(1.0, n_variables / 10.0) * max(1.0, n_days / 14.0)
+
+
+class TokenBucket:
+    """单个时间窗口的令牌桶：容量为 limit，在 period 秒内匀速回满。"""
+
+    def __init__(self, limit, period):
+        self.capacity = float(limit)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def wait_time(self, weight, now):
+        """返回拿到 weight 个令牌还需要等待的秒数 (0 表示现在就够)。"""
+        self._refill(now)
+        # 单次请求超过桶容量时，至少要等桶满才能发出
+        needed = min(weight, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, weight):
+        self.tokens -= weight
+
+
+class RateLimiter:
+    """
+    多窗口令牌桶限速器 (分钟/小时/天)，线程安全，同时支持 asyncio 与阻塞调用。
+
+    所有抓取协程共享同一个实例，吞吐量由真实配额决定，而不是固定的 sleep。
+    """
+
+    def __init__(self, limits=None):
+        limits = limits or OPEN_METEO_LIMITS
+        self.limits = dict(limits)
+        self.buckets = {name: TokenBucket(limit, period) for name, (limit, period) in self.limits.items()}
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+    def _try_acquire(self, weight):
+        """尝试一次性从所有桶中扣除令牌，返回需要等待的秒数 (0 表示已扣除)。"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            wait = max(bucket.wait_time(weight, now) for bucket in self.buckets.values())
+            if wait > 0:
+                return wait
+            for bucket in self.buckets.values():
+                bucket.consume(weight)
+            return 0.0
+
+    async def acquire(self, weight=1.0):
+        """异步等待直到配额允许发出一个权重为 weight 的请求。"""
+        while True:
+            wait = self._try_acquire(weight)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, weight=1.0):
+        """同步版本的 acquire，供串行抓取模式使用。"""
+        while True:
+            wait = self._try_acquire(weight)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """收到 429 后暂停所有请求 seconds 秒，并清空当前令牌。"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            for bucket in self.buckets.values():
+                bucket.tokens = min(bucket.tokens, 0.0)
+
+    def blocked_for(self):
+        """penalize() 造成的暂停还剩多少秒 (0 表示未暂停)。"""
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    def reset(self):
+        """切换到新的出口 IP 后，配额重新计算。"""
+        with self._lock:
+            self._blocked_until = 0.0
+            self.buckets = {name: TokenBucket(limit, period) for name, (limit, period) in self.limits.items()}
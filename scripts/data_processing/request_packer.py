@@ -0,0 +1,111 @@
+"""
+按权重预算决定每个请求的形状 (点数 × 年数)，并根据实际延迟与 429 自适应调整预算。
+
+Open-Meteo 按 点数 × 天数 × 变量数 折算调用次数 (见 rate_limiter.request_weight)，
+配额消耗与请求怎么切分无关，但请求数越少，握手、排队和解析的固定开销越少。
+因此在不超过单分钟配额、响应延迟可接受的前提下，每个请求应尽量装满：
+优先拉长年份跨度，再增加点数。
+
+预算按 AIMD 调整：请求快速成功时加性增加，延迟过高或出错时乘性减少，收到 429 时减半。
+"""
+import os
+import threading
+from datetime import date
+
+from rate_limiter import OPEN_METEO_LIMITS, request_weight
+from fetch_request import FetchRequest
+
+# 单个请求的权重上限：一个请求不能超过一分钟的配额，否则必然被限流
+MAX_REQUEST_WEIGHT = 0.9 * OPEN_METEO_LIMITS["minutely"][0]
+# 初始预算与原先固定的 10 个点 × 1 年 × 7 个变量相当
+INITIAL_REQUEST_WEIGHT = float(os.getenv("FETCH_WEIGHT_BUDGET", request_weight(10, 366, 7)))
+MIN_REQUEST_WEIGHT = request_weight(1, 366, 1)
+# 超过该延迟 (秒) 视为请求过大
+TARGET_LATENCY_SECONDS = float(os.getenv("FETCH_TARGET_LATENCY", "20"))
+MAX_YEARS_PER_REQUEST = 10
+
+
+def span_days(start_year, n_years):
+    return (date(start_year + n_years, 1, 1) - date(start_year, 1, 1)).days
+
+
+class AdaptiveBudget:
+    """每个请求的目标权重，线程安全 (作业领取在线程中读取，抓取协程中更新)。"""
+
+    def __init__(self, initial=INITIAL_REQUEST_WEIGHT, minimum=MIN_REQUEST_WEIGHT,
+                 maximum=MAX_REQUEST_WEIGHT, target_latency=TARGET_LATENCY_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        # 加性增量：每次快速成功多装一个 点 × 年
+        self.step = minimum
+        self._weight = min(max(initial, minimum), maximum)
+        self._lock = threading.Lock()
+
+    @property
+    def weight(self):
+        with self._lock:
+            return self._weight
+
+    def _set(self, weight):
+        self._weight = min(max(weight, self.minimum), self.maximum)
+
+    def on_success(self, latency):
+        with self._lock:
+            if latency > self.target_latency:
+                self._set(self._weight * 0.75)
+            else:
+                self._set(self._weight + self.step)
+
+    def on_quota_error(self):
+        with self._lock:
+            self._set(self._weight * 0.5)
+
+    def on_error(self):
+        """超时等非配额错误，多半是请求过大。"""
+        with self._lock:
+            self._set(self._weight * 0.75)
+
+
+def years_for(budget_weight, n_points, start_year, n_years, n_variables, max_years=MAX_YEARS_PER_REQUEST):
+    """n_points 个点在预算内最多能覆盖的年数 (至少 1 年)。"""
+    for years in range(min(n_years, max_years), 1, -1):
+        if request_weight(n_points, span_days(start_year, years), n_variables) <= budget_weight:
+            return years
+    return 1
+
+
+def points_for(budget_weight, n_points, start_year, n_years, n_variables):
+    """给定年份跨度时预算内最多能放的点数 (至少 1 个)。"""
+    per_point = request_weight(1, span_days(start_year, n_years), n_variables)
+    return max(1, min(n_points, int(budget_weight // per_point)))
+
+
+def pack_runs(runs, budget, max_years=MAX_YEARS_PER_REQUEST):
+    """
+    把 (variables, start_year, end_year, points) 形式的缺口矩形按当前预算切成请求。
+
+    这是生成器：每个请求的形状在产出时按 budget.weight 决定，
+    因此抓取过程中对预算的调整会立即作用于后续请求。
+    """
+    for variables, start_year, end_year, points in runs:
+        year = start_year
+        while year <= end_year:
+            years = years_for(budget.weight, 1, year, end_year - year + 1, len(variables), max_years)
+            k = 0
+            while k < len(points):
+                n = points_for(budget.weight, len(points) - k, year, years, len(variables))
+                yield FetchRequest.for_years(points[k:k + n], year, year + years - 1, variables)
+                k += n
+            year += years
+
+
+def year_spans(years):
+    """把年份列表拆成连续区间 [(start, end), ...]。"""
+    spans = []
+    for year in sorted(years):
+        if spans and spans[-1][1] == year - 1:
+            spans[-1] = (spans[-1][0], year)
+        else:
+            spans.append((year, year))
+    return spans
@@ -0,0 +1,222 @@
+"""
+Open-Meteo 原始响应归档与离线回放。
+
+每次请求的 FlatBuffers 原始字节以 gzip 压缩后永久保存在磁盘上，
+文件名为请求 (URL, 坐标, 日期区间, 变量) 规范化后的 SHA-256：
+
+    <root>/<key[:2]>/<key>.fb.gz    原始响应
+    <root>/<key[:2]>/<key>.json     请求参数与内容校验和，回放时据此还原 FetchRequest
+
+相同请求不会再消耗 API 配额；表结构变化或数据库重建时可直接从磁盘回放，无需联网。
+
+用法:
+    python scripts/data_processing/response_archive.py stats
+    python scripts/data_processing/response_archive.py replay --start-year 1990 --end-year 2000
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime
+
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from fetch_request import FetchRequest
+
+OPEN_METEO_ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+# 设为空字符串可关闭归档
+RESPONSE_ARCHIVE_DIR = os.getenv("OPEN_METEO_RESPONSE_ARCHIVE", os.path.join(os.getcwd(), "openmeteo_archive"))
+
+
+def parse_flatbuffers(content):
+    """
+    解析 Open-Meteo 的 FlatBuffers 响应 (每条消息前有 4 字节小端长度)，
+    返回 WeatherApiResponse 列表，顺序与请求中的坐标一致。
+    """
+    messages = []
+    pos, total = 0, len(content)
+    while pos < total:
+        length = int.from_bytes(content[pos:pos + 4], byteorder="little")
+        # 流式错误信息以 "Unexpected" 开头
+        if length == 0x78656E55:
+            raise OpenMeteoRequestsError(content[pos:].decode("utf-8"))
+        messages.append(WeatherApiResponse.GetRootAs(content, pos + 4))
+        pos += length + 4
+    return messages
+
+
+def request_key(request, url=OPEN_METEO_ARCHIVE_URL):
+    """请求的规范化描述的 SHA-256；变量顺序决定响应中各变量的位置，因此保留原顺序。"""
+    canonical = json.dumps({
+        "url": url,
+        "latitude": [float(x) for x in request.lats],
+        "longitude": [float(x) for x in request.lons],
+        "start_date": request.start_date.isoformat(),
+        "end_date": request.end_date.isoformat(),
+        "hourly": list(request.variables),
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseArchive:
+    """以请求为键、内容经压缩的原始响应归档。写入先落临时文件再改名，多进程并发写入安全。"""
+
+    def __init__(self, root=RESPONSE_ARCHIVE_DIR, url=OPEN_METEO_ARCHIVE_URL, compresslevel=6):
+        self.root = root
+        self.url = url
+        self.compresslevel = compresslevel
+
+    def _paths(self, key):
+        directory = os.path.join(self.root, key[:2])
+        return os.path.join(directory, f"{key}.fb.gz"), os.path.join(directory, f"{key}.json")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def contains(self, request):
+        return os.path.exists(self._paths(request_key(request, self.url))[1])
+
+    def put(self, request, content):
+        """保存一次请求的原始响应，返回键。"""
+        key = request_key(request, self.url)
+        blob_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        self._write_atomic(blob_path, gzip.compress(content, compresslevel=self.compresslevel, mtime=0))
+        meta = {
+            "url": self.url,
+            "points": [[float(lat), float(lon)] for lat, lon in request.points],
+            "start_date": request.start_date.isoformat(),
+            "end_date": request.end_date.isoformat(),
+            "variables": list(request.variables),
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "size": len(content),
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        # 元数据最后写入，存在即表示归档完整
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        return key
+
+    def get(self, request):
+        """返回原始响应字节，未归档或校验失败时返回 None。"""
+        return self._read(request_key(request, self.url))
+
+    def load(self, request):
+        """返回解析后的 WeatherApiResponse 列表，未归档时返回 None。"""
+        content = self.get(request)
+        return parse_flatbuffers(content) if content is not None else None
+
+    def _read(self, key, meta=None):
+        blob_path, meta_path = self._paths(key)
+        try:
+            if meta is None:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            with open(blob_path, "rb") as f:
+                content = gzip.decompress(f.read())
+        except (OSError, ValueError, EOFError):
+            return None
+        if hashlib.sha256(content).hexdigest() != meta["sha256"]:
+            logging.warning(f"Archived response {key} failed checksum; ignoring it.")
+            return None
+        return content
+
+    def entries(self, start_year=None, end_year=None):
+        """
+        按键顺序遍历归档，产出 (FetchRequest, 原始字节)。
+        只返回日期区间与 [start_year, end_year] 有交集的请求。
+        """
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in sorted(os.listdir(shard_dir)):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")]
+                with open(os.path.join(shard_dir, name), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("url", self.url) != self.url:
+                    continue
+                request = FetchRequest([tuple(p) for p in meta["points"]],
+                                       date.fromisoformat(meta["start_date"]),
+                                       date.fromisoformat(meta["end_date"]),
+                                       tuple(meta["variables"]), tag=key)
+                if start_year is not None and request.end_date.year < start_year:
+                    continue
+                if end_year is not None and request.start_date.year > end_year:
+                    continue
+                content = self._read(key, meta)
+                if content is not None:
+                    yield request, content
+
+    def stats(self):
+        """返回 (请求数, 原始字节数, 压缩后字节数)。"""
+        n, raw, stored = 0, 0, 0
+        for shard, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".json"):
+                    with open(os.path.join(shard, name), "r", encoding="utf-8") as f:
+                        raw += json.load(f)["size"]
+                    n += 1
+                elif name.endswith(".fb.gz"):
+                    stored += os.path.getsize(os.path.join(shard, name))
+        return n, raw, stored
+
+
+def default_archive():
+    """按 OPEN_METEO_RESPONSE_ARCHIVE 返回归档，设为空字符串时返回 None (不归档)。"""
+    return ResponseArchive(RESPONSE_ARCHIVE_DIR) if RESPONSE_ARCHIVE_DIR else None
+
+
+def replay(archive, loader, start_year=None, end_year=None):
+    """把归档中的响应重新解析并写入数据库，不发起任何网络请求。返回 (请求数, 插入行数)。"""
+    from hourly_batch import responses_to_batch
+
+    n_requests, inserted = 0, 0
+    for request, content in archive.entries(start_year, end_year):
+        batch = responses_to_batch(parse_flatbuffers(content), request.variables, request.points)
+        if len(batch):
+            inserted += loader.load(batch)
+        n_requests += 1
+        if n_requests % 100 == 0:
+            logging.info(f"  Replayed {n_requests} archived responses, {inserted} new rows so far...")
+    return n_requests, inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay the raw Open-Meteo response archive.")
+    parser.add_argument("command", choices=["stats", "replay"])
+    parser.add_argument("--root", default=RESPONSE_ARCHIVE_DIR)
+    parser.add_argument("--start-year", type=int, default=None)
+    parser.add_argument("--end-year", type=int, default=None)
+    args = parser.parse_args()
+    archive = ResponseArchive(args.root)
+
+    if args.command == "stats":
+        n, raw, stored = archive.stats()
+        print(f"{n} archived responses, {raw / 1e6:.1f} MB raw, {stored / 1e6:.1f} MB on disk "
+              f"({raw / max(stored, 1):.1f}x) in {args.root}")
+        return
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+    from grid_loader import GridWeatherLoader
+
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    n_requests, inserted = replay(archive, GridWeatherLoader(conn), args.start_year, args.end_year)
+    conn.close()
+    logging.info(f"Replay completed: {n_requests} archived responses, {inserted} new rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+只读 JSON 接口的响应缓存：进程内 LRU + 可选的磁盘共享存储，ETag 由数据版本号推出。
+
+网格数据只在加载器提交一批时变化 (见 data_version.py)，因此一个响应完全由
+(请求路径 + 查询参数, 数据版本号) 决定：
+    - ETag = "<版本号>-<路径摘要>"，不必计算响应体就能判断客户端的副本是否仍然有效，
+      If-None-Match 命中时直接返回 304
+    - 缓存条目以版本号为准，版本号变化时旧条目全部作废 (LRU 清空，磁盘条目按版本号比对)
+    - 版本号本身在进程内缓存 VERSION_TTL 秒；看板推送通道收到入库通知时立即作废 (expire_version)
+
+RESPONSE_CACHE_DIR 设置后，多个网页服务进程 (例如 gunicorn 的多个 worker) 共享磁盘上的响应体，
+一个进程算出的结果其他进程直接读取。
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from data_version import read_version
+
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "256"))
+CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR") or None
+VERSION_TTL = float(os.getenv("RESPONSE_CACHE_VERSION_TTL", "1"))
+
+
+def _digest(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, disk_dir=CACHE_DIR, version_ttl=VERSION_TTL):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()  # key -> (version, body, mimetype)
+        self._version = None
+        self._version_read_at = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    # ---- 版本号 ----
+
+    def version(self, conn):
+        """当前数据版本号 (最多 version_ttl 秒读一次数据库)；不可用时返回 None。"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version_read_at is not None and now - self._version_read_at < self.version_ttl:
+                return self._version
+        version = read_version(conn)
+        with self._lock:
+            if version != self._version:
+                # 条目只对生成时的版本有效，版本前进后全部作废
+                self._entries.clear()
+            self._version = version
+            self._version_read_at = now
+        return version
+
+    def expire_version(self, *_):
+        """下一次请求重新读取版本号 (入库通知的回调)。"""
+        with self._lock:
+            self._version_read_at = None
+
+    @staticmethod
+    def etag(key, version):
+        return f"{version}-{_digest(key)[:16]}"
+
+    # ---- 条目 ----
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{_digest(key)}.resp")
+
+    def get(self, key, version):
+        """返回 (body, mimetype)；没有该版本的条目时返回 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    header = json.loads(f.readline())
+                    body = f.read()
+            except (OSError, ValueError):
+                header = None
+            if header is not None and header.get("version") == version:
+                self._remember(key, version, body, header["mimetype"])
+                with self._lock:
+                    self.hits += 1
+                return body, header["mimetype"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, version, body, mimetype):
+        with self._lock:
+            self._entries[key] = (version, body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, version, body, mimetype):
+        self._remember(key, version, body, mimetype)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(json.dumps({"version": version, "mimetype": mimetype}).encode("utf-8") + b"\n")
+                f.write(body)
+            os.replace(tmp, path)
+
+    # ---- Flask ----
+
+    def cached(self, get_connection):
+        """
+        Flask 视图装饰器。get_connection 返回本请求的数据库连接 (用于读取版本号)；
+        版本号不可用、响应不是 200 或是流式响应时不缓存，行为与未装饰时相同。
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import Response, make_response, request
+
+                conn = get_connection()
+                version = self.version(conn) if conn else None
+                if version is None:
+                    return view(*args, **kwargs)
+                key = request.full_path
+                etag = self.etag(key, version)
+                if request.if_none_match.contains(etag):
+                    response = Response(status=304)
+                else:
+                    entry = self.get(key, version)
+                    if entry is None:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200 or response.is_streamed:
+                            return response
+                        self.put(key, version, response.get_data(), response.mimetype)
+                    else:
+                        response = Response(entry[0], mimetype=entry[1])
+                response.set_etag(etag)
+                # 允许浏览器保存副本，但每次都用 If-None-Match 重新验证
+                response.headers["Cache-Control"] = "no-cache"
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,181 @@
+"""
+grid_daily / grid_monthly 汇总表，由加载器在每次合并的同一事务中增量刷新。
+
+下游分析都在日或月尺度上进行 (QM 校正用日均温，SPEI 用月 P-ET0)，
+直接读取汇总表比每次扫描小时表少读 24 倍 / 约 730 倍的行。
+
+增量刷新只重算本批数据涉及的 (网格单元, 日期区间)：
+    小时表 -> grid_daily   (按 cell_id + 时间范围走 (cell_id, timestamp) 索引)
+    grid_daily -> grid_monthly
+日期按 timestamp 列的本地日期划分，与 date(timestamp) 的既有用法一致。
+小时值中的 NaN 视为缺测，不参与统计。
+
+对已有数据做一次全量重建:
+    python scripts/data_processing/rollups.py
+"""
+import logging
+
+import pandas as pd
+
+from data_version import bump_version
+
+DAILY_TABLE = "grid_daily"
+MONTHLY_TABLE = "grid_monthly"
+HOURLY_TABLE = "grid_weather_data"
+
+# (汇总列, 小时列, 聚合函数)；温度额外记录最低/最高
+DAILY_AGGREGATES = [
+    ("temperature_mean", "temperature", "avg"),
+    ("temperature_min", "temperature", "min"),
+    ("temperature_max", "temperature", "max"),
+    ("precipitation_sum", "precipitation", "sum"),
+    ("et0_sum", "et0_fao_evapotranspiration", "sum"),
+    ("soil_moisture_mean", "soil_moisture_0_to_7cm", "avg"),
+    ("relative_humidity_mean", "relative_humidity_2m", "avg"),
+    ("wind_speed_mean", "wind_speed_10m", "avg"),
+    ("shortwave_radiation_mean", "shortwave_radiation", "avg"),
+]
+
+# 月值由日值汇总：均值取日均值的平均，极值取日极值的极值，累计量求和
+_MONTHLY_FROM_DAILY = {"avg": "avg", "min": "min", "max": "max", "sum": "sum"}
+
+
+def _column_defs():
+    return ",\n    ".join(f"{name} FLOAT" for name, _, _ in DAILY_AGGREGATES)
+
+
+CREATE_ROLLUPS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+    cell_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    hours SMALLINT NOT NULL,
+    {_column_defs()},
+    PRIMARY KEY (cell_id, day)
+);
+CREATE TABLE IF NOT EXISTS {MONTHLY_TABLE} (
+    cell_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    days SMALLINT NOT NULL,
+    hours SMALLINT NOT NULL,
+    {_column_defs()},
+    water_balance FLOAT GENERATED ALWAYS AS (precipitation_sum - et0_sum) STORED,
+    PRIMARY KEY (cell_id, month)
+);
+-- 按期间读取全区域 (热力图)：主键以 cell_id 开头，需要单独的期间索引
+CREATE INDEX IF NOT EXISTS {DAILY_TABLE}_day_idx ON {DAILY_TABLE} (day);
+CREATE INDEX IF NOT EXISTS {MONTHLY_TABLE}_month_idx ON {MONTHLY_TABLE} (month);
+"""
+
+
+def create_rollup_tables(cur):
+    cur.execute(CREATE_ROLLUPS_SQL)
+
+
+def _upsert_set(names):
+    return ",\n                ".join(f"{n} = EXCLUDED.{n}" for n in names)
+
+
+def _daily_sql(ranges_sql):
+    """ranges_sql 产出 (cell_id, day_from, day_to)，重算 [day_from, day_to) 内的日值。"""
+    names = [name for name, _, _ in DAILY_AGGREGATES]
+    aggregates = ", ".join(f"{fn}(NULLIF(g.{col}, 'NaN'))" for _, col, fn in DAILY_AGGREGATES)
+    return f"""
+        INSERT INTO {DAILY_TABLE} (cell_id, day, hours, {", ".join(names)})
+        SELECT g.cell_id, g.timestamp::date, count(*), {aggregates}
+        FROM ({ranges_sql}) r
+        JOIN {HOURLY_TABLE} g
+          ON g.cell_id = r.cell_id AND g.timestamp >= r.day_from AND g.timestamp < r.day_to
+        GROUP BY g.cell_id, g.timestamp::date
+        ON CONFLICT (cell_id, day) DO UPDATE SET
+                hours = EXCLUDED.hours,
+                {_upsert_set(names)};
+    """
+
+
+def _monthly_sql(ranges_sql):
+    """重算覆盖 [day_from, day_to) 的整月月值。"""
+    names = [name for name, _, _ in DAILY_AGGREGATES]
+    aggregates = ", ".join(f"{_MONTHLY_FROM_DAILY[fn]}(d.{name})" for name, _, fn in DAILY_AGGREGATES)
+    return f"""
+        INSERT INTO {MONTHLY_TABLE} (cell_id, month, days, hours, {", ".join(names)})
+        SELECT d.cell_id, date_trunc('month', d.day::timestamp)::date, count(*), sum(d.hours), {aggregates}
+        FROM ({ranges_sql}) r
+        JOIN {DAILY_TABLE} d
+          ON d.cell_id = r.cell_id
+         AND d.day >= date_trunc('month', r.day_from::timestamp)::date
+         AND d.day < (date_trunc('month', (r.day_to - 1)::timestamp) + interval '1 month')::date
+        GROUP BY d.cell_id, date_trunc('month', d.day::timestamp)
+        ON CONFLICT (cell_id, month) DO UPDATE SET
+                days = EXCLUDED.days,
+                hours = EXCLUDED.hours,
+                {_upsert_set(names)};
+    """
+
+
+def staged_ranges_sql(staging_table):
+    """本连接暂存行涉及的 (cell_id, day_from, day_to)；cell_id 由加载器随数据写入暂存表。"""
+    return f"""
+        SELECT s.cell_id,
+               min(to_timestamp(s.epoch)::timestamp)::date AS day_from,
+               max(to_timestamp(s.epoch)::timestamp)::date + 1 AS day_to
+        FROM {staging_table} s
+        WHERE s.load_id = pg_backend_pid()
+        GROUP BY s.cell_id
+    """
+
+
+def refresh_rollups(cur, ranges_sql):
+    """先刷新日值，再由新的日值刷新月值 (同一事务内后一条语句能看到前一条的结果)。"""
+    cur.execute(_daily_sql(ranges_sql))
+    cur.execute(_monthly_sql(ranges_sql))
+
+
+def rebuild_rollups(conn):
+    """从小时表全量重建汇总 (用于汇总表上线前已入库的数据)，逐个网格单元提交。"""
+    cur = conn.cursor()
+    create_rollup_tables(cur)
+    cur.execute(f"SELECT cell_id, min(timestamp)::date, max(timestamp)::date + 1 FROM {HOURLY_TABLE} GROUP BY cell_id;")
+    ranges = cur.fetchall()
+    for k, (cell_id, day_from, day_to) in enumerate(ranges, 1):
+        refresh_rollups(cur, f"SELECT {int(cell_id)} AS cell_id, DATE '{day_from}' AS day_from, DATE '{day_to}' AS day_to")
+        bump_version(cur)
+        conn.commit()
+        if k % 50 == 0:
+            logging.info(f"  Rolled up {k}/{len(ranges)} cells...")
+    cur.close()
+    logging.info(f"Rollups rebuilt for {len(ranges)} cells.")
+    return len(ranges)
+
+
+def read_daily(conn, cell_id, columns=("temperature_mean",), start=None, end=None):
+    """读取一个网格单元的日值，返回以 date 为列的 DataFrame。"""
+    query = f"""
+        SELECT day AS date, {", ".join(columns)}
+        FROM {DAILY_TABLE}
+        WHERE cell_id = %s AND day >= %s AND day < %s
+        ORDER BY day;
+    """
+    df = pd.read_sql_query(query, conn, params=(cell_id, start or "1900-01-01", end or "2100-01-01"))
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def read_monthly_water_balance(conn, cell_id):
+    """读取一个网格单元的月降水、月 ET0 与 P-ET0，可直接传给 calc_spei.calculate_spei。"""
+    df = pd.read_sql_query(f"""
+        SELECT month, precipitation_sum, et0_sum, water_balance
+        FROM {MONTHLY_TABLE}
+        WHERE cell_id = %s
+        ORDER BY month;
+    """, conn, params=(cell_id,))
+    df["month"] = pd.to_datetime(df["month"])
+    return df
+
+
+if __name__ == "__main__":
+    from batch_fetch_weather import get_db_connection, create_grid_table
+
+    conn = get_db_connection()
+    create_grid_table(conn)
+    rebuild_rollups(conn)
+    conn.close()
@@ -0,0 +1,122 @@
+"""
+时间序列接口的键集分页与流式输出 (JSON 数组 / NDJSON / CSV)。
+
+查询按时间键排序，下一页用 after=<上一页最后一行的时间> 继续 (键集分页)：
+每页都是索引上的一次范围查找，不会像 OFFSET 那样越翻越慢。行通过服务器端 (命名) 游标
+每次取 FETCH_SIZE 行，逐批编码后写给客户端，服务端内存与请求的时间跨度无关，
+第一批行取到后就开始响应。
+
+    keyset_sql()    组装 WHERE 键 > after / 起止时间 / LIMIT 的查询
+    stream_rows()   服务器端游标逐批读取
+    encode_rows()   编码为 JSON 数组、NDJSON 或 CSV 文本块
+"""
+import csv
+import io
+import json
+import math
+from datetime import date, datetime
+
+FETCH_SIZE = 5000
+
+# 格式 -> 响应的 MIME 类型；第一个为缺省格式 (JSON 数组，与分页前的接口兼容)
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def parse_time(value, name):
+    """解析 ISO 日期/时间查询参数，缺省返回 None，格式错误抛出 ValueError。"""
+    if value is None or value == "":
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or timestamp, got {value!r}") from None
+
+
+def keyset_sql(table, columns, key="timestamp", filters=(), after=None, start=None, end=None, limit=None):
+    """
+    返回 (sql, params)。filters 为 [(条件 SQL, 参数), ...]；after 为开区间 (上一页的最后一个键)，
+    start / end 为 [start, end) 时间范围；limit 为 None 时不限行数。
+    """
+    conditions = [condition for condition, _ in filters]
+    params = [param for _, param in filters]
+    if after is not None:
+        conditions.append(f"{key} > %s")
+        params.append(after)
+    if start is not None:
+        conditions.append(f"{key} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{key} < %s")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {key} ASC"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+def stream_rows(conn, sql, params, fetch_size=FETCH_SIZE, name="series_stream"):
+    """用服务器端游标逐批读取，产出行元组的列表；游标在读完或中断时关闭。"""
+    from psycopg2.extensions import cursor as tuple_cursor
+
+    cur = conn.cursor(name=name, cursor_factory=tuple_cursor)
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return value
+
+
+def _json_row(columns, row):
+    return json.dumps(dict(zip(columns, map(_json_value, row))), ensure_ascii=False)
+
+
+def encode_rows(batches, columns, fmt):
+    """把 stream_rows 的批次编码为文本块 (每批一块)；CSV 先输出表头，JSON 数组逐批输出元素。"""
+    if fmt == "json":
+        yield "["
+        separator = ""
+        for rows in batches:
+            yield separator + ",".join(_json_row(columns, row) for row in rows)
+            separator = ","
+        yield "]"
+    elif fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(columns)
+        yield buf.getvalue()
+        for rows in batches:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows([_csv_value(v) for v in row] for row in rows)
+            yield buf.getvalue()
+    elif fmt == "ndjson":
+        for rows in batches:
+            yield "".join(_json_row(columns, row) + "\n" for row in rows)
+    else:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}, got {fmt!r}")
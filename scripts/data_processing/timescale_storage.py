@@ -0,0 +1,157 @@
+"""
+可选的 TimescaleDB 存储模式：把 grid_weather_data 转为按时间分块的 hypertable，
+并开启按网格单元分段、按时间排序的原生压缩。
+
+同一网格单元的小时序列在压缩块中连续存放，相邻值差异很小，34 年的小时档案
+在磁盘上通常能缩小数倍；按 (cell_id, 时间范围) 的查询只会打开时间上相关的块。
+
+需要 timescale/timescaledb 镜像 (见 docker-compose.yml 中的 POSTGRES_IMAGE)。
+压缩块上的 INSERT ... ON CONFLICT 需要 TimescaleDB >= 2.11，加载器因此无需改动。
+
+开启方式：设置 GRID_STORAGE=timescaledb 后，create_grid_table 会自动完成转换；
+也可以手动执行:
+    python scripts/data_processing/timescale_storage.py migrate
+    python scripts/data_processing/timescale_storage.py compress
+    python scripts/data_processing/timescale_storage.py status
+"""
+import argparse
+import logging
+import os
+
+from compact_storage import hourly_storage_table
+
+HOURLY_TABLE = "grid_weather_data"  # 紧凑存储模式下实际操作的是 grid_weather_compact
+GRID_STORAGE = os.getenv("GRID_STORAGE", "heap").lower()
+# 网格约 450 个点，一年约 400 万行，按年分块
+CHUNK_INTERVAL = os.getenv("TIMESCALE_CHUNK_INTERVAL", "1 year")
+# 早于该时间的块由后台任务压缩；本项目的数据都是历史档案，几乎所有块都会被压缩
+COMPRESS_AFTER = os.getenv("TIMESCALE_COMPRESS_AFTER", "30 days")
+MIN_TIMESCALE_VERSION = (2, 11)
+
+
+def timescale_enabled():
+    return GRID_STORAGE == "timescaledb"
+
+
+def timescale_version(cur):
+    """返回已安装扩展的版本元组，未安装时返回 None。"""
+    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'timescaledb';")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return tuple(int(part) for part in row[0].split("-")[0].split(".")[:2])
+
+
+def is_hypertable(cur, table=None):
+    table = table or hourly_storage_table(cur)
+    cur.execute("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = %s;", (table,))
+    return cur.fetchone() is not None
+
+
+def migrate_to_hypertable(conn, chunk_interval=CHUNK_INTERVAL, compress_after=COMPRESS_AFTER):
+    """
+    把 grid_weather_data 转为 hypertable 并设置压缩策略，可重复执行。
+
+    hypertable 上的唯一约束必须包含分块列 timestamp：(cell_id, timestamp) 满足要求，
+    而 SERIAL 主键 id 不满足，因此改为普通索引 (id 仍由序列生成，/api/grid_recent 照常使用)。
+    已有数据会在同一事务中迁移到各个块，大表上耗时较长。
+    """
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS timescaledb;")
+    version = timescale_version(cur)
+    if version < MIN_TIMESCALE_VERSION:
+        raise RuntimeError(f"TimescaleDB {'.'.join(map(str, version))} cannot upsert into compressed chunks; "
+                           f"need >= {'.'.join(map(str, MIN_TIMESCALE_VERSION))}.")
+
+    table = hourly_storage_table(cur)
+    if not is_hypertable(cur, table):
+        logging.info(f"Converting {table} to a hypertable (chunk interval {chunk_interval})...")
+        if table == HOURLY_TABLE:
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey;")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_id_idx ON {table} (id);")
+        cur.execute("""
+            SELECT create_hypertable(%s, 'timestamp', chunk_time_interval => %s::interval,
+                                     migrate_data => true, if_not_exists => true);
+        """, (table, chunk_interval))
+
+    cur.execute(f"""
+        ALTER TABLE {table} SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = 'cell_id',
+            timescaledb.compress_orderby = 'timestamp'
+        );
+    """)
+    cur.execute("SELECT add_compression_policy(%s, %s::interval, if_not_exists => true);",
+                (table, compress_after))
+    conn.commit()
+    cur.close()
+    logging.info(f"{table} is a compressed hypertable (segment by cell_id, order by timestamp).")
+
+
+def compress_now(conn, older_than=COMPRESS_AFTER):
+    """立即压缩所有符合条件的块，不等待后台策略。返回本次压缩的块数。"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT compress_chunk(c, if_not_compressed => true)
+        FROM show_chunks(%s, older_than => %s::interval) c;
+    """, (hourly_storage_table(cur), older_than))
+    n = len(cur.fetchall())
+    conn.commit()
+    cur.close()
+    return n
+
+
+def storage_status(conn):
+    """返回 (块数, 已压缩块数, 压缩前字节数, 压缩后字节数)。"""
+    cur = conn.cursor()
+    table = hourly_storage_table(cur)
+    cur.execute("""
+        SELECT count(*), count(*) FILTER (WHERE is_compressed)
+        FROM timescaledb_information.chunks WHERE hypertable_name = %s;
+    """, (table,))
+    n_chunks, n_compressed = cur.fetchone()
+    cur.execute("""
+        SELECT coalesce(sum(before_compression_total_bytes), 0),
+               coalesce(sum(after_compression_total_bytes), 0)
+        FROM chunk_compression_stats(%s) WHERE compression_status = 'Compressed';
+    """, (table,))
+    before, after = cur.fetchone()
+    cur.close()
+    return n_chunks, n_compressed, before, after
+
+
+def ensure_storage(conn):
+    """create_grid_table 的钩子：GRID_STORAGE=timescaledb 时保证表已转换。"""
+    if not timescale_enabled():
+        return
+    cur = conn.cursor()
+    converted = timescale_version(cur) is not None and is_hypertable(cur)
+    cur.close()
+    if not converted:
+        migrate_to_hypertable(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the optional TimescaleDB storage mode.")
+    parser.add_argument("command", choices=["migrate", "compress", "status"])
+    parser.add_argument("--chunk-interval", default=CHUNK_INTERVAL)
+    parser.add_argument("--compress-after", default=COMPRESS_AFTER)
+    args = parser.parse_args()
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    if args.command == "migrate":
+        migrate_to_hypertable(conn, args.chunk_interval, args.compress_after)
+    elif args.command == "compress":
+        logging.info(f"Compressed {compress_now(conn, args.compress_after)} chunks.")
+    n_chunks, n_compressed, before, after = storage_status(conn)
+    logging.info(f"{n_chunks} chunks, {n_compressed} compressed: "
+                 f"{before / 1e6:.0f} MB -> {after / 1e6:.0f} MB ({before / max(after, 1):.1f}x).")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
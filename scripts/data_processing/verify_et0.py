@@ -1,37 +1,22 @@
-import psycopg2
-import os
 from dotenv import load_dotenv
 import pandas as pd
 from calc_et0 import calculate_et0_fao56
+from db import connect
 import matplotlib.pyplot as plt
 
 # 加载环境变量
 load_dotenv()
 
-# 数据库配置
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "15432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-
 def verify_calculations():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         
         # 获取一个网格点的样本数据
         query = """
         SELECT timestamp, temperature, relative_humidity_2m, wind_speed_10m, 
                shortwave_radiation, et0_fao_evapotranspiration as et0_openmeteo
         FROM grid_weather_data
-        WHERE latitude = (SELECT latitude FROM grid_weather_data LIMIT 1)
-          AND longitude = (SELECT longitude FROM grid_weather_data LIMIT 1)
+        WHERE cell_id = (SELECT cell_id FROM grid_weather_data LIMIT 1)
         ORDER BY timestamp ASC
         LIMIT 100;
         """
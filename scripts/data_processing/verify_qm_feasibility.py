@@ -5,11 +5,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
-import psycopg2
 from dotenv import load_dotenv
 import gzip
 import io
 
+from db import connect
+from grid_cells import lookup_cell
+from rollups import read_daily
+
 # 加载环境变量 (用于连接数据库)
 load_dotenv()
 
@@ -24,15 +27,6 @@ TEST_LON = 110.4782
 # 测试时间段：不再硬编码 2020 年，而是自动寻找公共年份
 TEST_YEAR = None
 
-# 数据库连接配置
-DB_CONFIG = {
-    "host": os.getenv("POSTGRES_HOST", "localhost"),
-    "port": os.getenv("POSTGRES_PORT", "5432"),
-    "dbname": os.getenv("POSTGRES_DB", "gra_env_db"),
-    "user": os.getenv("POSTGRES_USER", "admin"),
-    "password": os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
-}
-
 def get_noaa_data(station_id, year=None):
     """
     读取本地下载的 NOAA ISD-Lite 原始数据
@@ -97,36 +91,18 @@ def get_open_meteo_data(lat, lon, year=None):
     print(f"[2/5] 从数据库查询 Open-Meteo 数据 (Lat: {lat}, Lon: {lon}, Year: {year})...")
     
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        # 查询特定位置、特定年份的数据
-        # 注意：我们需要按照经纬度范围模糊查询 (因为网格点可能有微小偏差)
-        if year:
-            query = """
-            SELECT date(timestamp) as date, temperature as om_temp
-            FROM grid_weather_data
-            WHERE latitude BETWEEN %s - 0.1 AND %s + 0.1
-              AND longitude BETWEEN %s - 0.1 AND %s + 0.1
-              AND extract(year from timestamp) = %s
-            ORDER BY timestamp;
-            """
-            params = (lat, lat, lon, lon, year)
-        else:
-            query = """
-            SELECT date(timestamp) as date, temperature as om_temp
-            FROM grid_weather_data
-            WHERE latitude BETWEEN %s - 0.1 AND %s + 0.1
-              AND longitude BETWEEN %s - 0.1 AND %s + 0.1
-            ORDER BY timestamp;
-            """
-            params = (lat, lat, lon, lon)
-
-        df = pd.read_sql_query(query, conn, params=params)
+        conn = connect()
+        # 站点坐标只解析一次为网格单元 (±0.1° 内最近的一个)，之后按 cell_id 等值查询
+        cell_id = lookup_cell(conn, lat, lon)
+        if cell_id is None:
+            print("      [错误] 附近 ±0.1° 内没有网格单元")
+            conn.close()
+            return pd.DataFrame()
+        # 日均温直接读 grid_daily 汇总表，每天一行，与 NOAA 日均值一一对齐
+        start, end = (f"{year}-01-01", f"{year + 1}-01-01") if year else (None, None)
+        df = read_daily(conn, cell_id, ["temperature_mean AS om_temp"], start, end)
         conn.close()
         
-        # 重命名列以便后续合并
-        # df.columns = ['date', 'om_temp']
-        df['date'] = pd.to_datetime(df['date'])
-        
         print(f"      -> 成功加载 {len(df)} 天的 Open-Meteo 模拟数据")
         return df
     except Exception as e:
@@ -0,0 +1,317 @@
+"""
+按年份声明式分区的小时表与按年的维护操作。
+
+开启后小时数据的物理表 (grid_weather_data，紧凑存储模式下为 grid_weather_compact)
+按 timestamp 做 RANGE 分区，每年一个分区，另有一个 DEFAULT 分区接收范围之外的年份：
+
+    <table>_y1990 ... <table>_y2023   每年约 400 万行
+    <table>_default                   尚未建分区的年份，add-year 会把它们移到独立分区
+
+唯一键 (cell_id, timestamp) 包含分区键，加载器的 ON CONFLICT 无需改动；
+SERIAL 主键 id 不包含分区键，改为普通索引 (/api/grid_recent 照常使用)。
+迁移按 (cell_id, timestamp) 顺序复制，另建 (cell_id, timestamp) 上的 BRIN 索引：
+按时间范围的扫描 (汇总重算、按年统计) 先由分区裁剪到相关年份，再由 BRIN 跳过无关的块。
+
+年份一律按 UTC 划分，与抓取请求、入库清单和抓取作业一致。timestamp 列存的是会话时区
+(库默认 Asia/Shanghai) 下的本地时间，因此 UTC 年 Y 对应本地 Y-01-01 08:00 到 Y+1-01-01 08:00；
+分区边界和查询范围都由 make_timestamptz(..., 'UTC')::timestamp 换算得到，一个分区恰好是一个 UTC 年。
+分区边界在建分区时按当时的会话时区固定，之后不要更改数据库的时区。
+
+查询请使用 timestamp >= 年初 AND timestamp < 次年年初 这样的范围条件
+(year_bounds + year_range_sql / year_counts_sql)，extract(year FROM timestamp) = ... 无法裁剪分区。
+按年的维护变为分区级操作：truncate-year 清空一年 (重新抓取前)，VACUUM / 导出也只涉及一个分区。
+
+开启方式：设置 GRID_STORAGE=partitioned 后，create_grid_table 会自动完成迁移；
+也可以手动执行 (迁移期间请停止抓取进程):
+    python scripts/data_processing/year_partitions.py migrate
+    python scripts/data_processing/year_partitions.py add-year 2024
+    python scripts/data_processing/year_partitions.py truncate-year 1991
+    python scripts/data_processing/year_partitions.py status
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+
+from compact_storage import COMPACT_TABLE, create_decode_view_sql, hourly_storage_table
+from fetch_jobs import JOBS_TABLE
+from ingest_manifest import MANIFEST_TABLE
+from rollups import DAILY_TABLE, MONTHLY_TABLE, refresh_rollups
+from timescale_storage import GRID_STORAGE, HOURLY_TABLE
+
+# 迁移时旧表改名加上的后缀，确认无误后可用 --drop-old 删除
+OLD_SUFFIX = "_unpartitioned"
+BRIN_PAGES_PER_RANGE = 32
+
+
+def partitioning_enabled():
+    return GRID_STORAGE == "partitioned"
+
+
+# 把 UTC 时刻参数换算为 timestamp 列中的会话本地时间
+LOCAL_TIMESTAMP = "%s::timestamptz::timestamp"
+
+
+def year_bounds(year):
+    """一个 UTC 年的 [起, 止) 时刻 (带时区)，在 SQL 中以 LOCAL_TIMESTAMP 换算后使用。"""
+    return datetime(year, 1, 1, tzinfo=timezone.utc), datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+
+
+def utc_year_sql(column="timestamp"):
+    """timestamp 列 (会话本地时间) 所属的 UTC 年。"""
+    return f"extract(year FROM {column}::timestamptz AT TIME ZONE 'UTC')::int"
+
+
+def year_range_sql(column="timestamp"):
+    """以 year_bounds(year) 为参数的可裁剪分区的范围条件。"""
+    return f"{column} >= {LOCAL_TIMESTAMP} AND {column} < {LOCAL_TIMESTAMP}"
+
+
+def year_counts_sql(aggregates, table=HOURLY_TABLE):
+    """
+    按 UTC 年统计 grid_weather_data 的 SQL。年份取自入库清单 (小表)，每年一个范围子查询，
+    执行时只扫描该年的分区，而不是对整表按 extract(year ...) 分组。
+    结果列: year, 之后是 aggregates。
+    """
+    return f"""
+        SELECT y.year, s.*
+        FROM (SELECT DISTINCT year FROM {MANIFEST_TABLE}) y
+        CROSS JOIN LATERAL (
+            SELECT {aggregates}
+            FROM {table}
+            WHERE timestamp >= make_timestamptz(y.year, 1, 1, 0, 0, 0, 'UTC')::timestamp
+              AND timestamp < make_timestamptz(y.year + 1, 1, 1, 0, 0, 0, 'UTC')::timestamp
+        ) s
+        ORDER BY y.year;
+    """
+
+
+def _relkind(cur, name):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (name,))
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def partition_name(table, year):
+    return f"{table}_y{year}"
+
+
+def is_partitioned(cur):
+    return _relkind(cur, hourly_storage_table(cur)) == "p"
+
+
+def _create_partitioned(cur, table, old, years):
+    cur.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp);")
+    for year in years:
+        start, end = year_bounds(year)
+        cur.execute(f"CREATE TABLE {partition_name(table, year)} PARTITION OF {table} "
+                    f"FOR VALUES FROM ({LOCAL_TIMESTAMP}) TO ({LOCAL_TIMESTAMP});", (start, end))
+    cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;")
+    # 分区表上的索引会自动建在每个分区上
+    cur.execute(f"CREATE UNIQUE INDEX {table}_cell_id_timestamp_key ON {table} (cell_id, timestamp);")
+    cur.execute(f"CREATE INDEX {table}_id_idx ON {table} (id);")
+    cur.execute(f"""
+        CREATE INDEX {table}_brin_idx ON {table}
+        USING brin (cell_id, timestamp) WITH (pages_per_range = {BRIN_PAGES_PER_RANGE});
+    """)
+
+
+def migrate_to_partitioned(conn, years, cells_per_batch=20, drop_old=False):
+    """
+    把小时数据的物理表迁移为按年分区的表，可重复执行 (中断后继续)。
+
+    旧表及其索引改名加上 _unpartitioned 后缀，新表沿用原名；数据按网格单元分批复制并
+    逐批提交，同一单元的行在每个年份分区内连续存放。years 之外的年份落入 DEFAULT 分区。
+    返回复制的行数。
+    """
+    cur = conn.cursor()
+    table = hourly_storage_table(cur)
+    old = table + OLD_SUFFIX
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb';")
+    if cur.fetchone() is not None:
+        cur.execute("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = %s;", (table,))
+        if cur.fetchone() is not None:
+            raise RuntimeError(f"{table} is a TimescaleDB hypertable, which is already partitioned by time.")
+
+    if _relkind(cur, table) == "r":
+        logging.info(f"Partitioning {table} by year ({min(years)}-{max(years)} plus a default partition)...")
+        cur.execute(f"ALTER TABLE {table} RENAME TO {old};")
+        # 索引名在 schema 内唯一，旧索引让出名字给新表
+        cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s;", (old,))
+        for (index,) in cur.fetchall():
+            cur.execute(f"ALTER INDEX {index} RENAME TO {index}{OLD_SUFFIX};")
+        _create_partitioned(cur, table, old, years)
+        conn.commit()
+
+    copied = 0
+    if _relkind(cur, old) == "r":
+        cur.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = %s "
+                    f"ORDER BY ordinal_position;", (table,))
+        columns = ", ".join(r[0] for r in cur.fetchall())
+        cur.execute("SELECT id FROM grid_cell ORDER BY id;")
+        cell_ids = [r[0] for r in cur.fetchall()]
+        for k in range(0, len(cell_ids), cells_per_batch):
+            cur.execute(f"""
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM {old}
+                WHERE cell_id = ANY(%s)
+                ORDER BY cell_id, timestamp
+                ON CONFLICT (cell_id, timestamp) DO NOTHING;
+            """, (cell_ids[k:k + cells_per_batch],))
+            copied += cur.rowcount
+            conn.commit()
+            logging.info(f"  Copied {min(k + cells_per_batch, len(cell_ids))}/{len(cell_ids)} cells "
+                         f"({copied} rows so far)...")
+
+        # id 序列改为归属新表，删除旧表时不会被连带删除
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (old,))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id;")
+        if table == COMPACT_TABLE:
+            # 视图按 OID 引用旧表，需要重新指向新表
+            cur.execute(create_decode_view_sql())
+        conn.commit()
+    if drop_old:
+        cur.execute(f"DROP TABLE IF EXISTS {old};")
+        conn.commit()
+    cur.close()
+    logging.info(f"{table} is partitioned by year; copied {copied} rows.")
+    return copied
+
+
+def add_year_partition(conn, year):
+    """
+    为一年建立独立分区。DEFAULT 分区里已有的该年数据在同一事务中移入新分区，
+    返回移动的行数；分区已存在时返回 0。
+    """
+    cur = conn.cursor()
+    table = hourly_storage_table(cur)
+    name = partition_name(table, year)
+    if _relkind(cur, name) is not None:
+        cur.close()
+        return 0
+    start, end = year_bounds(year)
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS);")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE {year_range_sql()} RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved ORDER BY cell_id, timestamp;
+    """, (start, end))
+    moved = cur.rowcount
+    # ATTACH 会校验行都在范围内并自动建立分区索引
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ({LOCAL_TIMESTAMP}) TO ({LOCAL_TIMESTAMP});", (start, end))
+    conn.commit()
+    cur.close()
+    return moved
+
+
+def _local_bounds(cur, year):
+    """UTC 年在会话时区下的 [起, 止) 本地时间。"""
+    cur.execute(f"SELECT {LOCAL_TIMESTAMP}, {LOCAL_TIMESTAMP};", year_bounds(year))
+    return cur.fetchone()
+
+
+def _partition_bound(cur, name):
+    cur.execute("SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE oid = to_regclass(%s);", (name,))
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def truncate_year(conn, year):
+    """
+    清空一个 UTC 年的小时数据以便整年重新抓取，并删除该年的入库清单和 grid_stats 计数、
+    把该年的抓取作业重置为 pending，下次运行抓取进程时整年重新入库。
+
+    分区边界恰好是该 UTC 年时直接 TRUNCATE 分区；旧版本按本地年份建立的分区
+    与 UTC 年错开 (例如 Asia/Shanghai 下差 8 小时)，改为按 UTC 范围 DELETE，
+    相邻年份的行不受影响。日/月汇总按本地日期划分，首尾两天同时含有相邻年份的小时，
+    删除受影响的日期后按剩余的小时数据重算。
+    """
+    from data_version import bump_version
+    from grid_stats import STATS_TABLE
+
+    cur = conn.cursor()
+    table = hourly_storage_table(cur)
+    name = partition_name(table, year)
+    if _relkind(cur, name) is None:
+        raise ValueError(f"{table} has no partition for {year}; run add-year first.")
+    lo, hi = _local_bounds(cur, year)
+    if _partition_bound(cur, name) == f"FOR VALUES FROM ('{lo:%Y-%m-%d %H:%M:%S}') TO ('{hi:%Y-%m-%d %H:%M:%S}')":
+        cur.execute(f"TRUNCATE {name};")
+    else:
+        logging.warning(f"{name} is not aligned to the UTC year; deleting the UTC range instead of truncating.")
+        cur.execute(f"DELETE FROM {table} WHERE {year_range_sql()};", year_bounds(year))
+    cur.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE year = %s;", (year,))
+    cur.execute(f"UPDATE {JOBS_TABLE} SET status = 'pending', updated_at = now() WHERE year = %s;", (year,))
+    cur.execute(f"DELETE FROM {STATS_TABLE} WHERE year = %s;", (year,))
+
+    # 受影响的本地日期 [day_from, day_to) 及其所在的整月
+    day_from = lo.date()
+    day_to = (hi - timedelta(microseconds=1)).date() + timedelta(days=1)
+    last = day_to - timedelta(days=1)
+    month_to = datetime(last.year + last.month // 12, last.month % 12 + 1, 1).date()
+    cur.execute(f"DELETE FROM {DAILY_TABLE} WHERE day >= %s AND day < %s;", (day_from, day_to))
+    cur.execute(f"DELETE FROM {MONTHLY_TABLE} WHERE month >= %s AND month < %s;",
+                (day_from.replace(day=1), month_to))
+    refresh_rollups(cur, f"SELECT id AS cell_id, DATE '{day_from}' AS day_from, DATE '{day_to}' AS day_to "
+                         f"FROM grid_cell")
+    bump_version(cur)
+    conn.commit()
+    cur.close()
+
+
+def partition_status(conn):
+    """返回 [(分区名, 估计行数, 字节数)]，行数来自统计信息，不扫描数据。"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname, greatest(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname;
+    """, (hourly_storage_table(cur),))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def ensure_partitions(conn, years):
+    """create_grid_table 的钩子：GRID_STORAGE=partitioned 时保证表已分区。"""
+    if not partitioning_enabled():
+        return
+    cur = conn.cursor()
+    partitioned = is_partitioned(cur)
+    cur.close()
+    if not partitioned:
+        migrate_to_partitioned(conn, years)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage year partitions of the hourly grid table.")
+    parser.add_argument("command", choices=["migrate", "add-year", "truncate-year", "status"])
+    parser.add_argument("year", nargs="?", type=int, help="year for add-year / truncate-year")
+    parser.add_argument("--drop-old", action="store_true", help="drop the unpartitioned table after migrating")
+    args = parser.parse_args()
+    if args.command in ("add-year", "truncate-year") and args.year is None:
+        parser.error(f"{args.command} needs a year")
+
+    # batch_fetch_weather 在导入时会初始化日志，因此延迟导入
+    import batch_fetch_weather as fetcher
+
+    conn = fetcher.get_db_connection()
+    fetcher.create_grid_table(conn)
+    if args.command == "migrate":
+        migrate_to_partitioned(conn, range(fetcher.START_YEAR, fetcher.END_YEAR + 1), drop_old=args.drop_old)
+    elif args.command == "add-year":
+        logging.info(f"Added partition for {args.year}; moved {add_year_partition(conn, args.year)} rows.")
+    elif args.command == "truncate-year":
+        truncate_year(conn, args.year)
+        logging.info(f"Truncated {args.year}; re-run the fetcher to reload it.")
+    for name, rows, size in partition_status(conn):
+        logging.info(f"  {name}: ~{rows} rows, {size / 1e6:.0f} MB")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,21 @@
 import os
-import psycopg2
+import sys
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_processing"))
+from compact_storage import hourly_storage_table
+from db import connect
+from grid_stats import reset_stats
 
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "15432")
-DB_NAME = os.getenv("POSTGRES_DB", "gra_env_db")
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "secure_password_dev")
+load_dotenv()
 
 def reset_db():
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS
-        )
+        conn = connect()
         cur = conn.cursor()
         print("正在清理旧数据...")
-        cur.execute("TRUNCATE TABLE grid_weather_data;")
+        cur.execute(f"TRUNCATE TABLE {hourly_storage_table(cur)};")
+        reset_stats(cur)
         conn.commit()
         print("✅ 数据库表格 'grid_weather_data' 已清空。")
         cur.close()
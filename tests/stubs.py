@@ -0,0 +1,87 @@
+"""
+测试共用的数据库替身 (不需要 PostgreSQL)。
+
+StubCursor 记录执行过的语句 statements = [(sql, params), ...]，sql 的空白已归一为单个空格；
+copy_expert 记录为 (sql, 读出的数据)。
+查询结果有两种给法：
+    StubCursor([r1, r2, ...])                  fetchone / fetchall 按顺序各取一个预设结果
+    StubCursor(answers=[(片段, 行), ...])       按语句中出现的片段返回行，与执行顺序无关；
+                                               行也可以是 params -> 行 的函数
+"""
+from unittest import mock
+
+
+class StubCursor:
+    def __init__(self, results=(), answers=None, rowcount=0):
+        self.results = list(results)
+        self.answers = answers
+        self.rowcount = rowcount
+        self.statements = []
+        self.closed = False
+        self._rows = None
+
+    @property
+    def sql(self):
+        return [s for s, _ in self.statements]
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+        self._rows = None
+        if self.answers is not None:
+            self._rows = next((list(rows(params) if callable(rows) else rows)
+                               for fragment, rows in self.answers if fragment in sql), [])
+            self.rowcount = len(self._rows)
+
+    def copy_expert(self, sql, file):
+        self.statements.append((" ".join(sql.split()), file.read()))
+
+    def fetchone(self):
+        if self.answers is not None:
+            return self._rows[0] if self._rows else None
+        return self.results.pop(0)
+
+    def fetchall(self):
+        if self.answers is not None:
+            return self._rows
+        return self.results.pop(0)
+
+    def fetchmany(self, size):
+        # 逐页取当前结果 (服务器端命名游标的用法)
+        if self._rows is None:
+            self._rows = list(self.results.pop(0))
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class StubConnection:
+    """cursor() 依次返回给定的游标，只剩一个时一直返回它；记录 commit / rollback 次数。"""
+
+    def __init__(self, *cursors):
+        self.cursors = list(cursors) or [StubCursor()]
+        self.commits = 0
+        self.rollbacks = 0
+
+    @property
+    def cur(self):
+        return self.cursors[0]
+
+    def cursor(self, *args, **kwargs):
+        cur = self.cursors.pop(0) if len(self.cursors) > 1 else self.cursors[0]
+        cur.connection = self
+        return cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def import_fetcher():
+    """batch_fetch_weather 导入时会配置日志并在当前目录建日志文件，测试中跳过。"""
+    with mock.patch("logging.basicConfig"), mock.patch("logging.handlers.WatchedFileHandler"):
+        import batch_fetch_weather
+    return batch_fetch_weather
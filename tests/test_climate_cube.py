@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from climate_cube import ClimateCube, year_start_epoch
+
+# (cell_id, lat, lon)，故意打乱顺序
+CELLS = [(7, 36.5, 115.0), (3, 36.0, 115.5), (5, 36.0, 115.0)]
+
+
+class TestClimateCube(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cube = ClimateCube(self.tmp.name)
+        self.cube.set_layout(CELLS)
+
+    def tearDown(self):
+        self.cube._close()
+        self.tmp.cleanup()
+
+    def write_hours(self, cube, year, cell_id, hours, temperature):
+        epoch = year_start_epoch(year) + 3600 * np.asarray(hours)
+        values = np.column_stack([temperature, np.zeros(len(hours))])
+        cube.write(year, [cell_id] * len(hours), epoch, values, ["temperature", "precipitation"])
+
+    def test_cells_are_ordered_by_latitude_then_longitude(self):
+        self.assertEqual(self.cube.cells[:, 0].tolist(), [5, 3, 7])
+        self.assertEqual(self.cube.bbox(35.9, 36.1, 114.0, 116.0).tolist(), [0, 1])
+
+    def test_write_then_read_views_after_reopen(self):
+        self.write_hours(self.cube, 2001, 3, [0, 1, 8759], [1.0, 2.0, 3.0])
+        self.cube.commit("2024-01-01T00:00:00", years=[2001], complete=True)
+
+        cube = ClimateCube(self.tmp.name)
+        self.assertEqual(cube.synced_at, "2024-01-01T00:00:00")
+        year = cube.year(2001)
+        self.assertEqual(year.shape, (8760, 3, len(cube.variables)))
+        series = cube.select(2001, cells=3, variable="temperature_2m")
+        self.assertTrue(np.shares_memory(series, year))
+        self.assertEqual(series[[0, 1, 8759]].tolist(), [1.0, 2.0, 3.0])
+        self.assertTrue(np.isnan(series[2]))
+        # 连续的单元下标仍是视图
+        self.assertTrue(np.shares_memory(cube.select(2001, cells=[0, 1]), year))
+        self.assertTrue(np.isnan(cube.select(2001, cells=7, variable="temperature")).all())
+        cube._close()
+
+    def test_new_cells_keep_existing_data(self):
+        self.write_hours(self.cube, 2000, 7, [5], [9.5])
+        self.cube.commit("2024-01-01T00:00:00", years=[2000])
+        self.cube.set_layout(CELLS + [(9, 35.5, 115.0)])
+        self.assertEqual(self.cube.cells[0, 0], 9)
+        self.assertEqual(self.cube.select(2000, cells=7, variable="temperature")[5], 9.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
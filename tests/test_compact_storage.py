@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from compact_storage import COLUMN_SCALES, compact_enabled, create_decode_view_sql, decode, encode
+from grid_loader import BATCH_KEY_COLUMNS, GridWeatherLoader
+from stubs import StubCursor
+
+
+class TestEncoding(unittest.TestCase):
+    def test_round_trip_is_within_half_a_step(self):
+        rng = np.random.default_rng(0)
+        samples = {
+            "temperature": rng.uniform(-30, 45, 1000),
+            "precipitation": rng.uniform(0, 80, 1000),
+            "et0_fao_evapotranspiration": rng.uniform(0, 1.5, 1000),
+            "soil_moisture_0_to_7cm": rng.uniform(0, 0.6, 1000),
+            "relative_humidity_2m": rng.uniform(0, 100, 1000),
+            "wind_speed_10m": rng.uniform(0, 120, 1000),
+            "shortwave_radiation": rng.uniform(0, 1100, 1000),
+        }
+        self.assertEqual(set(samples), set(COLUMN_SCALES))
+        for column, values in samples.items():
+            values = values.astype(np.float32)
+            stored, valid = encode(values, column)
+            self.assertEqual(stored.dtype, np.int16)
+            self.assertTrue(valid.all())
+            np.testing.assert_allclose(decode(stored, column), values, atol=COLUMN_SCALES[column] / 2 + 1e-6)
+
+    def test_nan_and_out_of_range_values_become_missing(self):
+        stored, valid = encode([1.5, np.nan, 1e6, -1e6], "temperature")
+        self.assertEqual(valid.tolist(), [True, False, False, False])
+        decoded = decode(stored, "temperature", valid)
+        self.assertAlmostEqual(decoded[0], 1.5)
+        self.assertTrue(np.isnan(decoded[1:]).all())
+
+
+class TestCompactSql(unittest.TestCase):
+    def test_view_decodes_every_column_and_takes_coordinates_from_grid_cell(self):
+        sql = create_decode_view_sql()
+        self.assertIn("CREATE OR REPLACE VIEW grid_weather_data", sql)
+        self.assertIn("(g.temperature * 0.01::float8) AS temperature", sql)
+        for column in COLUMN_SCALES:
+            self.assertIn(f"AS {column}", sql)
+        self.assertIn("LEFT JOIN grid_cell c ON c.id = g.cell_id", sql)
+
+    def test_compact_mode_follows_the_relation_kind(self):
+        self.assertTrue(compact_enabled(StubCursor([("v",)])))
+        self.assertFalse(compact_enabled(StubCursor([("r",)])))
+        self.assertFalse(compact_enabled(StubCursor([None])))
+
+    def test_loader_writes_encoded_values_without_coordinates(self):
+        loader = GridWeatherLoader(None)
+        loader.compact = True
+        sql = loader.merge_sql(BATCH_KEY_COLUMNS + ["temperature", "precipitation"])
+        self.assertIn("INSERT INTO grid_weather_compact (cell_id, timestamp, temperature, precipitation)", sql)
+        self.assertIn("grid_encode(s.temperature, 0.01)", sql)
+        self.assertNotIn("latitude,", sql.split("SELECT")[1].split("FROM")[0])
+        self.assertIn("ON CONFLICT (cell_id, timestamp) DO UPDATE SET", sql)
+        self.assertIn("temperature = COALESCE(grid_weather_compact.temperature, EXCLUDED.temperature)", sql)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+
+import db
+import stubs
+
+
+class StubConnection(stubs.StubConnection):
+    """带事务状态的连接，供连接池测试使用。"""
+
+    def __init__(self):
+        super().__init__()
+        self.prepared = set()
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        super().rollback()
+        self.status = TRANSACTION_STATUS_IDLE
+
+
+class StubPool:
+    """代替 ThreadedConnectionPool，记录借出和归还。"""
+
+    def __init__(self):
+        self.returned = []
+
+    def getconn(self):
+        return StubConnection()
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+def stub_pool(maxconn=2, timeout=0.05):
+    pool = db.ConnectionPool.__new__(db.ConnectionPool)
+    pool.timeout = timeout
+    pool._slots = threading.BoundedSemaphore(maxconn)
+    pool._pool = StubPool()
+    return pool
+
+
+class TestPreparedStatements(unittest.TestCase):
+    def test_statement_is_prepared_once_per_connection(self):
+        cur = StubConnection().cursor()
+        db.execute_prepared(cur, "series", "SELECT * FROM t WHERE id = $1", (7,))
+        db.execute_prepared(cur, "series", "SELECT * FROM t WHERE id = $1", (8,))
+        sql = cur.sql
+        self.assertEqual(sql, ["PREPARE series AS SELECT * FROM t WHERE id = $1",
+                               "EXECUTE series (%s)", "EXECUTE series (%s)"])
+        self.assertEqual(cur.statements[-1][1], (8,))
+
+    def test_statement_without_parameters(self):
+        cur = StubConnection().cursor()
+        db.execute_prepared(cur, "recent", "SELECT 1")
+        self.assertEqual(cur.statements[-1], ("EXECUTE recent", None))
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_exhausted_pool_waits_then_gives_up(self):
+        pool = stub_pool(maxconn=1)
+        conn = pool.getconn()
+        with self.assertRaises(PoolError):
+            pool.getconn()
+        pool.putconn(conn)
+        pool.putconn(pool.getconn())
+
+    def test_open_transaction_is_rolled_back_before_reuse(self):
+        pool = stub_pool()
+        with pool.connection() as conn:
+            conn.status = TRANSACTION_STATUS_INTRANS
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(pool._pool.returned, [(conn, False)])
+
+    def test_closed_connection_is_discarded(self):
+        pool = stub_pool()
+        with pool.connection() as conn:
+            conn.closed = 2
+        self.assertEqual(pool._pool.returned, [(conn, True)])
+
+
+class TestFlaskCheckout(unittest.TestCase):
+    def setUp(self):
+        from flask import Flask
+
+        self.saved = db._pool
+        db._pool = stub_pool()
+        self.app = Flask(__name__)
+        db.init_app(self.app)
+
+    def tearDown(self):
+        db._pool = self.saved
+
+    def test_one_connection_per_request_returned_at_teardown(self):
+        with self.app.app_context():
+            first = db.request_connection()
+            self.assertIs(db.request_connection(), first)
+            self.assertEqual(db._pool._pool.returned, [])
+        self.assertEqual(db._pool._pool.returned, [(first, False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import re
+import sqlite3
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+import fetch_jobs
+from fetch_jobs import claim_job, finish_job, renew_lease, seed_jobs
+from stubs import StubConnection, StubCursor, import_fetcher
+
+
+class SqliteJobsCursor:
+    """
+    在 SQLite 中执行 claim_job 的 CTE (去掉 PostgreSQL 特有的行锁语法)，返回被领取的行。
+    用来检查 year - row_number() 分组和过期租约的判断，不是完整的 PostgreSQL 语义。
+    """
+
+    NOW = 1000
+
+    def __init__(self, jobs):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute("CREATE TABLE fetch_jobs (chunk_index INTEGER, year INTEGER, status TEXT, "
+                        "lease_expires_at INTEGER)")
+        self.db.executemany("INSERT INTO fetch_jobs VALUES (?, ?, ?, ?)", jobs)
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        select = sql[sql.index("WITH"):sql.index("UPDATE fetch_jobs j SET")]
+        select = re.sub(r"FOR UPDATE( OF j)? SKIP LOCKED", "", select).replace("now()", str(self.NOW))
+        max_years = params[0]
+        self._rows = [(chunk, year, [36.0], [115.0]) for chunk, year in self.db.execute(
+            select.replace("%s", "?") + " SELECT chunk_index, year FROM run ORDER BY year DESC", (max_years,))]
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class TestClaimJob(unittest.TestCase):
+    def claim(self, jobs, max_years):
+        cur = SqliteJobsCursor(jobs)
+        conn = StubConnection(cur)
+        return claim_job(conn, "host:1", lease_seconds=60, max_years=max_years), cur, conn
+
+    def test_claims_only_the_unbroken_run_of_years(self):
+        # 1992 已完成，1993 之后的年份不能接到 1991 后面
+        jobs = [(0, 1990, "pending", None), (0, 1991, "pending", None), (0, 1992, "done", None),
+                (0, 1993, "pending", None), (1, 1990, "pending", None)]
+        job, cur, conn = self.claim(jobs, max_years=5)
+        self.assertEqual(job, (0, [1990, 1991], [36.0], [115.0]))
+        self.assertEqual(cur.statements[0][1], (5, "host:1", 60))
+        self.assertEqual(conn.commits, 1)
+
+    def test_expired_leases_are_reclaimed_but_live_ones_are_not(self):
+        now = SqliteJobsCursor.NOW
+        jobs = [(0, 1990, "claimed", now + 10), (1, 1990, "claimed", now - 10), (1, 1991, "pending", None),
+                (1, 1992, "claimed", now + 10)]
+        job, cur, _ = self.claim(jobs, max_years=3)
+        self.assertEqual(job[:2], (1, [1990, 1991]))
+        sql = cur.statements[0][0]
+        self.assertIn("FOR UPDATE SKIP LOCKED", sql)
+        self.assertIn("FOR UPDATE OF j SKIP LOCKED", sql)
+
+    def test_nothing_left_to_claim(self):
+        job, _, conn = self.claim([(0, 1990, "done", None)], max_years=1)
+        self.assertIsNone(job)
+        self.assertEqual(conn.commits, 1)
+
+
+class TestLeaseGuards(unittest.TestCase):
+    def test_renew_only_touches_jobs_still_claimed_by_this_worker(self):
+        cur = StubCursor(rowcount=0)
+        self.assertFalse(renew_lease(StubConnection(cur), 3, 1991, "host:1", lease_seconds=60))
+        sql, params = cur.statements[0]
+        self.assertIn("claimed_by = %s AND status = 'claimed'", sql)
+        self.assertEqual(params, (60, 3, [1991], "host:1"))
+        self.assertTrue(renew_lease(StubConnection(StubCursor(rowcount=2)), 3, [1991, 1992], "host:1"))
+
+    def test_finish_records_the_error_only_for_this_worker(self):
+        cur = StubCursor()
+        finish_job(StubConnection(cur), 3, [1991, 1992], "host:1", False, error="x" * 2000)
+        sql, params = cur.statements[0]
+        self.assertIn("WHERE chunk_index = %s AND year = ANY(%s) AND claimed_by = %s", sql)
+        self.assertEqual(params[0], "failed")
+        self.assertEqual(len(params[1]), 1000)
+        self.assertEqual(params[2:], (3, [1991, 1992], "host:1"))
+
+        cur = StubCursor()
+        finish_job(StubConnection(cur), 3, 1991, "host:1", True, error="ignored")
+        self.assertEqual(cur.statements[0][1][:2], ("done", None))
+
+
+class TestSeedJobs(unittest.TestCase):
+    def test_existing_jobs_keep_their_state(self):
+        grid = {"latitude": mock.Mock(tolist=lambda: [36.0, 36.5, 37.0]),
+                "longitude": mock.Mock(tolist=lambda: [115.0, 115.0, 115.0])}
+        calls = []
+
+        def fake_execute_values(cur, sql, rows, page_size=None):
+            calls.append((" ".join(sql.split()), rows))
+            cur.rowcount = 0 if len(calls) > 1 else len(rows)
+
+        cur = StubCursor()
+        with mock.patch.object(fetch_jobs, "execute_values", side_effect=fake_execute_values):
+            self.assertEqual(seed_jobs(StubConnection(cur), grid, [1990, 1991], chunk_size=2), 4)
+            # 再次登记同一网格不新增作业
+            self.assertEqual(seed_jobs(StubConnection(cur), grid, [1990, 1991], chunk_size=2), 0)
+        sql, rows = calls[0]
+        self.assertIn("ON CONFLICT (chunk_index, year) DO NOTHING", sql)
+        self.assertEqual([r[:2] for r in rows], [(0, 1990), (0, 1991), (1, 1990), (1, 1991)])
+        self.assertEqual(rows[2][2:], ([37.0], [115.0]))
+
+
+class TestClaimNextRequests(unittest.TestCase):
+    def test_complete_years_are_finished_and_the_rest_split_into_spans(self):
+        fetcher = import_fetcher()
+        jobs = [(0, [1990], [36.0], [115.0]), (1, [1990, 1991, 1992, 1993], [36.0, 36.5], [115.0, 115.0])]
+        finished = []
+        with mock.patch.object(fetcher, "claim_job", side_effect=jobs), \
+                mock.patch.object(fetcher, "incomplete_years", side_effect=[[], [1990, 1992, 1993]]), \
+                mock.patch.object(fetcher, "finish_job",
+                                  side_effect=lambda conn, chunk, years, worker, ok: finished.append((chunk, years))):
+            requests = fetcher.claim_next_requests(None, "host:1")
+        # chunk 0 整体已完整，不发请求；chunk 1 的 1991 已完整，其余年份按连续区间拆成两个请求
+        self.assertEqual(finished, [(0, [1990]), (1, [1991])])
+        self.assertEqual([r.tag for r in requests], [(1, [1990]), (1, [1992, 1993])])
+        self.assertEqual(len(requests[0].points), 2)
+
+    def test_no_jobs_left(self):
+        fetcher = import_fetcher()
+        with mock.patch.object(fetcher, "claim_job", return_value=None):
+            self.assertEqual(fetcher.claim_next_requests(None, "host:1"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from fetch_request import FetchRequest
+from proxy_pool import ProxyPool, ProxyWorker
+from stubs import import_fetcher
+
+
+class TestRunFetchQueue(unittest.TestCase):
+    def setUp(self):
+        self.fetcher = import_fetcher()
+        self.loader = mock.Mock()
+        self.loader.load.side_effect = len
+        patches = [
+            mock.patch.object(self.fetcher, "get_db_connection"),
+            mock.patch.object(self.fetcher, "create_grid_table"),
+            mock.patch.object(self.fetcher, "GridWeatherLoader", return_value=self.loader),
+            mock.patch.object(self.fetcher, "default_archive", return_value=None),
+            mock.patch.object(self.fetcher, "create_openmeteo_session"),
+            mock.patch.object(self.fetcher, "responses_to_batch", side_effect=lambda responses, *_: responses),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.pool = ProxyPool([ProxyWorker("proxy-0", "http://stub")])
+        self.requests = [FetchRequest.for_years([(36.0, 115.0)], year, tag=(0, [year])) for year in (1990, 1991, 1992)]
+
+    def run_queue(self, fetch, **kwargs):
+        done = []
+
+        def on_done(request, ok):
+            done.append((request.tag[1][0], ok, threading.current_thread() is threading.main_thread()))
+
+        with mock.patch.object(self.fetcher, "fetch_responses", side_effect=fetch):
+            asyncio.run(asyncio.wait_for(self.fetcher.run_fetch_queue(
+                self.requests, concurrency=1, on_done=on_done, pool=self.pool, **kwargs), timeout=5))
+        return done
+
+    def test_waiting_requests_keep_their_leases_and_jobs_finish_off_the_event_loop(self):
+        renewed = []
+
+        def slow_fetch(session, request, archive):
+            time.sleep(0.3)
+            return [request.tag[1][0]]
+
+        done = self.run_queue(slow_fetch, renew=lambda requests: renewed.append({r.tag[1][0] for r in requests}),
+                              renew_every=0.05)
+        self.assertEqual(sorted(done), [(1990, True, False), (1991, True, False), (1992, True, False)])
+        # 第一个请求在途时，排在后面的请求也一起续租
+        self.assertTrue(any({1990, 1991} <= years for years in renewed))
+        # 结束的请求不再续租
+        self.assertNotIn(1990, renewed[-1])
+
+    def test_unexpected_errors_fail_only_that_request(self):
+        # 限速器抛出的错误在原先的 try 之外，会让抓取协程静默退出、work_queue.join() 一直等待
+        acquire = mock.AsyncMock(side_effect=[RuntimeError("limiter broke"), None, None])
+        with mock.patch.object(self.pool.workers[0].limiter, "acquire", acquire):
+            done = self.run_queue(lambda session, request, archive: [request.tag[1][0]])
+        self.assertEqual(sorted((year, ok) for year, ok, _ in done), [(1990, False), (1991, True), (1992, True)])
+
+    def test_a_crashed_writer_is_surfaced(self):
+        def broken_on_done(request, ok):
+            raise ConnectionError("job table unreachable")
+
+        with mock.patch.object(self.fetcher, "fetch_responses", side_effect=lambda s, request, a: [1]):
+            with self.assertRaises(RuntimeError) as raised:
+                asyncio.run(asyncio.wait_for(self.fetcher.run_fetch_queue(
+                    self.requests, concurrency=1, on_done=broken_on_done, pool=self.pool), timeout=5))
+        self.assertIn("db-writer", str(raised.exception))
+        self.assertIsInstance(raised.exception.__cause__, ConnectionError)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+import numpy as np
+
+import grid_cells
+from grid_cells import CELL_UNIQUE_INDEX, CellIndex, check_hourly_cells, migrate_hourly_cells
+from hourly_batch import HourlyBatch
+from stubs import StubConnection, StubCursor
+
+
+class TestCellIndex(unittest.TestCase):
+    def setUp(self):
+        # id, 请求坐标, Open-Meteo 吸附后的坐标, 海拔
+        self.cells = [
+            (1, 36.0, 115.0, 36.017, 114.984, 40.0),
+            (2, 36.5, 115.0, 36.509, 115.015, 38.0),
+        ]
+        self.conn = StubConnection(StubCursor(answers=[("FROM grid_cell", self.cells)]))
+        self.index = CellIndex()
+
+    def test_request_and_canonical_coordinates_match_exactly(self):
+        self.assertEqual(self.index.lookup(self.conn, 36.0, 115.0), 1)
+        self.assertEqual(self.index.lookup(self.conn, 36.509, 115.015), 2)
+        # 缓存命中不再访问数据库
+        self.assertEqual(len(self.conn.cur.statements), 1)
+
+    def test_nearby_coordinates_pick_the_nearest_cell_only(self):
+        # 36.3 同时落在两个单元的 ±0.3 框内，范围框查询会把两个网格都匹配进来
+        self.assertEqual(self.index.lookup(self.conn, 36.3, 115.0, tolerance=0.3), 2)
+        self.assertEqual(self.index.lookup(self.conn, 36.05, 115.01), 1)
+        self.assertIsNone(self.index.lookup(self.conn, 40.0, 120.0))
+
+    def test_unknown_coordinates_trigger_one_refresh(self):
+        self.index.lookup(self.conn, 36.0, 115.0)
+        self.cells.append((3, 37.0, 115.0, 37.0, 115.0, 35.0))
+        self.assertEqual(self.index.lookup(self.conn, 37.0, 115.0), 3)
+        self.assertEqual(len(self.conn.cur.statements), 2)
+
+    def test_resolve_maps_every_row_by_rounded_request_point(self):
+        self.index.refresh(self.conn)
+        # 36.00000001 与登记的 36.0 只差浮点误差；第三个点由本事务刚登记
+        batch = HourlyBatch(np.array([36.017, 36.509, 37.0]), np.array([114.984, 115.015, 115.0]),
+                            np.array([0, 0, 0], dtype=np.int64), np.zeros((3, 1), dtype=np.float32),
+                            ["temperature"], np.array([36.00000001, 36.5, 37.0]), np.array([115.0, 115.0, 115.0]))
+        ids = self.index.resolve(batch, [(3, 37.0, 115.0, 37.0, 115.0, 35.0)])
+        self.assertEqual(ids.tolist(), [1, 2, 3])
+        with self.assertRaises(ValueError):
+            self.index.resolve(batch)
+
+
+class TestMigration(unittest.TestCase):
+    def legacy_answers(self):
+        return [
+            ("relkind FROM pg_class", []),  # 不是紧凑存储
+            ("is_nullable", [("YES",)]),
+            ("SELECT id, request_latitude", []),  # grid_cell 为空
+            ("SELECT DISTINCT g.latitude", [(36.017, 114.984), (36.02, 114.99), (38.0, 120.0)]),
+            ("min(id), max(id)", [(1, 250)]),
+            ("UPDATE grid_weather_data g SET cell_id", lambda params: [()] * 10),
+            ("count(*) FROM grid_weather_data WHERE cell_id IS NULL", [(0,)]),
+            ("column_name FROM information_schema", [("temperature",), ("precipitation",)]),
+            ("HAVING count(*) > 1 ORDER BY cell_id", [(1,)]),
+            ("DELETE FROM grid_weather_data g USING d", [()] * 3),
+        ]
+
+    def test_batched_migration_merges_collapsed_coordinates_before_the_unique_index(self):
+        cur = StubCursor(answers=self.legacy_answers())
+        conn = StubConnection(cur)
+        inserted = {}
+
+        def fake_execute_values(cur, sql, rows, fetch=False):
+            inserted.setdefault(sql.split()[2], []).append(rows)
+            return [(k + 1, *row[:2], *row[2:], None) for k, row in enumerate(rows)] if fetch else None
+
+        grid = {"latitude": mock.Mock(tolist=lambda: [36.0, 36.5]),
+                "longitude": mock.Mock(tolist=lambda: [115.0, 115.0])}
+        with mock.patch.object(grid_cells, "execute_values", side_effect=fake_execute_values):
+            migrated, removed = migrate_hourly_cells(conn, grid, batch_rows=100)
+
+        # 两个吸附坐标归并到同一请求点，只登记一个单元；远处的坐标自身成为一个单元
+        self.assertEqual(inserted["grid_cell"], [[(36.0, 115.0, 36.017, 114.984), (38.0, 120.0, 38.0, 120.0)]])
+        self.assertEqual(sorted(inserted["grid_cell_migration"][0]),
+                         [(36.017, 114.984, 1), (36.02, 114.99, 1), (38.0, 120.0, 2)])
+        sql = cur.sql
+        updates = [p for s, p in cur.statements if s.startswith("UPDATE grid_weather_data g SET cell_id")]
+        self.assertEqual(updates, [(1, 101), (101, 201), (201, 301)])
+        self.assertEqual((migrated, removed), (30, 3))
+        merge = next(k for k, s in enumerate(sql) if "USING d" in s)
+        index = sql.index(f"CREATE UNIQUE INDEX IF NOT EXISTS {CELL_UNIQUE_INDEX} ON grid_weather_data (cell_id, timestamp);")
+        self.assertLess(merge, index)
+        self.assertIn("COALESCE(g.temperature, d.temperature)", sql[merge])
+        self.assertIn("DROP TABLE IF EXISTS grid_cell_migration;", sql)
+        # 每批单独提交，中断后可以继续
+        self.assertGreaterEqual(conn.commits, 3 + 2)
+
+    def test_migrated_table_is_left_alone(self):
+        cur = StubCursor(answers=[("relkind FROM pg_class", []), ("is_nullable", [("NO",)])])
+        self.assertEqual(migrate_hourly_cells(StubConnection(cur)), (0, 0))
+        self.assertFalse(any("UPDATE" in s for s, _ in cur.statements))
+        check_hourly_cells(cur)
+
+    def test_create_grid_table_refuses_an_unmigrated_table(self):
+        with self.assertRaises(RuntimeError):
+            check_hourly_cells(StubCursor(answers=[("relkind FROM pg_class", []), ("is_nullable", [("YES",)])]))
+
+
+if __name__ == "__main__":
+    unittest.main()
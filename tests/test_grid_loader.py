@@ -0,0 +1,241 @@
+import datetime
+import os
+import re
+import sqlite3
+import struct
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from grid_loader import (BATCH_KEY_COLUMNS, GridWeatherLoader, StagedCopyLoader, batch_to_binary_copy,
+                         rows_to_text_copy)
+from hourly_batch import HourlyBatch
+from ingest_manifest import CREATE_MANIFEST_SQL
+from stubs import StubConnection, StubCursor
+
+
+def parse_binary_copy(data):
+    """按 PostgreSQL 二进制 COPY 格式逐字段解析，仅用于测试。"""
+    assert data[:11] == b"PGCOPY\n\xff\r\n\x00"
+    pos = 19
+    rows = []
+    while True:
+        (nfields,) = struct.unpack_from(">h", data, pos)
+        pos += 2
+        if nfields == -1:
+            break
+        row = []
+        for k in range(nfields):
+            (length,) = struct.unpack_from(">i", data, pos)
+            pos += 4
+            fmt = ">i" if length == 4 else (">q" if k == 2 else ">d")
+            row.append(struct.unpack_from(fmt, data, pos)[0])
+            pos += length
+        rows.append(tuple(row))
+    assert pos == len(data)
+    return rows
+
+
+class TestBinaryCopy(unittest.TestCase):
+    def test_roundtrip_matches_batch_rows(self):
+        values = np.array([[1.5, np.nan], [-3.25, 0.1]], dtype=np.float32)
+        batch = HourlyBatch(np.array([36.02, 36.02]), np.array([115.48, 115.48]),
+                            np.array([631152000, 631155600], dtype=np.int64), values,
+                            ["temperature", "precipitation"],
+                            np.array([36.0, 36.0]), np.array([115.5, 115.5]))
+        parsed = parse_binary_copy(batch_to_binary_copy(batch, np.array([7, 7], dtype=np.int32)))
+        expected = batch.rows()
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(parsed[1][:3], expected[1][:3])
+        self.assertEqual(parsed[1][3:6], (36.0, 115.5, 7))
+        self.assertEqual(parsed[1][6:], expected[1][3:])
+        self.assertEqual(parsed[0][6], expected[0][3])
+        self.assertTrue(np.isnan(parsed[0][7]))
+
+    def test_empty_batch_is_header_and_trailer(self):
+        batch = HourlyBatch.empty(["temperature"])
+        self.assertEqual(parse_binary_copy(batch_to_binary_copy(batch, np.empty(0, dtype=np.int32))), [])
+
+
+class TestTextCopy(unittest.TestCase):
+    def test_none_becomes_null_marker(self):
+        ts = datetime.datetime(2024, 1, 1, 8, 0)
+        buf = rows_to_text_copy([(ts, 1.5, None, 3.0)])
+        self.assertEqual(buf.read(), "2024-01-01 08:00:00\t1.5\t\\N\t3.0\n")
+
+
+class TestMergeSql(unittest.TestCase):
+    def test_existing_rows_only_fill_null_columns_of_the_batch(self):
+        sql = GridWeatherLoader(None).merge_sql(BATCH_KEY_COLUMNS + ["wind_speed_10m"])
+        self.assertIn("wind_speed_10m = COALESCE(grid_weather_data.wind_speed_10m, EXCLUDED.wind_speed_10m)", sql)
+        self.assertIn("WHERE (grid_weather_data.wind_speed_10m IS NULL", sql)
+        self.assertNotIn("temperature", sql)
+        self.assertNotIn("DO NOTHING", sql)
+
+    def test_rows_are_merged_by_the_staged_cell_id(self):
+        sql = GridWeatherLoader(None).merge_sql(BATCH_KEY_COLUMNS + ["temperature"])
+        self.assertIn("s.cell_id, s.latitude, s.longitude, to_timestamp(s.epoch)", sql)
+        self.assertNotIn("JOIN grid_cell c\n", sql)
+        self.assertNotIn("c.request_latitude = s.request_latitude", sql)
+        # 清单在合并之后按目标表重算 (见 TestManifestRefresh)，不在合并语句中
+        self.assertNotIn("grid_ingest_manifest", sql)
+
+
+class TestStagedCopyLoader(unittest.TestCase):
+    def test_subclasses_must_provide_the_merge(self):
+        class NoMerge(StagedCopyLoader):
+            target_table = "t"
+            staging_table = "t_staging"
+
+        with self.assertRaises(TypeError):
+            StagedCopyLoader(None)
+        with self.assertRaises(TypeError):
+            NoMerge(None)
+
+
+class StubCells:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.remembered = None
+
+    def register(self, conn, batch):
+        return [(9, 36.0, 115.5, 36.02, 115.48, 40.0)]
+
+    def resolve(self, batch, registered):
+        if self.fail:
+            raise ValueError("No grid cell registered")
+        return np.full(len(batch), registered[0][0], dtype=np.int32)
+
+    def remember(self, registered):
+        self.remembered = registered
+
+
+class RecordingLoader(GridWeatherLoader):
+    def load_buffer(self, columns, buffer, binary=False, commit=True):
+        self.copied = (columns, parse_binary_copy(buffer))
+        return len(self.copied[1])
+
+
+class TestLoad(unittest.TestCase):
+    def batch(self):
+        return HourlyBatch(np.array([36.02]), np.array([115.48]), np.array([631152000], dtype=np.int64),
+                           np.array([[1.5]], dtype=np.float32), ["temperature"],
+                           np.array([36.0]), np.array([115.5]))
+
+    def test_resolved_cell_ids_are_copied_with_the_rows(self):
+        cells = StubCells()
+        loader = RecordingLoader(StubConnection(), cells=cells)
+        self.assertEqual(loader.load(self.batch()), 1)
+        columns, rows = loader.copied
+        self.assertEqual(columns[columns.index("cell_id")], "cell_id")
+        self.assertEqual(rows[0][columns.index("cell_id")], 9)
+        self.assertEqual(cells.remembered[0][0], 9)
+
+    def test_unresolved_points_fail_the_batch_instead_of_dropping_rows(self):
+        conn = StubConnection()
+        loader = RecordingLoader(conn, cells=StubCells(fail=True))
+        with self.assertRaises(ValueError):
+            loader.load(self.batch())
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertFalse(hasattr(loader, "copied"))
+
+    def test_duplicated_key_in_one_batch_is_merged_once(self):
+        # 两个请求点落入同一单元的同一小时
+        batch = HourlyBatch(np.array([36.02, 36.03]), np.array([115.48, 115.49]),
+                            np.array([631152000, 631152000], dtype=np.int64),
+                            np.array([[1.5], [np.nan]], dtype=np.float32), ["temperature"],
+                            np.array([36.0, 36.1]), np.array([115.5, 115.5]))
+        cur = StubCursor(answers=[("WITH merged AS", [(1,)])])
+        conn = StubConnection(cur)
+        self.assertEqual(GridWeatherLoader(conn, cells=StubCells(), rollups=False).load(batch), 1)
+        copy = next(data for sql, data in cur.statements if sql.startswith("COPY grid_weather_staging"))
+        self.assertEqual([row[5] for row in parse_binary_copy(copy)], [9, 9])
+        merge = next(sql for sql in cur.sql if "WITH merged AS" in sql)
+        self.assertIn("SELECT DISTINCT ON (s.cell_id, s.epoch) s.cell_id", merge)
+        self.assertIn("ORDER BY s.cell_id, s.epoch, num_nonnulls(s.temperature) DESC ON CONFLICT", merge)
+        self.assertEqual((conn.commits, conn.rollbacks), (2, 0))
+
+
+class SqliteLoadCursor:
+    """
+    在 SQLite 中执行 after_merge 的清单重算语句 (会话时区视为 UTC)，只替换 PostgreSQL 特有的写法。
+    不是完整的 PostgreSQL 语义，用来检查计数取自目标表以及年份边界。
+    """
+
+    TRANSLATIONS = [
+        ("extract(year FROM to_timestamp(s.epoch) AT TIME ZONE 'UTC')::int",
+         "CAST(strftime('%Y', s.epoch, 'unixepoch') AS INTEGER)"),
+        ("make_timestamptz(t.year, 1, 1, 0, 0, 0, 'UTC')::timestamp", "printf('%04d-01-01 00:00:00', t.year)"),
+        ("make_timestamptz(t.year + 1, 1, 1, 0, 0, 0, 'UTC')::timestamp",
+         "printf('%04d-01-01 00:00:00', t.year + 1)"),
+        ("pg_backend_pid()", "1"),
+        ("now()", "CURRENT_TIMESTAMP"),
+    ]
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.execute(CREATE_MANIFEST_SQL)
+        self.db.execute("CREATE TABLE grid_cell (id INTEGER, request_latitude FLOAT, request_longitude FLOAT)")
+        self.db.execute("CREATE TABLE grid_weather_data (cell_id INTEGER, timestamp TEXT, temperature FLOAT, "
+                        "PRIMARY KEY (cell_id, timestamp))")
+        self.db.execute("CREATE TABLE grid_weather_staging (load_id INTEGER, cell_id INTEGER, epoch INTEGER, "
+                        "temperature FLOAT)")
+
+    def execute(self, sql, params=None):
+        for pg, lite in self.TRANSLATIONS:
+            sql = sql.replace(pg, lite)
+        sql = re.sub(r"make_date\(([^,]+), 1, 1\)", r"julianday(printf('%04d-01-01', \1))", sql)
+        # LATERAL (VALUES ...) 逆透视 -> 变量名表 + CASE 取值
+        match = re.search(r"CROSS JOIN LATERAL \(VALUES (.*?)\) AS v\(variable, row_count\)", sql)
+        if match:
+            pairs = re.findall(r"\('(\w+)', (n\.\w+)\)", match.group(1))
+            names = " UNION ALL ".join(f"SELECT '{name}' AS variable" for name, _ in pairs)
+            value = "CASE v.variable " + " ".join(f"WHEN '{name}' THEN {col}" for name, col in pairs) + " END"
+            sql = sql[:match.start()] + f"JOIN ({names}) v" + sql[match.end():]
+            sql = sql.replace("v.row_count", value).replace("ON CONFLICT", "WHERE true ON CONFLICT")
+        assert "::" not in sql and "LATERAL" not in sql, sql
+        self.db.execute(sql, params or ())
+
+    def merge(self):
+        """代替合并语句：已存在的行保持不变。"""
+        self.db.execute("INSERT OR IGNORE INTO grid_weather_data "
+                        "SELECT cell_id, datetime(epoch, 'unixepoch'), temperature FROM grid_weather_staging")
+
+
+class TestManifestRefresh(unittest.TestCase):
+    YEAR_1990 = [631152000 + 3600 * h for h in range(8760)]
+
+    def manifest(self, cur):
+        return cur.db.execute("SELECT year, variable, row_count, status FROM grid_ingest_manifest").fetchall()
+
+    def test_refetching_a_partly_stored_year_completes_it(self):
+        cur = SqliteLoadCursor()
+        cur.db.execute("INSERT INTO grid_cell VALUES (1, 36.0, 115.0)")
+        # 之前只入库了 8 个小时
+        cur.db.executemany("INSERT INTO grid_weather_data VALUES (1, datetime(?, 'unixepoch'), 1.0)",
+                           [(t,) for t in self.YEAR_1990[:8]])
+        cur.db.execute("INSERT INTO grid_ingest_manifest (latitude, longitude, year, variable, row_count) "
+                       "VALUES (36.0, 115.0, 1990, 'temperature', 8)")
+        cur.db.executemany("INSERT INTO grid_weather_staging VALUES (1, 1, ?, 2.0)", [(t,) for t in self.YEAR_1990])
+        cur.merge()
+        GridWeatherLoader(None, rollups=False).after_merge(cur, BATCH_KEY_COLUMNS + ["temperature"])
+        self.assertEqual(self.manifest(cur), [(1990, "temperature", 8760, "complete")])
+
+    def test_count_reflects_the_target_table_not_the_batch(self):
+        cur = SqliteLoadCursor()
+        cur.db.execute("INSERT INTO grid_cell VALUES (1, 36.0, 115.0)")
+        # 另一个 UTC 年的行不计入；NULL 值不计数
+        cur.db.executemany("INSERT INTO grid_weather_data VALUES (1, datetime(?, 'unixepoch'), ?)",
+                           [(self.YEAR_1990[0] - 3600, 1.0), (self.YEAR_1990[1], None)])
+        cur.db.executemany("INSERT INTO grid_weather_staging VALUES (1, 1, ?, 2.0)",
+                           [(t,) for t in self.YEAR_1990[2:12]])
+        cur.merge()
+        GridWeatherLoader(None, rollups=False).after_merge(cur, BATCH_KEY_COLUMNS + ["temperature"])
+        self.assertEqual(self.manifest(cur), [(1990, "temperature", 10, "partial")])
+
+
+if __name__ == "__main__":
+    unittest.main()
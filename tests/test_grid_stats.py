@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from grid_loader import BATCH_KEY_COLUMNS, GridWeatherLoader
+from grid_stats import create_stats_table, read_coverage, read_grid_stats, stats_upsert_sql
+from stubs import StubConnection, StubCursor
+
+
+class TestStatsSql(unittest.TestCase):
+    def test_only_inserted_rows_are_counted(self):
+        sql = stats_upsert_sql("merged")
+        self.assertIn("count(*) FILTER (WHERE inserted)", sql)
+        self.assertIn("row_count = grid_stats.row_count + EXCLUDED.row_count", sql)
+        self.assertIn("LEAST(grid_stats.min_timestamp, EXCLUDED.min_timestamp)", sql)
+
+    def test_merge_feeds_the_stats_in_the_same_statement(self):
+        sql = GridWeatherLoader(None).merge_sql(BATCH_KEY_COLUMNS + ["precipitation"])
+        self.assertIn("RETURNING timestamp, (xmax = 0) AS inserted", sql)
+        self.assertIn("INSERT INTO grid_stats", sql)
+        self.assertIn("SELECT count(*), CASE", sql)
+        self.assertTrue(sql.rstrip().endswith("FROM merged;"))
+        # 内层合并语句的分号会截断 CTE
+        self.assertNotIn("EXCLUDED.precipitation IS NOT NULL);", sql)
+
+
+class TestStatsRead(unittest.TestCase):
+    def test_empty_hourly_table_starts_a_baseline(self):
+        cur = StubCursor([None, None])
+        create_stats_table(cur)
+        self.assertIn("INSERT INTO grid_stats (year) VALUES (%s);", cur.sql)
+
+    def test_existing_data_without_baseline_is_not_counted_from_zero(self):
+        cur = StubCursor([None, (1,)])
+        create_stats_table(cur)
+        self.assertFalse(any(s.startswith("INSERT") for s in cur.sql))
+
+    def test_grid_stats_come_from_the_stats_table(self):
+        cur = StubCursor([(450,), (True, 8760, datetime(1990, 1, 1), datetime(1990, 12, 31, 23))])
+        stats = read_grid_stats(StubConnection(cur))
+        self.assertEqual(stats["total_records"], 8760)
+        self.assertEqual(stats["grid_points"], 450)
+        self.assertEqual(stats["source"], "stats")
+        self.assertFalse(any("grid_weather_data" in s for s in cur.sql))
+
+    def test_without_baseline_the_catalog_estimate_is_used(self):
+        cur = StubCursor([(450,), (None, None, None, None), None, (123456,), (1990, 1991)])
+        stats = read_grid_stats(StubConnection(cur))
+        self.assertEqual(stats["source"], "estimate")
+        self.assertEqual(stats["total_records"], 123456)
+        self.assertEqual(stats["min_date"], datetime(1990, 1, 1))
+        self.assertTrue(any("pg_class" in s for s in cur.sql))
+
+    def test_coverage_rows(self):
+        cur = StubCursor([(1,), [(1990, 3942000), (1991, 100)]])
+        self.assertEqual(read_coverage(StubConnection(cur)),
+                         [{"year": 1990, "count": 3942000}, {"year": 1991, "count": 100}])
+
+
+if __name__ == "__main__":
+    unittest.main()
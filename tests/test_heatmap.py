@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+import heatmap
+from heatmap import GridLayout, heatmap_sql, parse_period, read_heatmap
+from stubs import StubConnection, StubCursor
+
+
+class TestPeriod(unittest.TestCase):
+    def test_levels(self):
+        self.assertEqual(parse_period("1991-12"), ("month", date(1991, 12, 1), date(1992, 1, 1)))
+        self.assertEqual(parse_period("1991-02-28"), ("day", date(1991, 2, 28), date(1991, 3, 1)))
+        self.assertEqual(parse_period("1991"), ("year", date(1991, 1, 1), date(1992, 1, 1)))
+        with self.assertRaises(ValueError):
+            parse_period("1991/12")
+
+    def test_yearly_aggregate_follows_the_variable(self):
+        self.assertIn("sum(precipitation_sum)", heatmap_sql("precipitation_sum", "year"))
+        self.assertIn("max(temperature_max)", heatmap_sql("temperature_max", "year"))
+        self.assertIn("FROM grid_daily WHERE day >= %s", heatmap_sql("temperature_mean", "day"))
+        with self.assertRaises(ValueError):
+            heatmap_sql("temperature; DROP TABLE grid_cell", "month")
+
+
+class TestLayout(unittest.TestCase):
+    def test_cells_are_placed_on_the_regular_grid(self):
+        layout = GridLayout([(1, 32.0, 110.0), (2, 32.0, 110.5), (3, 33.0, 110.0), (4, 32.02, 110.49)])
+        self.assertEqual((layout.nlat, layout.nlon), (3, 2))
+        # 站点单元与规则网格点重合时不覆盖规则网格点，但仍算已知单元
+        self.assertEqual(layout.dense([(1, 1.0), (2, 2.0), (3, float("nan")), (4, 9.0)]),
+                         [1.0, 2.0, None, None, None, None])
+        self.assertIn(4, layout)
+
+    def test_new_cells_refresh_the_cached_layout(self):
+        heatmap._layout = GridLayout([(1, 32.0, 110.0)])
+        cur = StubCursor([[(1, 5.0), (2, 6.0)], [(1, 32.0, 110.0), (2, 32.0, 110.5)]])
+        result = read_heatmap(StubConnection(cur), "temperature_mean", "2000-07")
+        self.assertEqual(result["values"], [5.0, 6.0])
+        self.assertEqual(result["nlon"], 2)
+        self.assertEqual(cur.statements[0][1], (date(2000, 7, 1), date(2000, 8, 1)))
+        heatmap._layout = None
+
+
+if __name__ == "__main__":
+    unittest.main()
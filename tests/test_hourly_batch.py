@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from bench_convert import legacy_responses_to_records, make_responses
+from hourly_batch import HOURLY_VARIABLES, HourlyBatch, responses_to_batch
+
+
+class TestResponsesToBatch(unittest.TestCase):
+    def test_matches_legacy_iterrows_conversion(self):
+        responses = make_responses(3, 1)
+        legacy = legacy_responses_to_records(responses)
+        rows = responses_to_batch(responses).rows()
+        self.assertEqual(len(rows), len(legacy))
+        for old, new in zip(legacy[::997], rows[::997]):
+            self.assertEqual(old[:2], new[:2])
+            self.assertEqual(int(old[2].timestamp()), new[2])
+            self.assertEqual(old[3:], new[3:])
+
+    def test_columns_follow_requested_variables(self):
+        batch = responses_to_batch(make_responses(2, 1))
+        self.assertEqual(len(batch.columns), len(HOURLY_VARIABLES))
+        self.assertEqual(batch.columns[0], "temperature")
+        self.assertEqual(batch.values.dtype, np.float32)
+        self.assertEqual(np.diff(batch.epoch[:24]).tolist(), [3600] * 23)
+
+    def test_concat_of_nothing_is_empty(self):
+        batch = HourlyBatch.concat([], ["temperature"])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.rows(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import queue
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from live_events import EventHub, LogFollower, format_event, ingest_notify_sql, merge_ingest
+
+Notify = namedtuple("Notify", "pid channel payload")
+
+
+class StubListenConnection:
+    def __init__(self, payloads):
+        self.notifies = [Notify(1, "grid_ingest", p) for p in payloads]
+
+    def fileno(self):
+        return 0
+
+
+class TestIngestEvents(unittest.TestCase):
+    def test_notify_only_when_rows_were_inserted(self):
+        sql = ingest_notify_sql("merged")
+        self.assertIn("CASE WHEN count(*) FILTER (WHERE inserted) > 0 THEN pg_notify('grid_ingest'", sql)
+        self.assertIn("FROM merged WHERE inserted GROUP BY 1", sql)
+
+    def test_notifications_in_one_cycle_become_one_event(self):
+        event = merge_ingest([
+            {"inserted": 10, "years": {"1990": 10}, "min_timestamp": "1990-05-01T00:00:00",
+             "max_timestamp": "1990-05-01T09:00:00"},
+            {"inserted": 5, "years": {"1990": 2, "1991": 3}, "min_timestamp": "1990-01-01T00:00:00",
+             "max_timestamp": "1991-01-01T02:00:00"},
+        ])
+        self.assertEqual(event["inserted"], 15)
+        self.assertEqual(event["years"], {"1990": 12, "1991": 3})
+        self.assertEqual((event["min_timestamp"], event["max_timestamp"]),
+                         ("1990-01-01T00:00:00", "1991-01-01T02:00:00"))
+
+    def test_poll_drains_pending_notifications(self):
+        conn = StubListenConnection(['{"inserted": 1}', "not json"])
+        with mock.patch("live_events.select.select", return_value=([], [], [])):
+            self.assertEqual(EventHub().poll(conn, timeout=0), [{"inserted": 1}])
+        self.assertEqual(conn.notifies, [])
+
+    def test_slow_subscriber_drops_the_oldest_frame(self):
+        hub = EventHub()
+        q = queue.Queue(maxsize=1)
+        hub._subscribers.add(q)
+        hub.publish("log", {"lines": ["a"]})
+        hub.publish("log", {"lines": ["b"]})
+        self.assertEqual(q.get_nowait(), format_event("log", {"lines": ["b"]}))
+
+
+class TestLogFollower(unittest.TestCase):
+    def test_only_new_complete_lines_are_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fetch.log")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("old line\n")
+            follower = LogFollower(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("first\nsecond\npart")
+            self.assertEqual(follower.read_new_lines(), ["first", "second"])
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("ial\n")
+            self.assertEqual(follower.read_new_lines(), ["partial"])
+            # 截断 / 轮转后从头读
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("new\n")
+            self.assertEqual(follower.read_new_lines(), ["new"])
+
+
+class TestEventsEndpoint(unittest.TestCase):
+    def test_stream_yields_queued_frames(self):
+        import app
+
+        q = queue.Queue()
+        q.put(format_event("ingest", {"inserted": 3}))
+        with mock.patch.object(app.event_hub, "subscribe", return_value=q), \
+                mock.patch.object(app.event_hub, "unsubscribe") as unsubscribe:
+            response = app.app.test_client().get("/api/events")
+            chunks = iter(response.response)
+            self.assertEqual(next(chunks), b"retry: 5000\n\n")
+            frame = next(chunks).decode("utf-8")
+            response.close()
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(json.loads(frame.split("data: ")[1]), {"inserted": 3})
+        unsubscribe.assert_called_once_with(q)
+
+
+if __name__ == "__main__":
+    unittest.main()
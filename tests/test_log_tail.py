@@ -0,0 +1,122 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from logging.handlers import WatchedFileHandler
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+import log_tail
+from log_tail import follow, parse_cursor, read_since, tail
+
+
+def write(path, text, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
+
+class TestLogTail(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "batch_fetch.log")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_tail_reads_backwards_across_blocks(self):
+        write(self.path, "".join(f"line {k}\n" for k in range(100)) + "partial")
+        with mock.patch.object(log_tail, "TAIL_BLOCK", 16):
+            lines, cursor = tail(self.path, 3)
+        self.assertEqual(lines, ["line 97", "line 98", "line 99"])
+        # 游标停在未写完的行之前
+        self.assertEqual(parse_cursor(cursor)[1], os.path.getsize(self.path) - len("partial"))
+        self.assertEqual(tail(os.path.join(self.tmp.name, "missing.log")), ([], None))
+
+    def test_cursor_returns_only_new_lines(self):
+        write(self.path, "a\nb\n")
+        _, cursor = tail(self.path)
+        self.assertEqual(read_since(self.path, cursor), ([], cursor))
+        write(self.path, "c\nd")
+        lines, cursor = read_since(self.path, cursor)
+        self.assertEqual(lines, ["c"])
+        write(self.path, "\n")
+        self.assertEqual(read_since(self.path, cursor)[0], ["d"])
+
+    def test_rotation_finishes_the_old_file_first(self):
+        write(self.path, "old 1\n")
+        _, cursor = tail(self.path)
+        write(self.path, "old 2\n")
+        os.replace(self.path, self.path + ".1")
+        write(self.path, "new 1\n")
+        lines, cursor = read_since(self.path, cursor)
+        self.assertEqual(lines, ["old 2", "new 1"])
+        self.assertEqual(parse_cursor(cursor), (os.stat(self.path).st_ino, len("new 1\n")))
+
+    def test_truncated_file_is_read_from_the_start(self):
+        write(self.path, "long old line\n")
+        _, cursor = tail(self.path)
+        write(self.path, "new\n", mode="w")
+        self.assertEqual(read_since(self.path, cursor)[0], ["new"])
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            parse_cursor("12")
+
+    def test_follow_starts_with_the_tail(self):
+        write(self.path, "a\nb\nc\n")
+        stream = follow(self.path, n=2, poll_seconds=0)
+        self.assertEqual(next(stream)[0], ["b", "c"])
+        write(self.path, "d\n")
+        self.assertEqual(next(stream)[0], ["d"])
+        self.assertEqual(next(stream)[0], [])
+
+
+class TestSeveralWorkers(unittest.TestCase):
+    def test_workers_sharing_the_log_survive_an_external_rotation(self):
+        # 两个抓取进程各自的 WatchedFileHandler 追加写同一个文件，由 logrotate 改名轮转
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "batch_fetch.log")
+            workers = []
+            for name in ("fetch-1", "fetch-2"):
+                handler = WatchedFileHandler(path, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(name)s %(message)s"))
+                worker = logging.Logger(name)
+                worker.addHandler(handler)
+                workers.append(worker)
+            try:
+                workers[0].info("a")
+                _, cursor = tail(path)
+                workers[1].info("b")
+                os.rename(path, path + ".1")
+                workers[0].info("c")
+                workers[1].info("d")
+                lines, cursor = read_since(path, cursor)
+                more, _ = read_since(path, cursor)
+            finally:
+                for worker in workers:
+                    worker.handlers[0].close()
+        self.assertEqual(lines + more, ["fetch-2 b", "fetch-1 c", "fetch-2 d"])
+
+
+class TestFetchLogEndpoint(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        import app
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "batch_fetch.log")
+            write(path, "first\nsecond\n")
+            client = app.app.test_client()
+            with mock.patch.object(app, "FETCH_LOG", path):
+                first = client.get("/api/fetch_log?lines=1").get_json()
+                write(path, "third\n")
+                more = client.get(f"/api/fetch_log?cursor={first['cursor']}").get_json()
+                bad = client.get("/api/fetch_log?cursor=nope")
+        self.assertEqual(first["log"], "second\n")
+        self.assertEqual(more["log"], "third\n")
+        self.assertEqual(bad.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from parquet_lake import ParquetLake, export_cells, export_year
+from year_partitions import year_bounds
+from stubs import StubConnection, StubCursor
+
+
+def hourly_rows(cell_ids, year, hours):
+    start = datetime(year, 1, 1)
+    return [(cid, start + timedelta(hours=h), float(cid), 0.0, 0.1, 0.3, 50.0, 2.0, 100.0)
+            for cid in cell_ids for h in range(hours)]
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestParquetLake(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        # cell 1 和 70 分属不同的单元块
+        cells = [(1, 36.0, 115.0, 36.01, 115.02, 40.0), (2, 36.5, 115.0, 36.5, 115.0, 41.0),
+                 (70, 40.0, 120.0, 40.0, 120.0, 500.0)]
+        rows = hourly_rows([1, 2, 70], 2000, 48)
+        conn = StubConnection(StubCursor([cells]), StubCursor([rows]))
+        export_cells(conn, self.root)
+        self.n = export_year(conn, "grid_weather_data", 2000, self.root)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_partitions_by_year_and_cell_block(self):
+        self.assertEqual(self.n, 3 * 48)
+        year_dir = os.path.join(self.root, "grid_weather_data", "year=2000")
+        self.assertEqual(sorted(os.listdir(year_dir)), ["cell_block=000", "cell_block=001"])
+        self.assertFalse([d for d in os.listdir(self.root) if d.startswith(".tmp")])
+
+    def test_bbox_and_time_filters(self):
+        lake = ParquetLake(self.root)
+        df = lake.read(bbox=(35.9, 36.6, 114.5, 115.5), start="2000-01-02", columns=["temperature"])
+        self.assertEqual(sorted(df["cell_id"].unique().tolist()), [1, 2])
+        self.assertEqual(len(df), 2 * 24)
+        self.assertEqual(list(df.columns[:3]), ["cell_id", "timestamp", "temperature"])
+
+        df = lake.read(cell_ids=[70], end="2000-01-01T06:00:00")
+        self.assertEqual(len(df), 6)
+        self.assertTrue((df["temperature"] == 70.0).all())
+
+    def test_block_filter_prunes_other_partitions(self):
+        lake = ParquetLake(self.root)
+        fragments = list(lake.dataset("grid_weather_data").get_fragments(
+            filter=lake.build_filter("grid_weather_data", cell_ids=[70])))
+        self.assertEqual(len(fragments), 1)
+        self.assertIn("cell_block=001", fragments[0].path)
+
+    def test_reexport_replaces_the_year(self):
+        conn = StubConnection(StubCursor([hourly_rows([2], 2000, 24)]))
+        export_year(conn, "grid_weather_data", 2000, self.root)
+        self.assertEqual(len(ParquetLake(self.root).read()), 24)
+
+    def test_hourly_years_are_utc_years(self):
+        cur = StubCursor([[]])
+        export_year(StubConnection(cur), "grid_weather_data", 2001, self.root)
+        sql, params = cur.statements[0]
+        self.assertIn("timestamp >= %s::timestamptz::timestamp", sql)
+        self.assertEqual(params, year_bounds(2001))
+        # 汇总表按本地日期汇总，仍按日历年导出
+        cur = StubCursor([[]])
+        export_year(StubConnection(cur), "grid_daily", 2001, self.root)
+        self.assertEqual(cur.statements[0][1], (datetime(2001, 1, 1), datetime(2002, 1, 1)))
+
+    def test_local_new_year_hours_are_read_from_the_previous_utc_year(self):
+        # 本地 2001-01-01 05:00 (UTC+8) 属于 UTC 2000 年的分区
+        late = [(2, datetime(2001, 1, 1, 5), 5.0, 0.0, 0.1, 0.3, 50.0, 2.0, 100.0)]
+        export_year(StubConnection(StubCursor([hourly_rows([2], 2000, 24) + late])), "grid_weather_data", 2000,
+                    self.root)
+        lake = ParquetLake(self.root)
+        self.assertEqual(lake.read(start="2001-01-01")["temperature"].tolist(), [5.0])
+        self.assertEqual(len(lake.read(end="2001-01-01")), 24)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from hourly_batch import HOURLY_VARIABLES, VARIABLE_COLUMNS
+from plan_backfill import coalesce_gaps, parse_columns
+
+ALL_COLUMNS = frozenset(VARIABLE_COLUMNS.values())
+
+
+class TestCoalesceGaps(unittest.TestCase):
+    def test_consecutive_years_with_same_points_become_one_request(self):
+        gaps = {(36.0, 115.0): {y: ALL_COLUMNS for y in range(1990, 1994)},
+                (36.5, 115.0): {y: ALL_COLUMNS for y in range(1990, 1994)}}
+        plan = coalesce_gaps(gaps)
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0].points, [(36.0, 115.0), (36.5, 115.0)])
+        self.assertEqual((plan[0].start_date, plan[0].end_date), (date(1990, 1, 1), date(1993, 12, 31)))
+        self.assertEqual(plan[0].variables, tuple(HOURLY_VARIABLES))
+
+    def test_odd_year_holes_are_not_bridged(self):
+        gaps = {(36.0, 115.0): {1991: ALL_COLUMNS, 1993: ALL_COLUMNS}}
+        plan = coalesce_gaps(gaps)
+        self.assertEqual([r.start_date.year for r in plan], [1991, 1993])
+
+    def test_limits_split_points_and_years(self):
+        points = [(36.0 + 0.5 * k, 115.0) for k in range(25)]
+        gaps = {p: {y: ALL_COLUMNS for y in range(1990, 2002)} for p in points}
+        plan = coalesce_gaps(gaps, max_points=10, max_years=5)
+        # 3 个点组 × 3 个年份段 (5 + 5 + 2)
+        self.assertEqual(len(plan), 9)
+        self.assertTrue(all(len(r.points) <= 10 and r.n_days <= 5 * 366 for r in plan))
+
+    def test_missing_columns_only_request_those_variables(self):
+        gaps = {(36.0, 115.0): {2000: frozenset({"shortwave_radiation", "wind_speed_10m"})}}
+        plan = coalesce_gaps(gaps)
+        self.assertEqual(plan[0].variables, ("wind_speed_10m", "shortwave_radiation"))
+
+    def test_parse_columns_accepts_columns_and_api_variables(self):
+        self.assertEqual(parse_columns("temperature_2m, wind_speed_10m"), ["temperature", "wind_speed_10m"])
+        with self.assertRaises(ValueError):
+            parse_columns("snowfall")
+
+
+if __name__ == "__main__":
+    unittest.main()
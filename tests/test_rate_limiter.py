@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from rate_limiter import RateLimiter, TokenBucket, request_weight
+
+
+class TestRequestWeight(unittest.TestCase):
+    def test_small_request_counts_once_per_point(self):
+        self.assertEqual(request_weight(1, 7, 7), 1.0)
+        self.assertEqual(request_weight(10, 14, 10), 10.0)
+
+    def test_long_ranges_and_many_variables_scale_up(self):
+        self.assertAlmostEqual(request_weight(1, 28, 7), 2.0)
+        self.assertAlmostEqual(request_weight(1, 14, 15), 1.5)
+        self.assertAlmostEqual(request_weight(10, 365, 7), 10 * 365 / 14)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_wait_time_reflects_refill_rate(self):
+        bucket = TokenBucket(60, 60)  # 1 token / s
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(60, now), 0.0)
+        bucket.consume(60)
+        self.assertAlmostEqual(bucket.wait_time(10, now), 10.0)
+        self.assertAlmostEqual(bucket.wait_time(10, now + 4), 6.0)
+
+    def test_oversized_request_waits_for_full_bucket_only(self):
+        bucket = TokenBucket(10, 10)
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(50, now), 0.0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_acquire_consumes_every_window(self):
+        limiter = RateLimiter({"minutely": (100, 60), "daily": (1000, 86400)})
+        limiter.acquire_blocking(40)
+        self.assertAlmostEqual(limiter.buckets["minutely"].tokens, 60, places=0)
+        self.assertAlmostEqual(limiter.buckets["daily"].tokens, 960, places=0)
+
+    def test_tightest_window_decides_wait(self):
+        limiter = RateLimiter({"minutely": (100, 60), "daily": (50, 86400)})
+        self.assertEqual(limiter._try_acquire(50), 0.0)
+        self.assertGreater(limiter._try_acquire(10), 60)
+
+    def test_penalize_blocks_until_reset(self):
+        limiter = RateLimiter({"minutely": (100, 60)})
+        limiter.penalize(30)
+        self.assertGreater(limiter._try_acquire(1), 29)
+        limiter.reset()
+        self.assertEqual(limiter._try_acquire(1), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
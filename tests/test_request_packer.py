@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from hourly_batch import HOURLY_VARIABLES
+from rate_limiter import request_weight
+from request_packer import AdaptiveBudget, pack_runs, points_for, year_spans, years_for
+
+ALL_VARIABLES = tuple(HOURLY_VARIABLES)
+
+
+def covered(requests_list):
+    return sorted((p, y) for r in requests_list for p in r.points
+                  for y in range(r.start_date.year, r.end_date.year + 1))
+
+
+class TestAdaptiveBudget(unittest.TestCase):
+    def test_additive_increase_multiplicative_decrease(self):
+        budget = AdaptiveBudget(initial=200, minimum=20, maximum=500, target_latency=10)
+        budget.on_success(2.0)
+        self.assertEqual(budget.weight, 220)
+        budget.on_success(30.0)
+        self.assertEqual(budget.weight, 165)
+        budget.on_quota_error()
+        self.assertEqual(budget.weight, 82.5)
+
+    def test_bounds(self):
+        budget = AdaptiveBudget(initial=480, minimum=20, maximum=500)
+        for _ in range(5):
+            budget.on_success(0.1)
+        self.assertEqual(budget.weight, 500)
+        for _ in range(20):
+            budget.on_quota_error()
+        self.assertEqual(budget.weight, 20)
+
+
+class TestShapes(unittest.TestCase):
+    def test_ten_point_chunk_gets_two_years_at_full_budget(self):
+        self.assertEqual(years_for(540, 10, 1990, 34, 7), 2)
+        self.assertEqual(years_for(261, 10, 1990, 34, 7), 1)
+
+    def test_more_than_ten_variables_fit_fewer_points(self):
+        self.assertEqual(points_for(270, 50, 2000, 1, 7), 10)
+        # 不超过 10 个变量时按 10 个计费；超过 10 个才会按比例增加
+        self.assertEqual(points_for(270, 50, 2000, 1, 2), 10)
+        self.assertEqual(points_for(270, 50, 2000, 1, 20), 5)
+
+    def test_year_spans(self):
+        self.assertEqual(year_spans([1993, 1990, 1991, 1995, 1996]), [(1990, 1991), (1993, 1993), (1995, 1996)])
+
+
+class TestPackRuns(unittest.TestCase):
+    def test_requests_fit_budget_and_cover_every_point_year_once(self):
+        points = [(36.0 + 0.5 * k, 115.0) for k in range(25)]
+        budget = AdaptiveBudget(initial=300)
+        plan = list(pack_runs([(ALL_VARIABLES, 1990, 2003, points)], budget))
+        self.assertTrue(all(r.weight <= 300 for r in plan))
+        self.assertEqual(covered(plan), sorted((p, y) for p in points for y in range(1990, 2004)))
+        # 比固定的 10 点 × 1 年切分 (3 × 14 = 42 个请求) 更少
+        self.assertLess(len(plan), 42)
+
+    def test_shape_follows_budget_changes(self):
+        points = [(36.0 + 0.5 * k, 115.0) for k in range(20)]
+        budget = AdaptiveBudget(initial=request_weight(10, 366, 7))
+        plan = pack_runs([(ALL_VARIABLES, 2000, 2000, points)], budget)
+        first = next(plan)
+        self.assertEqual(len(first.points), 10)
+        budget.on_quota_error()
+        second = next(plan)
+        self.assertEqual(len(second.points), 5)
+        rest = list(plan)
+        self.assertEqual(covered([first, second] + rest), sorted((p, 2000) for p in points))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import flatbuffers
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from fetch_request import FetchRequest
+from hourly_batch import responses_to_batch
+from response_archive import ResponseArchive, parse_flatbuffers, request_key
+
+
+def build_message(lat, lon, start, values):
+    """按 openmeteo_sdk 的字段槽位手工构建一条带长度前缀的 WeatherApiResponse。"""
+    builder = flatbuffers.Builder(1024)
+    variables = []
+    for column in values:
+        vec = builder.CreateNumpyVector(np.asarray(column, dtype=np.float32))
+        builder.StartObject(14)
+        builder.PrependUOffsetTRelativeSlot(3, vec, 0)
+        variables.append(builder.EndObject())
+    builder.StartVector(4, len(variables), 4)
+    for offset in reversed(variables):
+        builder.PrependUOffsetTRelative(offset)
+    variables_vec = builder.EndVector()
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + 3600 * len(values[0]), 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vec, 0)
+    hourly = builder.EndObject()
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, lat, 0.0)
+    builder.PrependFloat32Slot(1, lon, 0.0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.Finish(builder.EndObject())
+    body = bytes(builder.Output())
+    return len(body).to_bytes(4, "little") + body
+
+
+def make_request():
+    return FetchRequest.for_years([(36.0, 115.5), (36.5, 115.5)], 2000,
+                                  variables=["temperature_2m", "precipitation"])
+
+
+def make_content():
+    return (build_message(36.0, 115.5, 946684800, [[1.0, 2.0, 3.0], [0.0, 0.5, 0.0]])
+            + build_message(36.5, 115.5, 946684800, [[4.0, 5.0, 6.0], [0.1, 0.0, 0.2]]))
+
+
+class TestParseFlatbuffers(unittest.TestCase):
+    def test_messages_feed_hourly_batch(self):
+        request = make_request()
+        batch = responses_to_batch(parse_flatbuffers(make_content()), request.variables, request.points)
+        self.assertEqual(len(batch), 6)
+        self.assertEqual(batch.columns, ("temperature", "precipitation"))
+        self.assertEqual(batch.values[3:, 0].tolist(), [4.0, 5.0, 6.0])
+        self.assertEqual(batch.request_latitude.tolist(), [36.0] * 3 + [36.5] * 3)
+
+
+class TestResponseArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = ResponseArchive(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip_and_replay_entries(self):
+        request, content = make_request(), make_content()
+        self.assertIsNone(self.archive.get(request))
+        self.archive.put(request, content)
+        self.assertTrue(self.archive.contains(request))
+        self.assertEqual(self.archive.get(request), content)
+        self.assertEqual(len(self.archive.load(request)), 2)
+
+        entries = list(self.archive.entries())
+        self.assertEqual(len(entries), 1)
+        replayed, replayed_content = entries[0]
+        self.assertEqual(replayed.points, request.points)
+        self.assertEqual(replayed.variables, request.variables)
+        self.assertEqual(replayed_content, content)
+        self.assertEqual(list(self.archive.entries(start_year=2001)), [])
+
+    def test_key_depends_on_points_dates_and_variable_order(self):
+        base = make_request()
+        self.assertEqual(request_key(base), request_key(make_request()))
+        other_vars = FetchRequest(base.points, base.start_date, base.end_date, tuple(reversed(base.variables)))
+        other_years = FetchRequest.for_years(base.points, 2001, variables=base.variables)
+        self.assertNotEqual(request_key(base), request_key(other_vars))
+        self.assertNotEqual(request_key(base), request_key(other_years))
+
+    def test_corrupt_blob_is_ignored(self):
+        request = make_request()
+        key = self.archive.put(request, make_content())
+        with open(os.path.join(self.tmp.name, key[:2], f"{key}.fb.gz"), "wb") as f:
+            f.write(b"not gzip")
+        self.assertIsNone(self.archive.get(request))
+        self.assertEqual(list(self.archive.entries()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from data_version import BUMP_VERSION_SQL
+from grid_loader import GridWeatherLoader
+from response_cache import ResponseCache
+from stubs import StubCursor
+
+
+class TestEntries(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_entries=2, disk_dir=None)
+        cache.put("/a", 1, b"a", "application/json")
+        cache.put("/b", 1, b"b", "application/json")
+        cache.get("/a", 1)
+        cache.put("/c", 1, b"c", "application/json")
+        self.assertIsNone(cache.get("/b", 1))
+        self.assertEqual(cache.get("/a", 1), (b"a", "application/json"))
+
+    def test_entries_are_bound_to_their_version(self):
+        cache = ResponseCache(disk_dir=None, version_ttl=0)
+        with mock.patch("response_cache.read_version", side_effect=[1, 2]):
+            cache.version(None)
+            cache.put("/a", 1, b"a", "application/json")
+            cache.version(None)
+        self.assertIsNone(cache.get("/a", 1))
+        self.assertIsNone(cache.get("/a", 2))
+
+    def test_disk_store_is_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ResponseCache(disk_dir=tmp).put("/api/grid_stats?", 7, b'{"total_records": 1}', "application/json")
+            other = ResponseCache(disk_dir=tmp)
+            self.assertEqual(other.get("/api/grid_stats?", 7), (b'{"total_records": 1}', "application/json"))
+            self.assertIsNone(other.get("/api/grid_stats?", 8))
+
+    def test_merging_new_rows_bumps_the_version(self):
+        loader = GridWeatherLoader(None, rollups=False)
+        for merged, bumped in ((0, False), (12, True)):
+            loader._merged = merged
+            cur = StubCursor()
+            loader.after_merge(cur, ["latitude", "longitude", "epoch", "request_latitude", "request_longitude",
+                                     "temperature"])
+            self.assertEqual(BUMP_VERSION_SQL in cur.sql, bumped)
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        from flask import Flask, jsonify
+
+        self.cache = ResponseCache(disk_dir=None, version_ttl=0)
+        self.calls = 0
+        app = Flask(__name__)
+
+        @app.route("/stats")
+        @self.cache.cached(lambda: object())
+        def stats():
+            self.calls += 1
+            return jsonify({"calls": self.calls})
+
+        self.client = app.test_client()
+
+    def test_repeated_reads_are_served_from_cache_until_the_version_changes(self):
+        with mock.patch("response_cache.read_version", side_effect=[1, 1, 1, 2]):
+            first = self.client.get("/stats")
+            etag = first.headers["ETag"]
+            self.assertEqual(self.client.get("/stats").get_json(), {"calls": 1})
+            not_modified = self.client.get("/stats", headers={"If-None-Match": etag})
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(self.calls, 1)
+            changed = self.client.get("/stats", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertEqual(self.calls, 2)
+
+    def test_without_version_table_nothing_is_cached(self):
+        with mock.patch("response_cache.read_version", return_value=None):
+            self.client.get("/stats")
+            response = self.client.get("/stats")
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
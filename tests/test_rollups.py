@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from grid_loader import GridWeatherLoader
+from rollups import CREATE_ROLLUPS_SQL, DAILY_AGGREGATES, _daily_sql, _monthly_sql, refresh_rollups, staged_ranges_sql
+from stubs import StubCursor
+
+
+class TestRollupSql(unittest.TestCase):
+    def test_every_aggregate_has_a_column_in_both_tables(self):
+        for name, _, _ in DAILY_AGGREGATES:
+            self.assertEqual(CREATE_ROLLUPS_SQL.count(f"{name} FLOAT"), 2)
+
+    def test_daily_refresh_only_reads_the_touched_ranges(self):
+        sql = _daily_sql(staged_ranges_sql("grid_weather_staging"))
+        self.assertIn("g.cell_id = r.cell_id AND g.timestamp >= r.day_from AND g.timestamp < r.day_to", sql)
+        self.assertIn("WHERE s.load_id = pg_backend_pid()", sql)
+        # NaN 视为缺测
+        self.assertIn("avg(NULLIF(g.temperature, 'NaN'))", sql)
+
+    def test_monthly_refresh_is_built_from_daily_rows(self):
+        sql = _monthly_sql("SELECT 1 AS cell_id, DATE '2000-01-31' AS day_from, DATE '2000-02-02' AS day_to")
+        self.assertIn("JOIN grid_daily d", sql)
+        self.assertIn("sum(d.precipitation_sum)", sql)
+        self.assertNotIn("grid_weather_data", sql)
+
+
+class SqliteRollupCursor:
+    """
+    在 SQLite 中执行 refresh_rollups 的两条语句，只把 PostgreSQL 特有的日期写法换成 SQLite 的等价写法。
+    小时值中的 NaN 以文本 'NaN' 存放：SQLite 会把浮点 NaN 存成 NULL，那样测不出 NULLIF 的作用。
+    """
+
+    TRANSLATIONS = [
+        ("(date_trunc('month', (r.day_to - 1)::timestamp) + interval '1 month')::date",
+         "date(r.day_to, '-1 day', 'start of month', '+1 month')"),
+        ("date_trunc('month', r.day_from::timestamp)::date", "date(r.day_from, 'start of month')"),
+        ("date_trunc('month', d.day::timestamp)::date", "date(d.day, 'start of month')"),
+        ("date_trunc('month', d.day::timestamp)", "date(d.day, 'start of month')"),
+        ("g.timestamp::date", "date(g.timestamp)"),
+    ]
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(CREATE_ROLLUPS_SQL)
+        hourly = sorted({col for _, col, _ in DAILY_AGGREGATES})
+        self.db.execute(f"CREATE TABLE grid_weather_data (cell_id INTEGER, timestamp TEXT, {', '.join(hourly)})")
+
+    def execute(self, sql, params=None):
+        for pg, lite in self.TRANSLATIONS:
+            sql = sql.replace(pg, lite)
+        assert "::" not in sql and "date_trunc" not in sql, sql
+        self.db.execute(sql)
+
+    def rows(self, sql):
+        return self.db.execute(sql).fetchall()
+
+
+class TestRollupAggregation(unittest.TestCase):
+    RANGES = "SELECT 1 AS cell_id, '2000-01-31' AS day_from, '2000-02-02' AS day_to"
+
+    def setUp(self):
+        self.cur = SqliteRollupCursor()
+        # 1 月 1 日的日值来自之前的加载，不在本次刷新范围内；1 月 31 日只有之前部分加载的 3 小时
+        self.cur.db.execute("INSERT INTO grid_daily (cell_id, day, hours, temperature_mean, precipitation_sum) "
+                            "VALUES (1, '2000-01-01', 24, 10.0, 1.0), (1, '2000-01-31', 3, 99.0, 99.0)")
+        hours = [(f"2000-01-31 {h:02d}:00:00", "NaN" if h < 4 else float(h), 0.5) for h in range(24)]
+        # 2 月 1 日是本批的最后一天，只有 6 个小时
+        hours += [(f"2000-02-01 {h:02d}:00:00", -2.0, "NaN" if h == 0 else 1.0) for h in range(6)]
+        self.cur.db.executemany("INSERT INTO grid_weather_data (cell_id, timestamp, temperature, precipitation) "
+                                "VALUES (1, ?, ?, ?)", hours)
+
+    def daily(self):
+        return self.cur.rows("SELECT day, hours, temperature_mean, temperature_min, temperature_max, precipitation_sum "
+                             "FROM grid_daily ORDER BY day")
+
+    def monthly(self):
+        return self.cur.rows("SELECT month, days, hours, temperature_mean, temperature_min, precipitation_sum, "
+                             "water_balance FROM grid_monthly ORDER BY month")
+
+    def test_nan_hours_are_missing_values_and_partial_days_keep_their_hour_count(self):
+        refresh_rollups(self.cur, self.RANGES)
+        self.assertEqual(self.daily(), [
+            ("2000-01-01", 24, 10.0, None, None, 1.0),
+            # NaN 不参与均值和极值，但仍计入小时数
+            ("2000-01-31", 24, sum(range(4, 24)) / 20, 4.0, 23.0, 12.0),
+            ("2000-02-01", 6, -2.0, -2.0, -2.0, 5.0),
+        ])
+        # 月值由全月的日值汇总，包括不在本次刷新范围内的 1 月 1 日；ET0 全为缺测，水分收支为 NULL
+        self.assertEqual(self.monthly(), [
+            ("2000-01-01", 2, 48, (10.0 + 13.5) / 2, 4.0, 13.0, None),
+            ("2000-02-01", 1, 6, -2.0, -2.0, 5.0, None),
+        ])
+
+    def test_refreshing_again_after_the_boundary_day_fills_up_is_idempotent(self):
+        refresh_rollups(self.cur, self.RANGES)
+        self.cur.db.executemany("INSERT INTO grid_weather_data (cell_id, timestamp, temperature, precipitation) "
+                                "VALUES (1, ?, 0.0, 0.0)", [(f"2000-02-01 {h:02d}:00:00",) for h in range(6, 24)])
+        refresh_rollups(self.cur, "SELECT 1 AS cell_id, '2000-02-01' AS day_from, '2000-02-02' AS day_to")
+        refresh_rollups(self.cur, "SELECT 1 AS cell_id, '2000-02-01' AS day_from, '2000-02-02' AS day_to")
+        self.assertEqual(self.daily()[2], ("2000-02-01", 24, -0.5, -2.0, 0.0, 5.0))
+        self.assertEqual(self.monthly()[0][:3], ("2000-01-01", 2, 48))
+        self.assertEqual(self.monthly()[1], ("2000-02-01", 1, 24, -0.5, -2.0, 5.0, None))
+
+
+class TestLoaderHook(unittest.TestCase):
+    def test_rollups_are_refreshed_in_the_merge_transaction(self):
+        cur = StubCursor()
+        GridWeatherLoader(None).after_merge(cur, ["latitude", "longitude", "epoch", "request_latitude",
+                                                  "request_longitude", "cell_id", "temperature"])
+        daily, monthly = cur.sql[-2:]
+        self.assertIn("INSERT INTO grid_daily", daily)
+        self.assertIn("INSERT INTO grid_monthly", monthly)
+        # 单元按暂存的整数 cell_id 确定，不再按浮点坐标关联 grid_cell
+        self.assertIn("GROUP BY s.cell_id", daily)
+        self.assertNotIn("request_latitude", daily)
+
+        cur = StubCursor()
+        GridWeatherLoader(None, rollups=False).after_merge(cur, ["latitude", "longitude", "epoch",
+                                                                 "request_latitude", "request_longitude", "cell_id"])
+        self.assertFalse(any("grid_daily" in s for s in cur.sql))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from series_stream import encode_rows, keyset_sql, parse_time, stream_rows
+
+
+class StubNamedCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = None
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.executed = (sql, params)
+
+    def fetchmany(self, n):
+        batch, self.rows = self.rows[:n], self.rows[n:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class StubConnection:
+    def __init__(self, rows):
+        self.cur = StubNamedCursor(rows)
+        self.cursor_args = None
+
+    def cursor(self, name=None, cursor_factory=None):
+        self.cursor_args = name
+        return self.cur
+
+
+class TestKeysetSql(unittest.TestCase):
+    def test_after_is_exclusive_and_range_is_half_open(self):
+        sql, params = keyset_sql("grid_weather_data", ["timestamp", "temperature"],
+                                 filters=[("cell_id = %s", 7)], after=datetime(2000, 1, 1, 5),
+                                 start=datetime(2000, 1, 1), end=datetime(2001, 1, 1), limit=100)
+        self.assertEqual(sql, "SELECT timestamp, temperature FROM grid_weather_data "
+                              "WHERE cell_id = %s AND timestamp > %s AND timestamp >= %s AND timestamp < %s "
+                              "ORDER BY timestamp ASC LIMIT %s")
+        self.assertEqual(params, [7, datetime(2000, 1, 1, 5), datetime(2000, 1, 1), datetime(2001, 1, 1), 100])
+
+    def test_no_filters_and_no_limit(self):
+        sql, params = keyset_sql("weather_samples", ["timestamp"])
+        self.assertEqual(sql, "SELECT timestamp FROM weather_samples  ORDER BY timestamp ASC")
+        self.assertEqual(params, [])
+
+    def test_bad_time_parameter(self):
+        self.assertIsNone(parse_time("", "after"))
+        with self.assertRaises(ValueError):
+            parse_time("yesterday", "after")
+
+
+class TestEncoding(unittest.TestCase):
+    def test_ndjson_lines(self):
+        rows = [(datetime(2000, 1, 1), 1.5), (datetime(2000, 1, 1, 1), float("nan"))]
+        text = "".join(encode_rows([rows], ["timestamp", "temperature"], "ndjson"))
+        lines = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(lines, [{"timestamp": "2000-01-01T00:00:00", "temperature": 1.5},
+                                 {"timestamp": "2000-01-01T01:00:00", "temperature": None}])
+
+    def test_csv_has_one_header_across_batches(self):
+        batches = [[(datetime(2000, 1, 1), 1.5)], [(datetime(2000, 1, 1, 1), None)]]
+        text = "".join(encode_rows(batches, ["timestamp", "temperature"], "csv"))
+        self.assertEqual(text, "timestamp,temperature\n2000-01-01T00:00:00,1.5\n2000-01-01T01:00:00,\n")
+
+    def test_server_side_cursor_is_read_in_batches(self):
+        conn = StubConnection([(k,) for k in range(5)])
+        batches = list(stream_rows(conn, "SELECT 1", [], fetch_size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertIsNotNone(conn.cursor_args)
+        self.assertTrue(conn.cur.closed)
+
+
+class TestWeatherEndpoint(unittest.TestCase):
+    def setUp(self):
+        import app
+
+        self.app = app
+        self.client = app.app.test_client()
+
+    def test_streams_ndjson_with_keyset_parameters(self):
+        conn = StubConnection([(datetime(2024, 1, 1), 1.0, 50.0, 3.0)])
+        with mock.patch.object(self.app, "get_db_connection", return_value=conn):
+            response = self.client.get("/api/weather?after=2023-12-31T23:00:00&limit=10&format=ndjson")
+            body = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(json.loads(body)["humidity"], 50.0)
+        sql, params = conn.cur.executed
+        self.assertIn("timestamp > %s", sql)
+        self.assertEqual(params, [datetime(2023, 12, 31, 23), 10])
+
+    def test_json_array_stays_the_default(self):
+        rows = [(datetime(2024, 1, 1, h), float(h), 50.0, 3.0) for h in range(3)]
+        conn = StubConnection(rows)
+        with mock.patch.object(self.app, "get_db_connection", return_value=conn), \
+                mock.patch("series_stream.FETCH_SIZE", 2):
+            response = self.client.get("/api/weather")
+            body = response.get_json()
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual([row["temperature"] for row in body], [0.0, 1.0, 2.0])
+        self.assertEqual(body[0]["timestamp"], "2024-01-01T00:00:00")
+
+    def test_accept_header_selects_ndjson_or_csv(self):
+        for accept, mimetype in (("application/x-ndjson", "application/x-ndjson"),
+                                 ("text/csv", "text/csv"),
+                                 ("text/html,*/*;q=0.8", "application/json")):
+            conn = StubConnection([(datetime(2024, 1, 1), 1.0, 50.0, 3.0)])
+            with mock.patch.object(self.app, "get_db_connection", return_value=conn):
+                response = self.client.get("/api/weather", headers={"Accept": accept})
+                response.get_data()
+            self.assertEqual(response.mimetype, mimetype, accept)
+
+    def test_grid_series_json_keeps_the_cell_envelope_and_row_cap(self):
+        conn = StubConnection([(datetime(2024, 1, 1),) + (1.0,) * len(self.app.VARIABLE_COLUMNS)])
+        with mock.patch.object(self.app, "get_db_connection", return_value=conn), \
+                mock.patch.object(self.app, "lookup_cell", return_value=7):
+            body = self.client.get("/api/grid_series?lat=36&lon=115").get_json()
+            default_limit = conn.cur.executed[1][-1]
+            self.client.get("/api/grid_series?lat=36&lon=115&limit=50000").get_data()
+        self.assertEqual(body["cell_id"], 7)
+        self.assertEqual([row["temperature"] for row in body["rows"]], [1.0])
+        self.assertEqual((default_limit, conn.cur.executed[1][-1]), (1000, 10000))
+
+    def test_rejects_unknown_format(self):
+        self.assertEqual(self.client.get("/api/weather?format=xml").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
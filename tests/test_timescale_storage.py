@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+import timescale_storage
+from timescale_storage import ensure_storage, migrate_to_hypertable, timescale_version
+from stubs import StubConnection, StubCursor, import_fetcher
+
+
+def answers(version="2.14.2", hypertable=False, compact=False):
+    return [
+        ("relkind FROM pg_class", [("v",)] if compact else []),
+        ("extversion", [(version,)] if version else []),
+        ("timescaledb_information.hypertables", [(1,)] if hypertable else []),
+        ("is_nullable", [("NO",)]),
+    ]
+
+
+class TestMigration(unittest.TestCase):
+    def test_heap_table_becomes_a_compressed_hypertable(self):
+        cur = StubCursor(answers=answers())
+        migrate_to_hypertable(StubConnection(cur), chunk_interval="1 year", compress_after="30 days")
+        sql = cur.sql
+        # SERIAL 主键不含分块列，先换成普通索引
+        drop = sql.index("ALTER TABLE grid_weather_data DROP CONSTRAINT IF EXISTS grid_weather_data_pkey;")
+        index = sql.index("CREATE INDEX IF NOT EXISTS grid_weather_data_id_idx ON grid_weather_data (id);")
+        create = next(k for k, s in enumerate(sql) if "create_hypertable" in s)
+        self.assertLess(drop, create)
+        self.assertLess(index, create)
+        self.assertIn("migrate_data => true", sql[create])
+        self.assertEqual(cur.statements[create][1], ("grid_weather_data", "1 year"))
+        compress = next(s for s in sql if "timescaledb.compress," in s)
+        self.assertIn("timescaledb.compress_segmentby = 'cell_id'", compress)
+        self.assertIn("timescaledb.compress_orderby = 'timestamp'", compress)
+        policy = next(p for s, p in cur.statements if "add_compression_policy" in s)
+        self.assertEqual(policy, ("grid_weather_data", "30 days"))
+
+    def test_compact_table_keeps_its_keys_and_existing_hypertables_are_not_recreated(self):
+        cur = StubCursor(answers=answers(compact=True))
+        migrate_to_hypertable(StubConnection(cur))
+        sql = cur.sql
+        self.assertFalse(any("DROP CONSTRAINT" in s for s in sql))
+        self.assertEqual(next(p for s, p in cur.statements if "create_hypertable" in s)[0], "grid_weather_compact")
+
+        cur = StubCursor(answers=answers(hypertable=True))
+        migrate_to_hypertable(StubConnection(cur))
+        self.assertFalse(any("create_hypertable" in s for s, _ in cur.statements))
+        # 压缩设置和策略可以重复执行
+        self.assertTrue(any("add_compression_policy" in s for s, _ in cur.statements))
+
+    def test_old_timescaledb_is_refused(self):
+        self.assertEqual(timescale_version(StubCursor(answers=answers(version="2.10.3-dev"))), (2, 10))
+        self.assertIsNone(timescale_version(StubCursor(answers=answers(version=None))))
+        cur = StubCursor(answers=answers(version="2.10.3"))
+        with self.assertRaises(RuntimeError):
+            migrate_to_hypertable(StubConnection(cur))
+        self.assertFalse(any("create_hypertable" in s for s, _ in cur.statements))
+        migrate_to_hypertable(StubConnection(StubCursor(answers=answers(version="2.11.0"))))
+
+
+class TestEnsureStorage(unittest.TestCase):
+    def test_only_converts_when_enabled(self):
+        for storage, converts in (("heap", False), ("partitioned", False), ("timescaledb", True)):
+            cur = StubCursor(answers=answers())
+            with mock.patch.object(timescale_storage, "GRID_STORAGE", storage):
+                ensure_storage(StubConnection(cur))
+            self.assertEqual(any("create_hypertable" in s for s, _ in cur.statements), converts, storage)
+
+        cur = StubCursor(answers=answers(hypertable=True))
+        with mock.patch.object(timescale_storage, "GRID_STORAGE", "timescaledb"):
+            ensure_storage(StubConnection(cur))
+        self.assertFalse(any("timescaledb.compress," in s for s, _ in cur.statements))
+
+    def test_create_grid_table_runs_the_hook(self):
+        batch_fetch_weather = import_fetcher()
+        for storage, converts in (("heap", False), ("timescaledb", True)):
+            cur = StubCursor(answers=answers())
+            with mock.patch.object(timescale_storage, "GRID_STORAGE", storage):
+                batch_fetch_weather.create_grid_table(StubConnection(cur))
+            self.assertEqual(any("create_hypertable" in s for s, _ in cur.statements), converts, storage)
+
+
+if __name__ == "__main__":
+    unittest.main()
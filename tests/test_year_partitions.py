@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "data_processing"))
+
+from year_partitions import _create_partitioned, truncate_year, year_bounds, year_counts_sql, year_range_sql
+from stubs import StubConnection, StubCursor
+
+
+class TestYearPartitions(unittest.TestCase):
+    def test_year_bounds_are_half_open_utc_years(self):
+        self.assertEqual(year_bounds(1991), (datetime(1991, 1, 1, tzinfo=timezone.utc),
+                                             datetime(1992, 1, 1, tzinfo=timezone.utc)))
+        # 参数是 UTC 时刻，在 SQL 中换算为 timestamp 列使用的会话本地时间
+        self.assertEqual(year_range_sql(), "timestamp >= %s::timestamptz::timestamp "
+                                           "AND timestamp < %s::timestamptz::timestamp")
+
+    def test_year_counts_use_sargable_utc_ranges(self):
+        sql = year_counts_sql("count(*) AS count")
+        self.assertNotIn("extract", sql.lower())
+        self.assertIn("timestamp >= make_timestamptz(y.year, 1, 1, 0, 0, 0, 'UTC')::timestamp", sql)
+        self.assertIn("timestamp < make_timestamptz(y.year + 1, 1, 1, 0, 0, 0, 'UTC')::timestamp", sql)
+        self.assertIn("FROM grid_weather_data", sql)
+
+    def test_partitioned_table_has_one_partition_per_year_and_a_brin_index(self):
+        cur = StubCursor()
+        _create_partitioned(cur, "grid_weather_data", "grid_weather_data_unpartitioned", range(1990, 1993))
+        sql = "\n".join(cur.sql)
+        self.assertIn("PARTITION BY RANGE (timestamp)", sql)
+        for year in (1990, 1991, 1992):
+            self.assertIn(f"grid_weather_data_y{year} PARTITION OF grid_weather_data", sql)
+        self.assertIn("grid_weather_data_default PARTITION OF grid_weather_data DEFAULT", sql)
+        # 加载器的 ON CONFLICT (cell_id, timestamp) 依赖这个唯一索引
+        self.assertIn("CREATE UNIQUE INDEX grid_weather_data_cell_id_timestamp_key ON grid_weather_data "
+                      "(cell_id, timestamp)", sql)
+        self.assertIn("USING brin (cell_id, timestamp)", sql)
+        params = [p for s, p in cur.statements if "_y1991 " in s][0]
+        self.assertEqual(params, year_bounds(1991))
+
+    # Asia/Shanghai 会话下 UTC 1991 年对应的本地时间范围
+    SHANGHAI_1991 = (datetime(1991, 1, 1, 8), datetime(1992, 1, 1, 8))
+
+    def test_truncate_year_resets_manifest_rollups_and_jobs(self):
+        # grid_weather_data 是分区表 (非紧凑视图)，该年分区按 UTC 年建立
+        bound = "FOR VALUES FROM ('1991-01-01 08:00:00') TO ('1992-01-01 08:00:00')"
+        cur = StubCursor([("p",), ("r",), self.SHANGHAI_1991, (bound,)])
+        conn = StubConnection(cur)
+        truncate_year(conn, 1991)
+        sql = cur.sql
+        self.assertIn("TRUNCATE grid_weather_data_y1991;", sql)
+        self.assertFalse(any(s.startswith("DELETE FROM grid_weather_data") for s in sql))
+        self.assertTrue(any(s.startswith("DELETE FROM grid_ingest_manifest") for s in sql))
+        self.assertTrue(any(s.startswith("UPDATE fetch_jobs SET status = 'pending'") for s in sql))
+        self.assertEqual(conn.commits, 1)
+
+    def test_truncate_year_keeps_neighbouring_utc_years_in_a_non_utc_zone(self):
+        # 旧版本按本地年份建立的分区含有 UTC 1990 年最后 8 小时，不能整个 TRUNCATE
+        bound = "FOR VALUES FROM ('1991-01-01 00:00:00') TO ('1992-01-01 00:00:00')"
+        cur = StubCursor([("p",), ("r",), self.SHANGHAI_1991, (bound,)])
+        truncate_year(StubConnection(cur), 1991)
+        statements = dict(cur.statements)
+        self.assertNotIn("TRUNCATE grid_weather_data_y1991;", statements)
+        delete = f"DELETE FROM grid_weather_data WHERE {year_range_sql()};"
+        self.assertEqual(statements[delete], year_bounds(1991))
+        # 本地 1991-01-01 和 1992-01-01 两天都含有被删的小时，删除后按剩余小时重算
+        daily = [p for s, p in cur.statements if s.startswith("DELETE FROM grid_daily")]
+        self.assertEqual(daily, [(date(1991, 1, 1), date(1992, 1, 2))])
+        monthly = [p for s, p in cur.statements if s.startswith("DELETE FROM grid_monthly")]
+        self.assertEqual(monthly, [(date(1991, 1, 1), date(1992, 2, 1))])
+        self.assertTrue(any("DATE '1991-01-01' AS day_from, DATE '1992-01-02' AS day_to" in s
+                            and s.lstrip().startswith("INSERT INTO grid_daily") for s, _ in cur.statements))
+
+    def test_truncate_year_without_partition_raises(self):
+        cur = StubCursor([("p",), None])
+        with self.assertRaises(ValueError):
+            truncate_year(StubConnection(cur), 2030)
+
+
+if __name__ == "__main__":
+    unittest.main()